@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+准入控制 - 按主机可用内存和 CPU 预算决定构建何时开始，并限制单个构建的资源
+
+每个构建在启动 Gradle (或快速构建) 前申请一张准入票：
+  - CPU：同时运行的构建数不超过 CPU 核数 / ADMISSION_CPUS_PER_BUILD
+  - 内存：已准入构建的预估内存之和不超过 (物理内存 - 保留内存)，
+    且当前 MemAvailable 扣除保留内存后放得下本次构建 (已有构建运行时)
+预算不足时构建在原地等待并通过 SSE 告知用户，等待超过
+ADMISSION_MAX_WAIT_SECONDS 或预估内存超过整机预算时直接拒绝。
+
+单个构建的上限：
+  - 堆内存：每个 daemon 槽位的 -Xmx (GRADLE_DAEMON_HEAP / GRADLE_DAEMON_HEAPS)
+  - 运行时间：BUILD_TIMEOUT_SECONDS，超时结束整个 Gradle 进程组
+  - cgroup / rlimit：仅 --no-daemon 模式。常驻 daemon 由第一个构建的 Gradle
+    客户端派生，会继承该构建的 cgroup 并在构建结束后继续存在，因此 daemon
+    模式下只依靠 -Xmx 和超时限制。配置了可写的 cgroup v2 目录
+    (BUILD_CGROUP_ROOT) 时为每个构建创建子 cgroup 限制 memory.max / cpu.max，
+    否则用 RLIMIT_CPU 限制 CPU 时间。不使用 RLIMIT_AS：JVM 预留的虚拟地址
+    空间远大于堆，限制地址空间会让 JVM 无法启动。
+"""
+
+import os
+import threading
+import uuid
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from build_queue import total_memory_mb
+
+# 是否启用准入控制
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') != '0'
+# 留给系统和 Web 服务的内存 (MB)
+ADMISSION_RESERVE_MB = int(os.environ.get('ADMISSION_RESERVE_MB', '1024'))
+# Gradle 构建堆以外的内存 (客户端 JVM、Kotlin 编译守护进程、aapt2 等)
+ADMISSION_OVERHEAD_MB = int(os.environ.get('ADMISSION_OVERHEAD_MB', '512'))
+# 快速构建 (aapt2 + apksigner) 的预估内存
+ADMISSION_FAST_BUILD_MB = int(os.environ.get('ADMISSION_FAST_BUILD_MB', '512'))
+# 每个构建占用的 CPU 核数
+ADMISSION_CPUS_PER_BUILD = float(os.environ.get('ADMISSION_CPUS_PER_BUILD', '2'))
+# 最长等待时间 (秒)，超过后拒绝
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS', '600'))
+
+# 单个构建的最长运行时间 (秒)
+BUILD_TIMEOUT_SECONDS = float(os.environ.get('BUILD_TIMEOUT_SECONDS', '1800'))
+# 可写的 cgroup v2 目录 (需委派给运行服务的用户)，为空时不使用 cgroup
+BUILD_CGROUP_ROOT = os.environ.get('BUILD_CGROUP_ROOT', '')
+# cgroup 中单个构建的内存上限 (MB)
+BUILD_MEMORY_LIMIT_MB = int(os.environ.get('BUILD_MEMORY_LIMIT_MB', '4096'))
+# cgroup 中单个构建可用的 CPU 核数
+BUILD_CPU_LIMIT = float(os.environ.get('BUILD_CPU_LIMIT', '2'))
+# 未使用 cgroup 时单个构建进程的 CPU 时间上限 (秒)
+BUILD_CPU_SECONDS = int(os.environ.get('BUILD_CPU_SECONDS', '3600'))
+
+
+def available_memory_mb():
+    """读取 MemAvailable (MB)，无法获取时返回 None"""
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+class Ticket:
+    """准入票，构建结束后释放 (可重复调用)"""
+
+    def __init__(self, controller, cost_mb):
+        self.controller = controller
+        self.cost_mb = cost_mb
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """内存和 CPU 预算"""
+
+    def __init__(self, cpus=None, memory_mb=None):
+        cpus = cpus or os.cpu_count() or 1
+        self.cpu_slots = max(1, int(cpus / ADMISSION_CPUS_PER_BUILD))
+        memory_mb = memory_mb or total_memory_mb()
+        self.memory_budget_mb = memory_mb - ADMISSION_RESERVE_MB if memory_mb else None
+        self.running = 0
+        self.reserved_mb = 0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def fits(self, cost_mb):
+        """预估内存是否可能放得下 (超过整机预算的构建永远无法准入)"""
+        return self.memory_budget_mb is None or cost_mb <= self.memory_budget_mb
+
+    def try_admit(self, cost_mb):
+        """尝试准入，返回 (Ticket, None) 或 (None, 原因)"""
+        if not ADMISSION_ENABLED:
+            return Ticket(self, 0), None
+        with self._cond:
+            if self.running >= self.cpu_slots:
+                return None, f'CPU 已满，{self.running} 个构建正在运行'
+            if self.memory_budget_mb is not None and self.reserved_mb + cost_mb > self.memory_budget_mb:
+                return None, f'内存预算已满，已分配 {self.reserved_mb} MB'
+            available = available_memory_mb()
+            if self.running and available is not None and available - ADMISSION_RESERVE_MB < cost_mb:
+                # 没有构建在运行时总是准入一个，避免其他进程占满内存时永远等待
+                return None, f'可用内存不足 ({available} MB)'
+            self.running += 1
+            self.reserved_mb += cost_mb
+            self.admitted += 1
+            return Ticket(self, cost_mb), None
+
+    def wait(self, timeout):
+        """等待有构建结束 (可用内存也可能因其他进程释放而变化，调用方应定期重试)"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def record_wait(self):
+        with self._cond:
+            self.waited += 1
+
+    def record_reject(self):
+        with self._cond:
+            self.rejected += 1
+
+    def _release(self, ticket):
+        if not ADMISSION_ENABLED:
+            return
+        with self._cond:
+            self.running -= 1
+            self.reserved_mb -= ticket.cost_mb
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'enabled': ADMISSION_ENABLED,
+                'cpu_slots': self.cpu_slots,
+                'memory_budget_mb': self.memory_budget_mb,
+                'running': self.running,
+                'reserved_mb': self.reserved_mb,
+                'available_mb': available_memory_mb(),
+                'admitted': self.admitted,
+                'waited': self.waited,
+                'rejected': self.rejected,
+            }
+
+
+def apply_limits(pid):
+    """为 --no-daemon 模式的构建进程设置资源上限
+
+    返回需要在构建结束后清理的 cgroup 目录 (未使用 cgroup 时为 None)。
+    在 Popen 之后调用：Gradle 客户端 JVM 启动需要数百毫秒，之后才会派生
+    实际执行构建的进程，子进程会继承 cgroup 和 rlimit。
+    """
+    if BUILD_CGROUP_ROOT:
+        # 名称中带创建它的进程号，启动清理时不会结束其他仍在运行的构建节点的构建
+        cgroup = Path(BUILD_CGROUP_ROOT) / f'web2apk-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        try:
+            cgroup.mkdir()
+            (cgroup / 'memory.max').write_text(str(BUILD_MEMORY_LIMIT_MB * 1024 * 1024))
+            (cgroup / 'cpu.max').write_text(f'{int(BUILD_CPU_LIMIT * 100000)} 100000')
+            (cgroup / 'cgroup.procs').write_text(str(pid))
+            return cgroup
+        except OSError as e:
+            print(f'[ADMISSION] 无法使用 cgroup {cgroup}: {e}')
+            release_limits(cgroup)
+    if resource is not None and hasattr(resource, 'prlimit'):
+        try:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (BUILD_CPU_SECONDS, BUILD_CPU_SECONDS + 60))
+        except (OSError, ValueError) as e:
+            print(f'[ADMISSION] 无法设置 RLIMIT_CPU: {e}')
+    return None
+
+
+def release_limits(cgroup):
+    """结束 cgroup 中残留的进程并删除 cgroup"""
+    if cgroup is None or not cgroup.exists():
+        return
+    try:
+        kill = cgroup / 'cgroup.kill'
+        if kill.exists():
+            kill.write_text('1')
+        cgroup.rmdir()
+    except OSError:
+        # 进程尚未完全退出时 rmdir 会失败，交给下次启动清理
+        pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def purge_cgroups():
+    """清理已退出的构建节点残留的 cgroup
+
+    平滑重启时旧节点仍在等待运行中的构建结束，它的 cgroup 不能动：只结束
+    创建者进程已不存在的 cgroup，无法判断创建者的 (旧格式名称) 只删除空的。
+    """
+    if not BUILD_CGROUP_ROOT or not os.path.isdir(BUILD_CGROUP_ROOT):
+        return
+    for entry in Path(BUILD_CGROUP_ROOT).glob('web2apk-*'):
+        parts = entry.name.split('-')
+        if len(parts) == 3 and parts[1].isdigit():
+            if not _process_alive(int(parts[1])):
+                release_limits(entry)
+            continue
+        try:
+            entry.rmdir()
+        except OSError:
+            pass
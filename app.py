@@ -6,30 +6,141 @@
 
 import os
 import sys
-import json
 import shutil
 import subprocess
 import uuid
 import re
-import zipfile
 import secrets
 import string
 from pathlib import Path
-from flask import Flask, render_template, request, send_file, Response
-from PIL import Image
+from flask import Flask, render_template, request, Response, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 import time
 
+from build_queue import (BuildQueue, default_worker_count, STATUS_QUEUED, STATUS_RUNNING,
+                         STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELED)
+from gradle_pool import GradleDaemonPool
+import gradle_cache
+import gradle_events
+import fast_build
+from template_fs import materialize, remove_tree, purge_trash
+from template_engine import TemplateSet, Slot, BEFORE, AFTER
+from keystore_pool import KeystorePool
+from cert_fingerprint import get_cert_fingerprints
+import toolchain
+import icon_cache
+import result_cache
+import admission
+import metrics
+import artifacts
+import packaging
+import uploads
+import batch
+import workspaces
+import step_graph
+import node_endpoint
+from progress_broker import SSE_HEARTBEAT_SECONDS, SSE_PING, parse_event_id, sse_message
+from sse_server import AsyncSSEServer, SSE_ASYNC_PORT, public_url as sse_public_url
+
 app = Flask(__name__)
+# DOWNLOAD_X_SENDFILE=1 时下载由 Apache / lighttpd 通过 X-Sendfile 发送
+app.config['USE_X_SENDFILE'] = artifacts.DOWNLOAD_X_SENDFILE
+# 请求体大小上限，超出时在读取表单前返回 413
+app.config['MAX_CONTENT_LENGTH'] = uploads.MAX_UPLOAD_MB * 1024 * 1024
 
 # 配置
 BASE_DIR = Path(__file__).parent.absolute()
 TEMPLATE_DIR = BASE_DIR / 'android-template'
-OUTPUT_DIR = BASE_DIR / 'output'
-UPLOAD_DIR = BASE_DIR / 'uploads'
+# 构建节点分布在多台机器时上传和产物目录需放在共享存储上 (任务数据库见 transport.py)
+OUTPUT_DIR = Path(os.environ.get('OUTPUT_DIR', str(BASE_DIR / 'output')))
+UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', str(BASE_DIR / 'uploads')))
+DATA_DIR = Path(os.environ.get('DATA_DIR', str(BASE_DIR / 'data')))
+# 构建节点状态接口的地址 (见 node_endpoint.py)
+NODE_ADDRESS_FILE = DATA_DIR / 'build-node.json'
 
 # 确保目录存在
-OUTPUT_DIR.mkdir(exist_ok=True)
-UPLOAD_DIR.mkdir(exist_ok=True)
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# 共享 Gradle 用户目录和构建缓存
+gradle_cache.setup()
+gradle_events.setup()
+purge_trash(OUTPUT_DIR)
+workspaces.purge_trash()
+
+# 预编译变体时使用的默认图标
+TEMPLATE_ICON = TEMPLATE_DIR / 'app' / 'src' / 'main' / 'res' / 'mipmap-xxxhdpi' / 'ic_launcher.png'
+
+# build_apk 会原地改写的模板文件，物化模板时需要真实复制 (其余文件硬链接)；
+# gradlew 会被 chmod，硬链接时会改动模板本身的权限
+TEMPLATE_MUTABLE_FILES = [
+    'gradlew',
+    'app/src/main/res/values/strings.xml',
+    'app/src/main/res/values/colors.xml',
+    'app/src/main/res/values/bools.xml',
+]
+
+# 模板引擎插槽 (见 template_engine.py)：锚点是模板原文，启动时编译，锚点失效立即报错
+TEMPLATE_MANIFEST = 'app/src/main/AndroidManifest.xml'
+TEMPLATE_PACKAGE_DIR = 'app/src/main/java/com/webapk/app'
+TEMPLATE_SOURCES = sorted(f'{TEMPLATE_PACKAGE_DIR}/{f.name}' for f in (TEMPLATE_DIR / TEMPLATE_PACKAGE_DIR).glob('*.kt'))
+PACKAGE_DECL = re.compile(r'(?<=^package )com\.webapk\.app$', re.MULTILINE)
+
+
+def _kotlin_method(name):
+    """MainActivity 中 JS 接口方法 (注解到方法结束的右括号)"""
+    return re.compile(r'        @android\.webkit\.JavascriptInterface\n        fun ' + name + r'\(\).*?\n        \}', re.DOTALL)
+
+
+TEMPLATE_SLOTS = {rel_path: [Slot('package', PACKAGE_DECL)] for rel_path in TEMPLATE_SOURCES}
+TEMPLATE_SLOTS.update({
+    'build.gradle': [
+        Slot('plugins', "    id 'com.android.application' version '8.1.0' apply false", AFTER),
+    ],
+    'app/build.gradle': [
+        Slot('package', 'com.webapk.app', count=None),
+        Slot('version_code', 'versionCode 1'),
+        Slot('version_name', 'versionName "1.0"'),
+        Slot('signing_configs', '    buildTypes {', BEFORE),
+        Slot('release_signing', '        release {\n', AFTER),
+        Slot('plugins', "    id 'org.jetbrains.kotlin.android'", AFTER),
+        Slot('dependencies', "    implementation 'androidx.swiperefreshlayout:swiperefreshlayout:1.1.0'", AFTER),
+        Slot('play_services_auth', "    implementation 'com.google.android.gms:play-services-auth:20.7.0'\n"),
+    ],
+    TEMPLATE_MANIFEST: [
+        Slot('package', 'com.webapk.app', count=None),
+        Slot('deep_link_host', 'DEEP_LINK_HOST_PLACEHOLDER', count=None),
+        Slot('main_activity_attrs',
+             'android:configChanges="orientation|screenSize|keyboardHidden|uiMode|smallestScreenSize|screenLayout"', AFTER),
+        Slot('services', '    </application>', BEFORE),
+    ],
+    f'{TEMPLATE_PACKAGE_DIR}/MainActivity.kt': [
+        Slot('package', PACKAGE_DECL),
+        Slot('fullscreen_imports', 'import androidx.core.view.WindowCompat\n', AFTER),
+        Slot('google_launcher_field',
+             '    // Google 登录相关\n    private lateinit var googleSignInLauncher: ActivityResultLauncher<Intent>\n'),
+        Slot('content_padding',
+             '        // 给内容区域添加顶部 padding = 状态栏高度\n'
+             '        val statusBarHeight = getStatusBarHeight()\n'
+             '        swipeRefresh.setPadding(0, statusBarHeight, 0, 0)\n'
+             '        errorView.setPadding(0, statusBarHeight, 0, 0)'),
+        Slot('google_launcher_register', re.compile(
+            r'\n        // Google 登录结果\n        googleSignInLauncher = registerForActivityResult.*?(?=\n\n        // JS 相机)',
+            re.DOTALL)),
+        Slot('splash_status_bar',
+             '        val statusBarColor = getColor(R.color.status_bar_color)\n'
+             '        window.statusBarColor = statusBarColor\n\n'
+             '        val isLightBackground = isColorLight(statusBarColor)\n'
+             '        WindowInsetsControllerCompat(window, window.decorView).isAppearanceLightStatusBars = isLightBackground'),
+        Slot('google_login', re.compile(
+            r'        /\*\*\n         \* 检查 Google 登录是否可用.*?fun loginGoogle\(\) \{.*?\n        \}', re.DOTALL)),
+        Slot('fcm_available', _kotlin_method('isFcmAvailable')),
+        Slot('fcm_token', _kotlin_method('getFcmToken')),
+        Slot('register_push', _kotlin_method('registerPush')),
+    ],
+})
+templates = TemplateSet(TEMPLATE_DIR, TEMPLATE_SLOTS)
 
 # 图标尺寸配置
 ICON_SIZES = {
@@ -40,33 +151,110 @@ ICON_SIZES = {
     'mipmap-xxxhdpi': 192,
 }
 
+# Gradle 守护进程池，槽位数与构建工作线程数一致
+gradle_pool = GradleDaemonPool(default_worker_count())
+
 
 def stream_response(generator):
-    """SSE 流式响应"""
+    """SSE 流式响应
+
+    generator 产出事件 dict、(seq, dict) (带 id，供断线重连) 或 None (心跳)
+    """
     def generate():
-        for data in generator:
-            yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
-    return Response(generate(), mimetype='text/event-stream')
+        try:
+            for item in generator:
+                if item is None:
+                    yield SSE_PING
+                elif isinstance(item, tuple):
+                    yield sse_message(item[1], item[0])
+                else:
+                    yield sse_message(item)
+        finally:
+            # 客户端断开时服务器关闭响应，同时关闭事件源 (用于断开检测)
+            if hasattr(generator, 'close'):
+                generator.close()
+    # 禁止代理缓冲和缓存，否则进度会攒到构建结束才一次性到达
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+
+def send_progress(message, percent, **extra):
+    """发送进度消息，extra 为附加信息 (如步骤开始时间)"""
+    return {'type': 'progress', 'message': message, 'percent': percent, **extra}
+
+
+def send_done(message, **extra):
+    """发送完成消息，extra 为附加信息 (如缓存统计)"""
+    return {'type': 'done', 'message': message, **extra}
+
+
+def send_error(message, reason=None):
+    """发送错误消息，reason 为失败原因分类 (用于指标，默认取出错时所在的步骤)"""
+    if reason is None:
+        return {'type': 'error', 'message': message}
+    return {'type': 'error', 'message': message, 'reason': reason}
 
 
-def send_progress(message, percent):
-    """发送进度消息"""
-    return {'type': 'progress', 'message': message, 'percent': percent}
+def send_canceled(message='构建已取消'):
+    """发送取消消息"""
+    return {'type': 'canceled', 'message': message}
 
 
-def send_done(message):
-    """发送完成消息"""
-    return {'type': 'done', 'message': message}
+def send_success(filename, **extra):
+    """发送成功消息，extra 为附加信息 (如各步骤耗时)"""
+    return {'type': 'success', 'filename': filename, **extra}
 
 
-def send_error(message):
-    """发送错误消息"""
-    return {'type': 'error', 'message': message}
+class StepTimer:
+    """记录构建各步骤的真实耗时
 
+    使用单调时钟，时间为相对构建开始的秒数，随 SSE 消息一起发送。
+    """
 
-def send_success(filename):
-    """发送成功消息"""
-    return {'type': 'success', 'filename': filename}
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.steps = []
+        self._current = None
+        # 并行执行中的步骤 {步骤名: 计时}
+        self._parallel = {}
+
+    def _now(self, at=None):
+        return round((time.monotonic() if at is None else at) - self.origin, 3)
+
+    def start(self, step):
+        """开始一个步骤 (会结束上一个未结束的步骤)，返回附加到进度消息的字段"""
+        if self._current is not None:
+            self.end()
+        self._current = {'step': step, 'started': self._now()}
+        return dict(self._current)
+
+    def end(self):
+        """结束当前步骤，返回附加到完成消息的字段"""
+        if self._current is None:
+            return {}
+        timing = self._current
+        timing['ended'] = self._now()
+        timing['duration'] = round(timing['ended'] - timing['started'], 3)
+        self.steps.append(timing)
+        self._current = None
+        return dict(timing)
+
+    def begin(self, step, at=None):
+        """开始一个与其他步骤并行的步骤 (不影响 start/end 的当前步骤)，at 为单调时钟时间"""
+        timing = self._parallel[step] = {'step': step, 'started': self._now(at)}
+        return dict(timing)
+
+    def finish(self, step, at=None):
+        """结束 begin 开始的步骤"""
+        timing = self._parallel.pop(step)
+        timing['ended'] = self._now(at)
+        timing['duration'] = round(timing['ended'] - timing['started'], 3)
+        self.steps.append(timing)
+        return dict(timing)
+
+    def summary(self):
+        """全部步骤耗时"""
+        return {'total': self._now(), 'steps': list(self.steps)}
 
 
 def validate_package_name(package_name):
@@ -83,18 +271,11 @@ def generate_password(length=16):
 
 def generate_keystore(keystore_path, app_name, store_password, key_password, key_alias='key0'):
     """使用 keytool 生成签名证书"""
-    # 查找 keytool
-    tools_dir = BASE_DIR / 'tools'
-    jdk_dirs = list((tools_dir / 'jdk').glob('jdk-*'))
-
-    if jdk_dirs:
-        keytool = jdk_dirs[0] / 'bin' / ('keytool.exe' if sys.platform == 'win32' else 'keytool')
-    else:
-        keytool = 'keytool'  # 使用系统 PATH 中的 keytool
+    tools = toolchain.get()
 
     # 生成证书
     cmd = [
-        str(keytool),
+        str(tools.keytool or 'keytool'),
         '-genkeypair',
         '-keystore', str(keystore_path),
         '-alias', key_alias,
@@ -107,7 +288,7 @@ def generate_keystore(keystore_path, app_name, store_password, key_password, key
         '-storetype', 'PKCS12'
     ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = subprocess.run(cmd, capture_output=True, text=True, env=tools.env)
     if result.returncode != 0:
         raise Exception(f'生成证书失败: {result.stderr}')
 
@@ -115,29 +296,98 @@ def generate_keystore(keystore_path, app_name, store_password, key_password, key
 
 
 def process_icon(icon_path, build_dir):
-    """处理图标，生成各种尺寸"""
+    """处理图标，生成各种尺寸 (按图标内容缓存，重复图标直接链接)"""
     try:
-        img = Image.open(icon_path)
-        # 转换为 RGBA
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-
-        for folder, size in ICON_SIZES.items():
-            target_dir = build_dir / 'app' / 'src' / 'main' / 'res' / folder
-            target_dir.mkdir(parents=True, exist_ok=True)
+        icon_cache.place_icons(icon_path, build_dir / 'app' / 'src' / 'main' / 'res', ICON_SIZES)
+        return True
+    except Exception as e:
+        return str(e)
 
-            resized = img.resize((size, size), Image.Resampling.LANCZOS)
-            resized.save(target_dir / 'ic_launcher.png', 'PNG')
 
-            # 圆形图标
-            resized.save(target_dir / 'ic_launcher_round.png', 'PNG')
+def wait_for_admission(cost_mb, cancel_event=None):
+    """申请准入票，预算不足时原地等待并产出排队消息 (配合 yield from 使用)
 
+    返回 Ticket；被拒绝或取消时返回 None (已产出对应消息)。
+    """
+    ticket, reason = admission_controller.try_admit(cost_mb)
+    if ticket is not None:
+        return ticket
+    if not admission_controller.fits(cost_mb):
+        admission_controller.record_reject()
+        yield send_error(f'服务器内存不足以执行该构建 (需要约 {cost_mb} MB)', reason='admission')
+        return None
+
+    admission_controller.record_wait()
+    yield send_progress(f'服务器繁忙，等待空闲资源 ({reason})...', 40)
+    deadline = time.monotonic() + admission.ADMISSION_MAX_WAIT_SECONDS
+    while ticket is None:
+        if cancel_event is not None and cancel_event.is_set():
+            yield send_canceled()
+            return None
+        if time.monotonic() > deadline:
+            admission_controller.record_reject()
+            yield send_error('服务器繁忙，等待资源超时，请稍后重试', reason='admission')
+            return None
+        admission_controller.wait(2.0)
+        ticket, reason = admission_controller.try_admit(cost_mb)
+    return ticket
+
+
+def prime_pending(key):
+    """该变体是否正在预编译 (本进程登记的，或队列中由任意节点执行的预编译任务)"""
+    if fast_build.is_priming(key):
         return True
-    except Exception as e:
-        return str(e)
+    return any(params.get('prime_variant') == key for params in build_queue.active_params())
 
 
-def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, screen_orientation='unspecified', fullscreen=False, splash_color='#f8f9fa', version_name='1.0', status_bar_color='#000000', pull_to_refresh=False, google_client_id='', fcm_config_path=None, output_format='apk'):
+def wait_for_prime(key, cancel_event=None):
+    """等待同变体的预编译任务结束 (配合 yield from 使用)
+
+    返回变体是否已可快速构建；取消时返回 None (已产出取消消息)。
+    预编译失败或等待超时返回 False，调用方回退到 Gradle 构建。
+    """
+    yield send_progress('等待预编译代码完成 (批量构建共享)...', 40)
+    deadline = time.monotonic() + batch.BATCH_PRIME_WAIT_SECONDS
+    while prime_pending(key) and time.monotonic() < deadline:
+        if cancel_event is None:
+            time.sleep(2.0)
+        elif cancel_event.wait(2.0):
+            yield send_canceled()
+            return None
+    return fast_build.is_ready(key)
+
+
+def run_steps(graph, labels, timer, cancel_event=None):
+    """执行构建前步骤依赖图并产出各步骤的进度 (配合 yield from 使用)
+
+    labels: {步骤名: (开始消息, 进度百分比, 完成消息)}；与其他步骤并行执行时
+    消息带 parallel 标记，页面按 step 分别显示。
+    返回 {步骤名: 返回值}；步骤失败时抛出其异常 (StepFailed 的消息直接作为
+    错误消息)，取消时返回 None (已产出取消消息)。
+    """
+    events = graph.run(cancel_event)
+    try:
+        while True:
+            try:
+                kind, step, at, parallel = next(events)
+            except StopIteration as stop:
+                results = stop.value
+                break
+            message, percent, done_message = labels[step]
+            extra = {'parallel': True} if parallel else {}
+            if kind == step_graph.STEP_STARTED:
+                yield send_progress(message, percent, **extra, **timer.begin(step, at))
+            else:
+                yield send_done(done_message, **extra, **timer.finish(step, at))
+    finally:
+        # 生成器被关闭时等待运行中的步骤结束
+        events.close()
+    if results is None:
+        yield send_canceled()
+    return results
+
+
+def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, screen_orientation='unspecified', fullscreen=False, splash_color='#f8f9fa', version_name='1.0', status_bar_color='#000000', pull_to_refresh=False, google_client_id='', fcm_config_path=None, output_format='apk', deliverable='zip', prime_variant=None, wait_prime=False, cancel_event=None, profile=None):
     """构建 APK/AAB 的生成器函数
 
     existing_keystore: 可选，用户上传的已有证书信息
@@ -155,9 +405,18 @@ def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, sc
     pull_to_refresh: 是否启用下拉刷新
     fcm_config_path: FCM 配置文件路径 (google-services.json)
     output_format: 输出格式 ('apk' 或 'aab')
+    deliverable: 交付内容，'zip' 为安装包 + 证书 + 说明文件，'package' 只交付安装包 (仅限上传证书)
+    prime_variant: 预编译变体键，仅用于后台预编译任务 (见 fast_build.py)
+    wait_prime: 同变体正在预编译时等待其完成后快速构建，而不是各自执行 Gradle (批量构建)
+    cancel_event: 构建队列传入的取消事件，置位时结束 Gradle 进程组
+    profile: 构建剖析 (见 run_build)，记录构建路径、Gradle 任务耗时和产物大小
     """
     build_id = str(uuid.uuid4())[:8]
     build_dir = OUTPUT_DIR / f'build_{build_id}'
+    profile = profile or metrics.BuildProfile()
+    profile.build_id = build_id
+    if prime_variant:
+        profile.path = 'prime'
 
     # 判断是使用已有证书还是生成新证书
     use_existing = existing_keystore is not None
@@ -170,189 +429,152 @@ def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, sc
         key_password = store_password  # 使用相同密码简化用户操作
         key_alias = 'key0'
 
+    # 生成 versionCode (基于时间戳，确保递增)
+    version_code = int(time.strftime('%Y%m%d%H'))
+
+    timer = StepTimer()
+    ticket = None
+    # Gradle 执行目录：默认是构建目录，更新构建启用增量工作区时是该包的工作区 (见 workspaces.py)
+    project_dir = build_dir
+    workspace = None
+    workspace_ok = False
+
     try:
         # 步骤 1: 验证参数
-        yield send_progress('验证参数...', 5)
-        time.sleep(0.3)
+        yield send_progress('验证参数...', 5, build_id=build_id, **timer.start('validate'))
 
         if not validate_package_name(package_name):
             yield send_error(f'包名格式不正确: {package_name}')
             return
 
-        yield send_done('参数验证通过')
-
-        # 步骤 2: 复制模板项目
-        yield send_progress('复制 Android 模板项目...', 10)
-        time.sleep(0.3)
-
-        if build_dir.exists():
-            shutil.rmtree(build_dir)
-        shutil.copytree(TEMPLATE_DIR, build_dir)
-
-        yield send_done('模板项目复制完成')
-
-        # 步骤 3: 处理图标
-        yield send_progress('处理应用图标...', 15)
-        time.sleep(0.3)
-
-        icon_result = process_icon(icon_path, build_dir)
-        if icon_result is not True:
-            yield send_error(f'图标处理失败: {icon_result}')
-            return
-
-        yield send_done('图标处理完成')
+        yield send_done('参数验证通过', **timer.end())
+
+        # 相同输入 (仅限上传证书的构建) 直接返回已有产物，见 result_cache.py
+        result_key = None
+        if use_existing and not prime_variant and result_cache.RESULT_CACHE_ENABLED:
+            result_key = result_cache.fingerprint(
+                {
+                    'app_name': app_name, 'package_name': package_name, 'url': url,
+                    'screen_orientation': screen_orientation, 'fullscreen': fullscreen,
+                    'splash_color': splash_color, 'version_name': version_name, 'version_code': version_code,
+                    'status_bar_color': status_bar_color, 'pull_to_refresh': pull_to_refresh,
+                    'google_client_id': google_client_id, 'output_format': output_format,
+                    'deliverable': deliverable,
+                    'store_password': store_password, 'key_alias': key_alias, 'key_password': key_password,
+                },
+                {'icon': icon_path, 'keystore': existing_keystore['path'], 'fcm_config': fcm_config_path},
+                fast_build.template_hash(),
+            )
+            safe_name = re.sub(r'[^\w\-]', '_', app_name)
+            artifact_ext = f'.{output_format}' if deliverable == 'package' else '.zip'
+            zip_filename = f'{safe_name}_{build_id}{artifact_ext}'
+            if result_cache.lookup(result_key, OUTPUT_DIR / zip_filename):
+                profile.path = 'cached'
+                profile.record_artifact(output_format if deliverable == 'package' else 'zip', OUTPUT_DIR / zip_filename)
+                yield send_done('相同配置已构建过，直接返回结果', cached=True)
+                yield send_success(zip_filename, build_id=build_id, cached=True, timings=timer.summary())
+                return
 
-        # 步骤 4: 处理签名证书
+        # 步骤 2~5: 复制模板后，处理图标、准备签名证书、修改配置文件互不依赖，
+        # 在线程池中并行执行 (见 step_graph.py)；签名配置等证书准备好后写入
         keystore_path = build_dir / 'release.keystore'
 
-        if use_existing:
-            yield send_progress('使用已有证书...', 20)
-            time.sleep(0.3)
-            # 复制用户上传的证书
-            shutil.copy(existing_keystore['path'], keystore_path)
-            yield send_done('证书已加载')
-        else:
-            yield send_progress('生成签名证书...', 20)
-            time.sleep(0.3)
+        def copy_template():
+            if build_dir.exists():
+                shutil.rmtree(build_dir)
+            materialize(TEMPLATE_DIR, build_dir, TEMPLATE_MUTABLE_FILES)
+
+        def place_icon():
+            icon_result = process_icon(icon_path, build_dir)
+            if icon_result is not True:
+                raise step_graph.StepFailed(f'图标处理失败: {icon_result}')
+
+        def prepare_keystore():
+            """返回 (证书密码, 密钥别名, 密钥密码)"""
+            if use_existing:
+                # 复制用户上传的证书
+                shutil.copy(existing_keystore['path'], keystore_path)
+                return store_password, key_alias, key_password
+            # 优先使用后台预生成的证书
+            pooled = keystore_pool.take(keystore_path)
+            if pooled:
+                return pooled['store_password'], pooled['key_alias'], pooled['key_password']
             try:
                 generate_keystore(keystore_path, app_name, store_password, key_password, key_alias)
             except Exception as e:
-                yield send_error(f'生成证书失败: {str(e)}')
-                return
-            yield send_done('签名证书生成完成')
+                raise step_graph.StepFailed(f'生成证书失败: {str(e)}')
+            return store_password, key_alias, key_password
 
-        # 步骤 5: 修改配置文件
-        yield send_progress('修改应用配置...', 30)
-        time.sleep(0.3)
-
-        # 修改 strings.xml
-        strings_path = build_dir / 'app' / 'src' / 'main' / 'res' / 'values' / 'strings.xml'
-        strings_content = f'''<?xml version="1.0" encoding="utf-8"?>
+        def write_config():
+            # 修改 strings.xml
+            strings_path = build_dir / 'app' / 'src' / 'main' / 'res' / 'values' / 'strings.xml'
+            strings_content = f'''<?xml version="1.0" encoding="utf-8"?>
 <resources>
     <string name="app_name">{app_name}</string>
     <string name="web_url">{url}</string>
     <string name="google_client_id">{google_client_id}</string>
 </resources>
 '''
-        strings_path.write_text(strings_content, encoding='utf-8')
+            strings_path.write_text(strings_content, encoding='utf-8')
 
-        # 修改 colors.xml (启动画面背景色 + 状态栏颜色)
-        colors_path = build_dir / 'app' / 'src' / 'main' / 'res' / 'values' / 'colors.xml'
-        colors_content = f'''<?xml version="1.0" encoding="utf-8"?>
+            # 修改 colors.xml (启动画面背景色 + 状态栏颜色)
+            colors_path = build_dir / 'app' / 'src' / 'main' / 'res' / 'values' / 'colors.xml'
+            colors_content = f'''<?xml version="1.0" encoding="utf-8"?>
 <resources>
     <color name="splash_background">{splash_color}</color>
     <color name="status_bar_color">{status_bar_color}</color>
 </resources>
 '''
-        colors_path.write_text(colors_content, encoding='utf-8')
+            colors_path.write_text(colors_content, encoding='utf-8')
 
-        # 修改 bools.xml (功能开关)
-        bools_path = build_dir / 'app' / 'src' / 'main' / 'res' / 'values' / 'bools.xml'
-        bools_content = f'''<?xml version="1.0" encoding="utf-8"?>
+            # 修改 bools.xml (功能开关)
+            bools_path = build_dir / 'app' / 'src' / 'main' / 'res' / 'values' / 'bools.xml'
+            bools_content = f'''<?xml version="1.0" encoding="utf-8"?>
 <resources>
     <bool name="pull_to_refresh_enabled">{'true' if pull_to_refresh else 'false'}</bool>
     <bool name="follow_system_font_scale">true</bool>
     <bool name="webview_preload">true</bool>
 </resources>
 '''
-        bools_path.write_text(bools_content, encoding='utf-8')
-
-        # 修改 build.gradle 中的包名、版本号和签名配置
-        gradle_path = build_dir / 'app' / 'build.gradle'
-        gradle_content = gradle_path.read_text(encoding='utf-8')
-        gradle_content = gradle_content.replace('com.webapk.app', package_name)
-
-        # 生成 versionCode (基于时间戳，确保递增)
-        version_code = int(time.strftime('%Y%m%d%H'))
-        gradle_content = gradle_content.replace('versionCode 1', f'versionCode {version_code}')
-        gradle_content = gradle_content.replace('versionName "1.0"', f'versionName "{version_name}"')
-
-        # 添加签名配置
-        signing_config = f'''
-    signingConfigs {{
-        release {{
-            storeFile file('../release.keystore')
-            storePassword '{store_password}'
-            keyAlias '{key_alias}'
-            keyPassword '{key_password}'
-        }}
-    }}
-'''
-        # 在 buildTypes 之前插入签名配置
-        gradle_content = gradle_content.replace(
-            '    buildTypes {',
-            signing_config + '    buildTypes {'
-        )
-        # 给 release buildType 添加签名配置
-        gradle_content = gradle_content.replace(
-            'release {\n            minifyEnabled false',
-            'release {\n            signingConfig signingConfigs.release\n            minifyEnabled false'
-        )
-
-        # 处理 FCM 推送配置
-        enable_fcm = fcm_config_path is not None
-        if enable_fcm:
-            # 复制 google-services.json 到 app 目录
-            fcm_dest = build_dir / 'app' / 'google-services.json'
-            shutil.copy(fcm_config_path, fcm_dest)
-
-            # 修改 project-level build.gradle 添加 google-services 插件
-            project_gradle_path = build_dir / 'build.gradle'
-            project_gradle_content = project_gradle_path.read_text(encoding='utf-8')
-            if "id 'com.google.gms.google-services'" not in project_gradle_content:
-                project_gradle_content = project_gradle_content.replace(
-                    "id 'com.android.application' version '8.1.0' apply false",
-                    "id 'com.android.application' version '8.1.0' apply false\n    id 'com.google.gms.google-services' version '4.4.0' apply false"
-                )
-                project_gradle_path.write_text(project_gradle_content, encoding='utf-8')
-
-            # 修改 app-level build.gradle 添加 FCM 依赖
-            gradle_content = gradle_content.replace(
-                "id 'org.jetbrains.kotlin.android'",
-                "id 'org.jetbrains.kotlin.android'\n    id 'com.google.gms.google-services'"
-            )
-            # 添加 Firebase BOM 和 FCM 依赖
-            gradle_content = gradle_content.replace(
-                "implementation 'androidx.swiperefreshlayout:swiperefreshlayout:1.1.0'",
-                "implementation 'androidx.swiperefreshlayout:swiperefreshlayout:1.1.0'\n\n    // Firebase\n    implementation platform('com.google.firebase:firebase-bom:32.7.0')\n    implementation 'com.google.firebase:firebase-messaging-ktx'"
-            )
-        else:
-            # 移除 FCM Service 文件
-            fcm_service_path = build_dir / 'app' / 'src' / 'main' / 'java' / 'com' / 'webapk' / 'app' / 'FCMService.kt'
-            if fcm_service_path.exists():
-                fcm_service_path.unlink()
-
-        # 动态替换 FCM JS 接口
-        main_kt_path = build_dir / 'app' / 'src' / 'main' / 'java' / 'com' / 'webapk' / 'app' / 'MainActivity.kt'
-        main_kt_content = main_kt_path.read_text(encoding='utf-8')
-
-        if enable_fcm:
-            # 替换 isFcmAvailable 方法
-            main_kt_content = main_kt_content.replace(
-                '''        @android.webkit.JavascriptInterface
-        fun isFcmAvailable(): Boolean {
-            // FCM_ENABLED_PLACEHOLDER - 由构建时动态替换
-            return false
-        }''',
-                '''        @android.webkit.JavascriptInterface
+            bools_path.write_text(bools_content, encoding='utf-8')
+
+            # 各模板文件的插槽值 (插槽定义见 TEMPLATE_SLOTS)，未提供的插槽保留模板原文
+            # build.gradle 中的包名和版本号 (签名配置在证书准备好后写入)
+            project_gradle_values = {}
+            app_gradle_values = {
+                'package': package_name,
+                'version_code': f'versionCode {version_code}',
+                'version_name': f'versionName "{version_name}"',
+            }
+            main_activity_values = {'package': package_name}
+
+            # 从 URL 中提取 Deep Link 域名
+            from urllib.parse import urlparse
+            parsed_url = urlparse(url)
+            deep_link_host = parsed_url.netloc or parsed_url.path.split('/')[0]
+            manifest_values = {'package': package_name, 'deep_link_host': deep_link_host}
+
+            # 处理 FCM 推送配置
+            enable_fcm = fcm_config_path is not None
+            if enable_fcm:
+                # 复制 google-services.json 到 app 目录
+                fcm_dest = build_dir / 'app' / 'google-services.json'
+                shutil.copy(fcm_config_path, fcm_dest)
+
+                # project-level build.gradle 添加 google-services 插件
+                project_gradle_values['plugins'] = "\n    id 'com.google.gms.google-services' version '4.4.0' apply false"
+
+                # app-level build.gradle 添加插件和 Firebase BOM、FCM 依赖
+                app_gradle_values['plugins'] = "\n    id 'com.google.gms.google-services'"
+                app_gradle_values['dependencies'] = "\n\n    // Firebase\n    implementation platform('com.google.firebase:firebase-bom:32.7.0')\n    implementation 'com.google.firebase:firebase-messaging-ktx'"
+
+                # 替换 FCM JS 接口
+                main_activity_values['fcm_available'] = '''        @android.webkit.JavascriptInterface
         fun isFcmAvailable(): Boolean {
             return com.google.android.gms.common.GoogleApiAvailability.getInstance()
                 .isGooglePlayServicesAvailable(context) == com.google.android.gms.common.ConnectionResult.SUCCESS
         }'''
-            )
-
-            # 替换 getFcmToken 方法
-            main_kt_content = main_kt_content.replace(
-                '''        @android.webkit.JavascriptInterface
-        fun getFcmToken() {
-            this@MainActivity.runOnUiThread {
-                webView.evaluateJavascript(
-                    "if(typeof onFcmError==='function'){onFcmError('未启用 FCM 推送功能')}",
-                    null
-                )
-            }
-        }''',
-                '''        @android.webkit.JavascriptInterface
+                main_activity_values['fcm_token'] = '''        @android.webkit.JavascriptInterface
         fun getFcmToken() {
             com.google.firebase.messaging.FirebaseMessaging.getInstance().token
                 .addOnSuccessListener { token ->
@@ -374,20 +596,7 @@ def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, sc
                     }
                 }
         }'''
-            )
-
-            # 替换 registerPush 方法
-            main_kt_content = main_kt_content.replace(
-                '''        @android.webkit.JavascriptInterface
-        fun registerPush() {
-            this@MainActivity.runOnUiThread {
-                webView.evaluateJavascript(
-                    "if(typeof onPushRegistered==='function'){onPushRegistered(false,'')}",
-                    null
-                )
-            }
-        }''',
-                '''        @android.webkit.JavascriptInterface
+                main_activity_values['register_push'] = '''        @android.webkit.JavascriptInterface
         fun registerPush() {
             com.google.firebase.messaging.FirebaseMessaging.getInstance().token
                 .addOnSuccessListener { token ->
@@ -408,237 +617,280 @@ def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, sc
                     }
                 }
         }'''
-            )
-
-        main_kt_path.write_text(main_kt_content, encoding='utf-8')
-
-        # 动态注入 Google 登录依赖（只有填写了 Client ID 才添加）
-        if not google_client_id:
-            # 移除 Google Play Services Auth 依赖，减少 APK 体积
-            gradle_content = gradle_content.replace(
-                "    implementation 'com.google.android.gms:play-services-auth:20.7.0'\n", 
-                ""
-            )
-            
-            # 同时移除 MainActivity.kt 中的 Google 登录相关代码
-            main_kt_path = build_dir / 'app' / 'src' / 'main' / 'java' / 'com' / 'webapk' / 'app' / 'MainActivity.kt'
-            main_kt_content = main_kt_path.read_text(encoding='utf-8')
-            
-            # 移除 googleSignInLauncher 声明
-            main_kt_content = main_kt_content.replace(
-                "    // Google 登录相关\n    private lateinit var googleSignInLauncher: ActivityResultLauncher<Intent>\n",
-                ""
-            )
-            
-            # 移除 googleSignInLauncher 注册代码（匹配到下一个注释之前）
-            main_kt_content = re.sub(
-                r'\n        // Google 登录结果\n        googleSignInLauncher = registerForActivityResult.*?(?=\n\n        // JS 相机)',
-                '',
-                main_kt_content,
-                flags=re.DOTALL
-            )
-            
-            # 替换 Google 登录方法为空实现
-            main_kt_content = re.sub(
-                r'        /\*\*\n         \* 检查 Google 登录是否可用.*?fun loginGoogle\(\) \{.*?\n        \}',
-                '''        @android.webkit.JavascriptInterface
-        fun isGoogleLoginAvailable(): Boolean = false
-
-        @android.webkit.JavascriptInterface
-        fun loginGoogle() {
-            this@MainActivity.runOnUiThread {
-                webView.evaluateJavascript("if(typeof onGoogleLoginError==='function'){onGoogleLoginError(-1,'未启用 Google 登录功能')}", null)
-            }
-        }''',
-                main_kt_content,
-                flags=re.DOTALL
-            )
-            
-            main_kt_path.write_text(main_kt_content, encoding='utf-8')
-
-        gradle_path.write_text(gradle_content, encoding='utf-8')
-
-        # 修改 AndroidManifest.xml 中的包名和屏幕方向
-        manifest_path = build_dir / 'app' / 'src' / 'main' / 'AndroidManifest.xml'
-        manifest_content = manifest_path.read_text(encoding='utf-8')
-        manifest_content = manifest_content.replace('com.webapk.app', package_name)
-
-        # 替换 Deep Link host（从 URL 中提取域名）
-        from urllib.parse import urlparse
-        parsed_url = urlparse(url)
-        deep_link_host = parsed_url.netloc or parsed_url.path.split('/')[0]
-        manifest_content = manifest_content.replace('DEEP_LINK_HOST_PLACEHOLDER', deep_link_host)
-
-        # 添加屏幕方向设置
-        if screen_orientation != 'unspecified':
-            manifest_content = manifest_content.replace(
-                'android:configChanges="orientation|screenSize|keyboardHidden|uiMode"',
-                f'android:configChanges="orientation|screenSize|keyboardHidden|uiMode"\n            android:screenOrientation="{screen_orientation}"'
-            )
 
-        # 添加 FCM Service 注册
-        if enable_fcm:
-            fcm_service_declaration = '''
-        <!-- FCM 推送服务 -->
+                # 注册 FCM Service
+                manifest_values['services'] = '''        <!-- FCM 推送服务 -->
         <service
             android:name=".FCMService"
             android:exported="false">
             <intent-filter>
                 <action android:name="com.google.firebase.MESSAGING_EVENT" />
             </intent-filter>
-        </service>'''
-            manifest_content = manifest_content.replace(
-                '</application>',
-                fcm_service_declaration + '\n    </application>'
-            )
+        </service>
+'''
 
-        manifest_path.write_text(manifest_content, encoding='utf-8')
+            # 只有填写了 Client ID 才保留 Google 登录
+            if not google_client_id:
+                # 移除 Google Play Services Auth 依赖，减少 APK 体积
+                app_gradle_values['play_services_auth'] = ''
+                # 移除 MainActivity.kt 中的 Google 登录相关代码，登录方法替换为空实现
+                main_activity_values['google_launcher_field'] = ''
+                main_activity_values['google_launcher_register'] = ''
+                main_activity_values['google_login'] = '''        @android.webkit.JavascriptInterface
+        fun isGoogleLoginAvailable(): Boolean = false
 
-        # 重命名包目录
-        old_package_dir = build_dir / 'app' / 'src' / 'main' / 'java' / 'com' / 'webapk' / 'app'
-        new_package_parts = package_name.split('.')
-        new_package_dir = build_dir / 'app' / 'src' / 'main' / 'java' / '/'.join(new_package_parts)
-        new_package_dir.parent.mkdir(parents=True, exist_ok=True)
+        @android.webkit.JavascriptInterface
+        fun loginGoogle() {
+            this@MainActivity.runOnUiThread {
+                webView.evaluateJavascript("if(typeof onGoogleLoginError==='function'){onGoogleLoginError(-1,'未启用 Google 登录功能')}", null)
+            }
+        }'''
 
-        # 移动 MainActivity.kt 和其他文件
-        if old_package_dir.exists():
-            for f in old_package_dir.glob('*'):
-                if f.is_dir():
-                    # 如果是目录（如 wxapi），直接复制
-                    shutil.copytree(f, new_package_dir / f.name, dirs_exist_ok=True)
-                    continue
+            # 屏幕方向设置在 MainActivity 上
+            if screen_orientation != 'unspecified':
+                manifest_values['main_activity_attrs'] = f'\n            android:screenOrientation="{screen_orientation}"'
 
-                content = f.read_text(encoding='utf-8')
-                content = content.replace('package com.webapk.app', f'package {package_name}')
-
-                # 如果启用全屏模式，修改为沉浸式（隐藏系统栏）
-                if fullscreen and f.name == 'MainActivity.kt':
-                    # 添加额外导入
-                    content = content.replace(
-                        'import androidx.core.view.WindowCompat',
-                        'import androidx.core.view.WindowCompat\nimport androidx.core.view.WindowInsetsCompat\nimport androidx.core.view.WindowInsetsControllerCompat'
-                    )
-                    # 替换 hideSplashScreen 中只改颜色的逻辑为隐藏系统栏
-                    content = content.replace(
-                        '// 只改状态栏颜色，不改布局（避免跳动）\n        window.statusBarColor = Color.BLACK',
-                        '''// 全屏模式：隐藏系统栏
+            # 全屏模式：修改为沉浸式（隐藏系统栏）
+            if fullscreen:
+                main_activity_values['fullscreen_imports'] = 'import androidx.core.view.WindowInsetsCompat\n'
+                # 隐藏启动画面时隐藏系统栏，而不是设置状态栏颜色
+                main_activity_values['splash_status_bar'] = '''        // 全屏模式：隐藏系统栏
         WindowInsetsControllerCompat(window, window.decorView).let { controller ->
             controller.hide(WindowInsetsCompat.Type.systemBars())
             controller.systemBarsBehavior = WindowInsetsControllerCompat.BEHAVIOR_SHOW_TRANSIENT_BARS_BY_SWIPE
         }'''
-                    )
-                    # 全屏模式不需要给内容区域添加 padding
-                    content = content.replace(
-                        '''// 给内容区域添加顶部 padding = 状态栏高度
-        val statusBarHeight = getStatusBarHeight()
-        swipeRefresh.setPadding(0, statusBarHeight, 0, 0)
-        errorView.setPadding(0, statusBarHeight, 0, 0)''',
-                        '// 全屏模式：不需要 padding'
-                    )
-
-                new_file = new_package_dir / f.name
-                new_package_dir.mkdir(parents=True, exist_ok=True)
-                new_file.write_text(content, encoding='utf-8')
-
-            # 删除旧目录
-            shutil.rmtree(build_dir / 'app' / 'src' / 'main' / 'java' / 'com' / 'webapk')
-
-        yield send_done('配置修改完成')
-
-        # 步骤 6: 执行 Gradle 构建
-        format_label = output_format.upper()
-        yield send_progress(f'开始编译 {format_label} (这可能需要几分钟)...', 40)
+                # 全屏模式不需要给内容区域添加 padding
+                main_activity_values['content_padding'] = '        // 全屏模式：不需要 padding'
+
+            templates.render_to('build.gradle', build_dir / 'build.gradle', project_gradle_values)
+            templates.render_to(TEMPLATE_MANIFEST, build_dir / TEMPLATE_MANIFEST, manifest_values)
+
+            # 源码渲染到新的包目录 (先删除旧目录，包名以 com.webapk 开头时也不会误删新目录)
+            java_dir = build_dir / 'app' / 'src' / 'main' / 'java'
+            old_package_dir = build_dir / TEMPLATE_PACKAGE_DIR
+            new_package_dir = java_dir.joinpath(*package_name.split('.'))
+            shutil.rmtree(old_package_dir)
+            for parent in (old_package_dir.parent, old_package_dir.parent.parent):
+                try:
+                    parent.rmdir()  # 删除空的 com/webapk、com
+                except OSError:
+                    break
+            for d in (TEMPLATE_DIR / TEMPLATE_PACKAGE_DIR).iterdir():
+                if d.is_dir():
+                    # 子目录 (如 wxapi) 原样复制
+                    shutil.copytree(d, new_package_dir / d.name, dirs_exist_ok=True)
+
+            for rel_path in TEMPLATE_SOURCES:
+                filename = rel_path.rsplit('/', 1)[1]
+                # 不启用 FCM 时不包含 FCM Service
+                if filename == 'FCMService.kt' and not enable_fcm:
+                    continue
+                values = main_activity_values if filename == 'MainActivity.kt' else {'package': package_name}
+                templates.render_to(rel_path, new_package_dir / filename, values)
 
-        # 设置 Gradle 环境
-        gradle_wrapper = build_dir / 'gradlew.bat' if sys.platform == 'win32' else build_dir / 'gradlew'
+            return {'enable_fcm': enable_fcm, 'deep_link_host': deep_link_host, 'app_gradle_values': app_gradle_values}
 
-        if sys.platform != 'win32':
-            os.chmod(gradle_wrapper, 0o755)
+        def write_signing(keystore, config):
+            signing_store_password, signing_key_alias, signing_key_password = keystore
+            signing_config = f'''
+    signingConfigs {{
+        release {{
+            storeFile file('../release.keystore')
+            storePassword '{signing_store_password}'
+            keyAlias '{signing_key_alias}'
+            keyPassword '{signing_key_password}'
+        }}
+    }}
+'''
+            # 在 buildTypes 之前插入签名配置，并给 release buildType 添加签名配置
+            app_gradle_values = dict(config['app_gradle_values'],
+                                     signing_configs=signing_config,
+                                     release_signing='            signingConfig signingConfigs.release\n')
+            templates.render_to('app/build.gradle', build_dir / 'app' / 'build.gradle', app_gradle_values)
+
+        graph = step_graph.StepGraph()
+        graph.add('template', copy_template)
+        graph.add('icon', place_icon, after=('template',))
+        graph.add('keystore', prepare_keystore, after=('template',))
+        graph.add('config', write_config, after=('template',))
+        graph.add('signing', write_signing, after=('keystore', 'config'))
+        step_labels = {
+            'template': ('复制 Android 模板项目...', 10, '模板项目复制完成'),
+            'icon': ('处理应用图标...', 15, '图标处理完成'),
+            'keystore': ('使用已有证书...', 20, '证书已加载') if use_existing
+                        else ('生成签名证书...', 20, '签名证书生成完成'),
+            'config': ('修改应用配置...', 25, '配置修改完成'),
+            'signing': ('写入签名配置...', 30, '签名配置完成'),
+        }
+        try:
+            prebuild = yield from run_steps(graph, step_labels, timer, cancel_event)
+        except step_graph.StepFailed as e:
+            yield send_error(str(e), reason=e.step)
+            return
+        if prebuild is None:
+            return
+        store_password, key_alias, key_password = prebuild['keystore']
+        enable_fcm = prebuild['config']['enable_fcm']
+        deep_link_host = prebuild['config']['deep_link_host']
 
-        # 执行构建 - 根据格式选择不同命令
-        env = os.environ.copy()
+        # 步骤 6: 编译 (优先复用预编译变体，否则执行 Gradle 构建)
+        format_label = output_format.upper()
 
-        # 自动检测并设置环境变量
-        tools_dir = BASE_DIR / 'tools'
-        jdk_dirs = list((tools_dir / 'jdk').glob('jdk-*'))
-        if jdk_dirs:
-            env['JAVA_HOME'] = str(jdk_dirs[0])
-        if (tools_dir / 'android-sdk').exists():
-            env['ANDROID_HOME'] = str(tools_dir / 'android-sdk')
-            env['ANDROID_SDK_ROOT'] = str(tools_dir / 'android-sdk')
+        # 构建环境 (启动时解析好的工具链)
+        tools = toolchain.get()
+        env = tools.env
 
         # 打印环境变量用于调试
         print(f"[DEBUG] JAVA_HOME: {env.get('JAVA_HOME', 'NOT SET')}")
         print(f"[DEBUG] ANDROID_HOME: {env.get('ANDROID_HOME', 'NOT SET')}")
         print(f"[DEBUG] Output format: {output_format}")
 
-        # 根据输出格式选择构建任务
-        build_task = 'bundleRelease' if output_format == 'aab' else 'assembleRelease'
-
-        process = subprocess.Popen(
-            [str(gradle_wrapper), 'clean', build_task, '--no-daemon'],
-            cwd=str(build_dir),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            env=env
-        )
-
-        build_progress = 40
-        build_output = []
-        for line in iter(process.stdout.readline, ''):
-            line = line.strip()
-            if line:
-                build_output.append(line)
-                print(f"[GRADLE] {line}")  # 在终端显示
-                # 解析构建进度
-                if 'CONFIGURING' in line.upper():
-                    build_progress = 50
-                    yield send_progress('配置项目...', build_progress)
-                elif 'COMPILING' in line.upper() or 'COMPILE' in line.upper():
-                    build_progress = min(build_progress + 5, 70)
-                    yield send_progress('编译源码...', build_progress)
-                elif 'PROCESSING' in line.upper():
-                    build_progress = min(build_progress + 3, 80)
-                    yield send_progress('处理资源...', build_progress)
-                elif 'PACKAGING' in line.upper() or 'PACKAGE' in line.upper() or 'BUNDLE' in line.upper():
-                    build_progress = 85
-                    yield send_progress(f'打包 {format_label}...', build_progress)
-                elif 'BUILD SUCCESSFUL' in line.upper():
-                    build_progress = 95
-                    yield send_progress('构建成功!', build_progress)
-
-        process.wait()
-
-        if process.returncode != 0:
-            # 获取最后几行错误信息
-            error_lines = [l for l in build_output if 'error' in l.lower() or 'failed' in l.lower()]
-            error_msg = error_lines[-1] if error_lines else '未知错误'
-            print(f"[ERROR] Build failed: {error_msg}")
-            yield send_error(f'Gradle 构建失败: {error_msg}')
+        fast_variant = None if prime_variant else fast_build.variant_key(enable_fcm, fullscreen, bool(google_client_id), output_format)
+        fast_done = False
+        if wait_prime and fast_variant and prime_pending(fast_variant):
+            if (yield from wait_for_prime(fast_variant, cancel_event)) is None:
+                return
+        if fast_build.is_ready(fast_variant):
+            ticket = yield from wait_for_admission(admission.ADMISSION_FAST_BUILD_MB, cancel_event)
+            if ticket is None:
+                return
+            yield send_progress(f'快速打包 {format_label} (复用预编译代码)...', 40, **timer.start('fast_build'))
+            try:
+                fast_build.build(fast_variant, build_dir, package_name, version_code, version_name, screen_orientation,
+                                 deep_link_host, keystore_path, store_password, key_alias, key_password, env=env)
+                fast_done = True
+                profile.path = 'fast'
+                yield send_done(f'{format_label} 快速打包完成', **timer.end())
+            except Exception as e:
+                timer.end()
+                profile.record_fast_fallback(fast_variant, e)
+                print(f"[FAST] 快速构建失败，回退到 Gradle: {e}")
+            ticket.release()
+        elif fast_variant and not prime_pending(fast_variant) and fast_build.claim_prime(fast_variant):
+            # 后台预编译该变体，之后同变体的构建走快速路径
+            build_queue.submit(fast_build.prime_params(fast_variant, TEMPLATE_ICON))
+
+        if not fast_done and use_existing and not prime_variant and workspaces.WORKSPACE_ENABLED:
+            workspace = workspaces.acquire(package_name, fast_build.template_hash())
+            if workspace is not None:
+                changes = workspace.sync(build_dir)
+                project_dir = workspace.path
+                profile.path = 'incremental'
+                print(f"[WORKSPACE] {package_name}: {'复用' if workspace.reused else '新建'}工作区，"
+                      f"写入 {changes['written']} 个文件，未变 {changes['unchanged']} 个，删除 {changes['removed']} 个")
+
+        if not fast_done:
+            yield send_progress(f'开始编译 {format_label} (这可能需要几分钟)...', 40, **timer.start('gradle'))
+
+            gradle_wrapper = project_dir / 'gradlew.bat' if sys.platform == 'win32' else project_dir / 'gradlew'
+            if sys.platform != 'win32':
+                os.chmod(gradle_wrapper, 0o755)
+
+            # 根据输出格式选择构建任务
+            build_task = 'bundleRelease' if output_format == 'aab' else 'assembleRelease'
+
+            # 模板是全新复制的 (或增量工作区只写入了变化的文件)，无需 clean；使用守护进程池中的常驻 Gradle daemon
+            with gradle_pool.lease() as daemon:
+                # 按主机内存和 CPU 预算准入，预算不足时排队等待
+                ticket = yield from wait_for_admission(daemon.memory_cost_mb(admission.ADMISSION_OVERHEAD_MB), cancel_event)
+                if ticket is None:
+                    return
+
+                # 进度按 init 脚本输出的任务事件计算，完整输出写入构建日志
+                progress = gradle_events.GradleProgress(start_percent=40, end_percent=95)
+                cache_stats = gradle_cache.CacheStats()
+                build_log = gradle_events.BuildLog(build_id)
+                process = subprocess.Popen(
+                    [str(gradle_wrapper), build_task] + daemon.gradle_args() + gradle_cache.gradle_args() + gradle_events.gradle_args(),
+                    cwd=str(project_dir),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1,
+                    env=env,
+                    **gradle_pool.process_group_kwargs()
+                )
+                # 取消或超时时结束整个 Gradle 进程组；--no-daemon 模式下另加 cgroup/rlimit 上限
+                timed_out = gradle_pool.kill_on_cancel(process, cancel_event, admission.BUILD_TIMEOUT_SECONDS)
+                cgroup = None if gradle_pool.GRADLE_USE_DAEMON else admission.apply_limits(process.pid)
+
+                try:
+                    for line in iter(process.stdout.readline, ''):
+                        line = line.rstrip()
+                        if line:
+                            build_log.write(line)
+                            daemon.check_output(line)
+                            cache_stats.feed(line)
+                            update = progress.feed(line)
+                            if update:
+                                yield send_progress(*update)
+
+                    process.wait()
+                finally:
+                    # 生成器被关闭 (任务取消) 时结束仍在运行的 Gradle
+                    build_log.close()
+                    gradle_pool.kill_process_tree(process)
+                    admission.release_limits(cgroup)
+                    ticket.release()
+                profile.record_gradle(progress.tasks, cache_stats.as_dict(), progress.failed_task)
+
+                if cancel_event is not None and cancel_event.is_set():
+                    yield send_canceled()
+                    return
+                if timed_out.is_set():
+                    yield send_error(f'构建超时 (超过 {admission.BUILD_TIMEOUT_SECONDS:.0f} 秒)，已终止', reason='timeout')
+                    return
+
+                if process.returncode != 0:
+                    error_msg = progress.error_message()
+                    print(f"[ERROR] Build {build_id} failed: {error_msg} (日志: {build_log.path})")
+                    yield send_error(f'Gradle 构建失败: {error_msg}')
+                    return
+
+            build_cache = cache_stats.record()
+            gradle_cache.schedule_eviction()
+            yield send_done(f'{format_label} 编译完成 (缓存命中 {build_cache["from_cache"]} 个任务)',
+                            cache=build_cache, slowest_tasks=progress.slowest(), **timer.end())
+
+        if prime_variant:
+            # 预编译任务：保存变体产物，不生成下载文件
+            fast_build.capture(prime_variant, build_dir)
+            remove_tree(build_dir)
+            timer.end()
+            yield send_success('', timings=timer.summary())
             return
 
-        yield send_done(f'{format_label} 编译完成')
-
         # 步骤 7: 打包输出文件 + 证书 + 说明文件为 ZIP
-        yield send_progress('打包下载文件...', 98)
-        time.sleep(0.3)
+        yield send_progress('打包下载文件...', 98, **timer.start('package'))
 
         # 根据格式查找输出文件
         if output_format == 'aab':
-            output_source = build_dir / 'app' / 'build' / 'outputs' / 'bundle' / 'release' / 'app-release.aab'
+            output_source = project_dir / 'app' / 'build' / 'outputs' / 'bundle' / 'release' / 'app-release.aab'
             output_ext = '.aab'
         else:
-            output_source = build_dir / 'app' / 'build' / 'outputs' / 'apk' / 'release' / 'app-release.apk'
+            output_source = project_dir / 'app' / 'build' / 'outputs' / 'apk' / 'release' / 'app-release.apk'
             output_ext = '.apk'
 
         if not output_source.exists():
             yield send_error(f'{format_label} 文件未找到，构建可能失败')
             return
+        profile.record_artifact(output_format, output_source)
 
         # 使用应用名作为文件名
         safe_name = re.sub(r'[^\w\-]', '_', app_name)
+
+        if deliverable == 'package':
+            # 只交付安装包：用户已持有上传的证书，不需要证书和说明文件
+            package_filename = f'{safe_name}_{build_id}{output_ext}'
+            package_path = OUTPUT_DIR / package_filename
+            packaging.place_file(output_source, package_path, copy=workspace is not None)
+            remove_tree(build_dir)
+            workspace_ok = workspace is not None
+            result_cache.store(result_key, package_path)
+            timer.end()
+            yield send_success(package_filename, build_id=build_id, timings=timer.summary())
+            return
+
         zip_filename = f'{safe_name}_{build_id}.zip'
         zip_path = OUTPUT_DIR / zip_filename
 
@@ -661,34 +913,8 @@ def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, sc
 生成时间: {time.strftime("%Y-%m-%d %H:%M:%S")}
 '''
 
-        # 获取证书指纹用于 App Links 和 Google 登录
-        def get_cert_fingerprints(keystore_path, store_password, key_alias):
-            """使用 keytool 获取证书 SHA1 和 SHA256 指纹"""
-            tools_dir = BASE_DIR / 'tools'
-            jdk_dirs = list((tools_dir / 'jdk').glob('jdk-*'))
-            if jdk_dirs:
-                keytool = jdk_dirs[0] / 'bin' / ('keytool.exe' if sys.platform == 'win32' else 'keytool')
-            else:
-                keytool = 'keytool'
-            
-            cmd = [
-                str(keytool), '-list', '-v',
-                '-keystore', str(keystore_path),
-                '-alias', key_alias,
-                '-storepass', store_password
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            # 从输出中提取指纹
-            sha1 = ''
-            sha256 = ''
-            for line in result.stdout.split('\n'):
-                if 'SHA1:' in line.upper():
-                    sha1 = line.split(':', 1)[1].strip() if ':' in line else ''
-                elif 'SHA256:' in line.upper():
-                    sha256 = line.split(':', 1)[1].strip() if ':' in line else ''
-            return sha1 or 'NOT_FOUND', sha256 or 'NOT_FOUND'
-
-        sha1_fingerprint, sha256_fingerprint = get_cert_fingerprints(keystore_path, store_password, key_alias)
+        # 获取证书指纹用于 App Links 和 Google 登录 (PKCS12 在进程内解析，JKS 回退到 keytool)
+        sha1_fingerprint, sha256_fingerprint = get_cert_fingerprints(keystore_path, store_password, key_alias, tools.keytool or 'keytool', env)
         cert_fingerprint = sha256_fingerprint  # 兼容之前的变量名
 
         # 创建 assetlinks.json 内容
@@ -729,22 +955,23 @@ def build_apk(app_name, package_name, url, icon_path, existing_keystore=None, sc
 生成时间: {time.strftime("%Y-%m-%d %H:%M:%S")}
 '''
 
-        # 创建 ZIP 文件
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            # 添加 APK/AAB
-            zf.write(output_source, f'{safe_name}{output_ext}')
-            # 添加证书
-            zf.write(keystore_path, 'release.keystore')
-            # 添加说明文件
-            zf.writestr('证书信息-请妥善保管.txt', readme_content)
-            # 添加 App Links 配置文件
-            zf.writestr('.well-known/assetlinks.json', assetlinks_content)
-            # 添加 App Links 部署说明
-            zf.writestr('链接直达功能配置指南.txt', applinks_guide)
-
-            # 添加 Google 登录配置说明（如果填写了 Client ID）
-            if google_client_id:
-                google_guide = f'''===== {app_name} Google 登录配置指南 =====
+        # 打包成员：已压缩的安装包和证书原样存储，只压缩文本 (见 packaging.py)
+        members = [
+            # APK/AAB
+            (f'{safe_name}{output_ext}', output_source),
+            # 证书
+            ('release.keystore', keystore_path),
+            # 说明文件
+            ('证书信息-请妥善保管.txt', readme_content),
+            # App Links 配置文件
+            ('.well-known/assetlinks.json', assetlinks_content),
+            # App Links 部署说明
+            ('链接直达功能配置指南.txt', applinks_guide),
+        ]
+
+        # 添加 Google 登录配置说明（如果填写了 Client ID）
+        if google_client_id:
+            google_guide = f'''===== {app_name} Google 登录配置指南 =====
 
 【配置状态】
 ✅ 已配置 Google Client ID
@@ -766,10 +993,10 @@ SHA-1 证书指纹: {sha1_fingerprint}
 
 生成时间: {time.strftime("%Y-%m-%d %H:%M:%S")}
 '''
-                zf.writestr('Google登录配置指南.txt', google_guide)
-            else:
-                # 没配置也给一个说明
-                google_guide = f'''===== {app_name} Google 登录配置说明 =====
+            members.append(('Google登录配置指南.txt', google_guide))
+        else:
+            # 没配置也给一个说明
+            google_guide = f'''===== {app_name} Google 登录配置说明 =====
 
 【当前状态】
 ⚠️ 未配置 Google Client ID（打包时未填写）
@@ -785,32 +1012,156 @@ SHA-1 证书指纹: {sha1_fingerprint}
 【注意】
 此功能仅海外设备可用，国内设备因无 Google 服务无法使用。
 '''
-                zf.writestr('Google登录配置说明.txt', google_guide)
+            members.append(('Google登录配置说明.txt', google_guide))
+
+        packaging.write_zip(zip_path, members)
+
+        profile.record_artifact('zip', zip_path)
 
         # 清理构建目录
-        shutil.rmtree(build_dir)
+        remove_tree(build_dir)
+        workspace_ok = workspace is not None
+        result_cache.store(result_key, zip_path)
 
-        yield send_success(zip_filename)
+        timer.end()
+        yield send_success(zip_filename, build_id=build_id, timings=timer.summary())
 
     except Exception as e:
         yield send_error(f'构建过程出错: {str(e)}')
-        # 清理
+    finally:
+        if ticket is not None:
+            ticket.release()
+        # 清理 (出错、取消或生成器被关闭时构建目录仍在)
         if build_dir.exists():
             try:
-                shutil.rmtree(build_dir)
+                remove_tree(build_dir)
             except:
                 pass
+        if prime_variant:
+            fast_build.release_prime(prime_variant)
+        if workspace is not None:
+            # 失败或取消的工作区可能处于中间状态，直接删除
+            workspace.release(workspace_ok)
+            if workspace_ok:
+                build_queue.set_affinity(workspaces.affinity_key(package_name))
+
+
+def run_build(cancel_event=None, **params):
+    """构建任务入口：执行 build_apk，从进度事件中记录构建剖析和指标"""
+    profile = metrics.BuildProfile(
+        output_format=params.get('output_format', 'apk'),
+        fcm=bool(params.get('fcm_config_path')),
+        google_login=bool(params.get('google_client_id')),
+        fullscreen=bool(params.get('fullscreen')),
+        uploaded_keystore=params.get('existing_keystore') is not None,
+    )
+    metrics.BUILDS_RUNNING.inc()
+    events = build_apk(cancel_event=cancel_event, profile=profile, **params)
+    try:
+        for event in events:
+            profile.observe(event)
+            yield event
+    finally:
+        events.close()
+        metrics.BUILDS_RUNNING.dec()
+        profile.finish()
+
+
+def uploads_in_use():
+    """未完成任务引用的上传文件"""
+    paths = set()
+    for params in build_queue.active_params():
+        paths |= uploads.upload_paths(params)
+    return paths
+
+
+# 上传文件清理：任务结束时释放，后台定期清理
+upload_reaper = uploads.UploadReaper(UPLOAD_DIR, uploads_in_use)
+
+# 构建队列：/build 入队，工作线程执行 build_apk
+build_queue = BuildQueue(DATA_DIR / 'jobs.db', run_build, on_finish=upload_reaper.release)
+
+# 批量构建记录 (与构建队列共用数据库)
+batch_store = batch.BatchStore(DATA_DIR / 'jobs.db')
+
+# 准入控制：按主机内存和 CPU 预算决定构建何时开始
+admission_controller = admission.AdmissionController()
+
+# 产物过期清理
+artifact_reaper = artifacts.ArtifactReaper(OUTPUT_DIR, prune=build_queue.prune)
+
+# 签名证书池：后台预生成证书
+keystore_pool = KeystorePool(generate_keystore, generate_password)
+
+# 异步 SSE 服务 (SSE_ASYNC_PORT 非 0 时启动)
+sse_async_server = AsyncSSEServer(build_queue)
+
+
+def preload():
+    """加载只读的共享状态：工具链探测、模板内容哈希 (模板插槽在导入时已编译)
+
+    gunicorn 预加载 (serve.py) 时在主进程 fork 之前调用，各 Web 进程共享结果。
+    """
+    toolchain.get()
+    fast_build.template_hash()
+
+
+def start_build_services():
+    """启动构建所需的服务 (工具链、构建工作线程、证书池)，构建节点 (worker.py) 也使用"""
+    toolchain.get()
+    admission.purge_cgroups()
+    build_queue.start()
+    if build_queue.workers:
+        keystore_pool.start()
+
+
+def start_services():
+    """启动后台服务 (构建工作线程、证书池、清理线程)"""
+    start_build_services()
+    artifact_reaper.start()
+    upload_reaper.start()
+    if SSE_ASYNC_PORT:
+        sse_async_server.start()
+
+
+def publish_node_endpoint():
+    """构建节点提供 /stats、/metrics，serve.py 的 Web 进程转发给它 (worker.py --services 调用)"""
+    node_endpoint.publish(app, NODE_ADDRESS_FILE)
+
+
+def _forward_to_node():
+    """本进程不执行构建时把请求转发给构建节点，返回响应；本进程执行构建或没有构建节点时返回 None"""
+    if build_queue.started and build_queue.workers:
+        return None
+    url = node_endpoint.address(NODE_ADDRESS_FILE)
+    if url is None:
+        return None
+    result = node_endpoint.forward(url + request.full_path.rstrip('?'))
+    if result is None:
+        return jsonify(send_error('构建节点状态接口无响应')), 503
+    status, body, content_type = result
+    return Response(body, status=status, content_type=content_type)
 
 
 @app.route('/')
 def index():
     """首页"""
-    return render_template('index.html')
+    # 启用异步 SSE 服务时，前端从独立端口订阅进度
+    return render_template('index.html', sse_base=sse_public_url(request.host, request.scheme))
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify(send_error(f'上传文件过大 (上限 {uploads.MAX_UPLOAD_MB} MB)')), 413
 
 
 @app.route('/build', methods=['POST'])
 def build():
-    """构建 APK"""
+    """提交构建任务，立即返回 job_id"""
+    tools = toolchain.get()
+    if not tools.ok:
+        return jsonify(send_error(f'构建环境不可用: {"; ".join(tools.errors)}')), 503
+
     try:
         app_name = request.form.get('appName', '').strip()
         package_name = request.form.get('packageName', '').strip().lower()
@@ -823,12 +1174,10 @@ def build():
         status_bar_color = request.form.get('statusBarColor', '#000000').strip()
 
         if not all([app_name, package_name, url, icon]):
-            return stream_response([send_error('请填写所有必填字段')])
+            return jsonify(send_error('请填写所有必填字段')), 400
 
-        # 保存图标
-        icon_filename = f'{uuid.uuid4()}.png'
-        icon_path = UPLOAD_DIR / icon_filename
-        icon.save(icon_path)
+        # 保存并校验上传文件 (不合法时返回 400，不进入队列)
+        icon_path = uploads.ingest_icon(UPLOAD_DIR, icon)
 
         # 处理用户上传的证书
         existing_keystore = None
@@ -839,15 +1188,12 @@ def build():
             key_password = request.form.get('keyPassword', '').strip() or keystore_password
 
             if not keystore_password:
-                return stream_response([send_error('请填写证书密码')])
+                return jsonify(send_error('请填写证书密码')), 400
 
-            # 保存证书文件
-            keystore_filename = f'{uuid.uuid4()}.keystore'
-            keystore_path = UPLOAD_DIR / keystore_filename
-            keystore_file.save(keystore_path)
+            keystore_path = uploads.ingest_keystore(UPLOAD_DIR, keystore_file, keystore_password, key_alias)
 
             existing_keystore = {
-                'path': keystore_path,
+                'path': str(keystore_path),
                 'store_password': keystore_password,
                 'key_alias': key_alias,
                 'key_password': key_password
@@ -865,29 +1211,288 @@ def build():
         fcm_config_path = None
         fcm_config = request.files.get('fcmConfig')
         if fcm_config:
-            fcm_filename = f'{uuid.uuid4()}_google-services.json'
-            fcm_config_path = UPLOAD_DIR / fcm_filename
-            fcm_config.save(fcm_config_path)
+            fcm_config_path = str(uploads.ingest_fcm_config(UPLOAD_DIR, fcm_config, package_name))
 
         # 获取输出格式 (apk 或 aab)
         output_format = request.form.get('outputFormat', 'apk').strip().lower()
         if output_format not in ('apk', 'aab'):
             output_format = 'apk'
 
-        # 返回流式响应
-        return stream_response(build_apk(app_name, package_name, url, icon_path, existing_keystore, screen_orientation, fullscreen, splash_color, version_name, status_bar_color, pull_to_refresh, google_client_id, fcm_config_path, output_format))
+        # 交付内容：zip (安装包 + 证书 + 说明) 或 package (只要安装包)
+        deliverable = request.form.get('deliverable', 'zip').strip().lower()
+        if deliverable not in ('zip', 'package'):
+            deliverable = 'zip'
+        if deliverable == 'package' and existing_keystore is None:
+            # 自动生成的证书只随 ZIP 交付，只给安装包会导致证书丢失、无法更新应用
+            return jsonify(send_error('只下载安装包需要上传自己的签名证书')), 400
+
+        # 更新构建优先交给持有该包增量工作区的构建节点
+        affinity = None
+        if existing_keystore is not None and workspaces.WORKSPACE_ENABLED:
+            affinity = workspaces.affinity_key(package_name)
+
+        # 加入构建队列，进度通过 /jobs/<job_id>/events 获取
+        job_id = build_queue.submit({
+            'app_name': app_name,
+            'package_name': package_name,
+            'url': url,
+            'icon_path': str(icon_path),
+            'existing_keystore': existing_keystore,
+            'screen_orientation': screen_orientation,
+            'fullscreen': fullscreen,
+            'splash_color': splash_color,
+            'version_name': version_name,
+            'status_bar_color': status_bar_color,
+            'pull_to_refresh': pull_to_refresh,
+            'google_client_id': google_client_id,
+            'fcm_config_path': fcm_config_path,
+            'output_format': output_format,
+            'deliverable': deliverable,
+        }, affinity)
+        return jsonify({'job_id': job_id})
+
+    except uploads.UploadError as e:
+        return jsonify(send_error(str(e))), 400
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
+    except Exception as e:
+        return jsonify(send_error(f'服务器错误: {str(e)}')), 500
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询构建任务状态"""
+    job = build_queue.get(job_id)
+    if job is None:
+        return jsonify(send_error('任务不存在')), 404
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'position': build_queue.queue_position(job_id),
+        'filename': job['result'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    })
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """订阅构建任务的进度事件 (SSE)，断开后可重新订阅
+
+    Last-Event-ID 请求头或 last_event_id 参数：只补发该 id 之后的事件
+    cancel_on_disconnect=1: 所有订阅者断开且宽限期内没有重新订阅时取消任务
+    """
+    if build_queue.get(job_id) is None:
+        return stream_response([send_error('任务不存在')])
+    after_seq = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    cancel_on_disconnect = request.args.get('cancel_on_disconnect') == '1'
+    return stream_response(build_queue.iter_events(
+        job_id, after_seq, cancel_on_disconnect=cancel_on_disconnect, heartbeat=SSE_HEARTBEAT_SECONDS
+    ))
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    """取消构建任务 (排队中或运行中)"""
+    job = build_queue.get(job_id)
+    if job is None:
+        return jsonify(send_error('任务不存在')), 404
+    if not build_queue.cancel(job_id):
+        return jsonify({'job_id': job_id, 'canceled': False, 'status': job['status']}), 409
+    return jsonify({'job_id': job_id, 'canceled': True})
+
+
+@app.route('/batch', methods=['POST'])
+def batch_build():
+    """提交批量构建：清单 (manifest，JSON/CSV) + 图标压缩包 (icons)，返回 batch_id"""
+    tools = toolchain.get()
+    if not tools.ok:
+        return jsonify(send_error(f'构建环境不可用: {"; ".join(tools.errors)}')), 503
 
+    try:
+        manifest = request.files.get('manifest')
+        icons_file = request.files.get('icons')
+        if not manifest or not icons_file:
+            return jsonify(send_error('请上传清单和图标压缩包')), 400
+
+        entries = batch.parse_manifest(manifest.read(), manifest.filename or '')
+        icons = batch.open_icons(icons_file.stream)
+
+        records = []
+        for index, entry in enumerate(entries, 1):
+            record = {'index': index, 'app_name': entry['app_name'], 'package_name': entry['package_name'],
+                      'job_id': None, 'error': batch.check_entry(entry, validate_package_name)}
+            if record['error'] is None:
+                member = batch.find_icon(icons, entry['icon'])
+                if member is None:
+                    record['error'] = f'图标压缩包中没有 {entry["icon"]}'
+            if record['error'] is None:
+                try:
+                    with icons.open(member) as icon:
+                        icon_path = uploads.ingest_icon(UPLOAD_DIR, icon)
+                except uploads.UploadError as e:
+                    record['error'] = str(e)
+            if record['error'] is None:
+                params = batch.entry_params(entry, icon_path)
+                # 变体未预编译时先提交预编译任务，同变体的条目等待它完成后快速打包
+                variant = fast_build.variant_key(False, params['fullscreen'], bool(params['google_client_id']),
+                                                 params['output_format'])
+                if variant and tools.fast_build_ready and not prime_pending(variant) and fast_build.claim_prime(variant):
+                    build_queue.submit(fast_build.prime_params(variant, TEMPLATE_ICON))
+                record['job_id'] = build_queue.submit(params)
+            records.append(record)
+
+        batch_id = batch_store.create(records)
+        failed = [r for r in records if r['error']]
+        print(f'[BATCH] 批次 {batch_id}: {len(records)} 个条目，{len(failed)} 个校验失败')
+        return jsonify({
+            'batch_id': batch_id,
+            'total': len(records),
+            'queued': len(records) - len(failed),
+            'failed': [{'index': r['index'], 'app_name': r['app_name'], 'message': r['error']} for r in failed],
+        })
+
+    except batch.BatchError as e:
+        return jsonify(send_error(str(e))), 400
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
     except Exception as e:
-        return stream_response([send_error(f'服务器错误: {str(e)}')])
+        return jsonify(send_error(f'服务器错误: {str(e)}')), 500
+
+
+@app.route('/batches/<batch_id>')
+def batch_status(batch_id):
+    """查询批次中各条目的状态"""
+    record = batch_store.get(batch_id)
+    if record is None:
+        return jsonify(send_error('批次不存在')), 404
+    states = batch.entry_states(build_queue, record)
+    return jsonify({'batch_id': batch_id, 'created_at': record['created_at'],
+                    'summary': batch.summarize(states), 'apps': states})
+
+
+@app.route('/batches/<batch_id>/events')
+def batch_events(batch_id):
+    """订阅批次的汇总进度 (SSE)：batch (统计)、entry (单个条目结束)、batch_done"""
+    record = batch_store.get(batch_id)
+    if record is None:
+        return stream_response([send_error('批次不存在')])
+    return stream_response(batch.iter_progress(build_queue, record, heartbeat=SSE_HEARTBEAT_SECONDS))
+
+
+@app.route('/batches/<batch_id>/download')
+def batch_download(batch_id):
+    """下载批次汇总 ZIP (各条目产物 + report.json)，边打包边发送"""
+    record = batch_store.get(batch_id)
+    if record is None:
+        return jsonify(send_error('批次不存在')), 404
+    members = batch.archive_members(batch.entry_states(build_queue, record), OUTPUT_DIR)
+    headers = {'Content-Disposition': f'attachment; filename="batch_{batch_id}.zip"'}
+    return Response(packaging.stream_zip(members), mimetype='application/zip', headers=headers)
+
+
+@app.route('/batches/<batch_id>/cancel', methods=['POST'])
+def batch_cancel(batch_id):
+    """取消批次中所有未结束的任务"""
+    record = batch_store.get(batch_id)
+    if record is None:
+        return jsonify(send_error('批次不存在')), 404
+    canceled = sum(1 for entry in record['entries'] if entry['job_id'] and build_queue.cancel(entry['job_id']))
+    return jsonify({'batch_id': batch_id, 'canceled': canceled})
+
+
+@app.route('/health/toolchain')
+def health_toolchain():
+    """工具链状态"""
+    tools = toolchain.get()
+    return jsonify(tools.health()), 200 if tools.ok else 503
+
+
+@app.route('/stats')
+def stats():
+    """构建子系统状态 (守护进程池、构建缓存、证书池)，serve.py 下由构建节点提供"""
+    forwarded = _forward_to_node()
+    if forwarded is not None:
+        return forwarded
+    return jsonify({
+        'gradle_daemons': gradle_pool.stats(),
+        'gradle_cache': gradle_cache.stats(),
+        'keystore_pool': keystore_pool.stats(),
+        'icon_cache': icon_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'admission': admission_controller.stats(),
+        'progress_broker': build_queue.broker.stats(),
+        'sse_server': sse_async_server.stats(),
+        'artifacts': artifact_reaper.stats(),
+        'uploads': upload_reaper.stats(),
+        'workspaces': workspaces.stats(),
+    })
+
+
+def collect_metrics():
+    """抓取时读取各子系统状态"""
+    queue_counts = build_queue.counts()
+    icon = icon_cache.stats()
+    result = result_cache.stats()
+    gradle = gradle_cache.stats()
+    keystores = keystore_pool.stats()
+    budget = admission_controller.stats()
+    broker = build_queue.broker.stats()
+    return [
+        ('web2apk_jobs', 'gauge', '各状态的任务数',
+         [({'status': status}, queue_counts.get(status, 0)) for status in
+          (STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELED)]),
+        ('web2apk_cache_requests_total', 'counter', '缓存查询次数',
+         [({'cache': 'icon', 'result': 'hit'}, icon['hits']), ({'cache': 'icon', 'result': 'miss'}, icon['misses']),
+          ({'cache': 'result', 'result': 'hit'}, result['hits']), ({'cache': 'result', 'result': 'miss'}, result['misses']),
+          ({'cache': 'keystore_pool', 'result': 'hit'}, keystores['hits']),
+          ({'cache': 'keystore_pool', 'result': 'miss'}, keystores['misses'])]),
+        ('web2apk_gradle_tasks_total', 'counter', 'Gradle 任务数 (按结果)',
+         [({'outcome': 'executed'}, gradle['executed']), ({'outcome': 'from_cache'}, gradle['from_cache']),
+          ({'outcome': 'up_to_date'}, gradle['up_to_date'])]),
+        ('web2apk_gradle_build_cache_bytes', 'gauge', 'Gradle 构建缓存大小',
+         [({}, gradle['size_mb'] * 1024 * 1024)]),
+        ('web2apk_admission_running', 'gauge', '已准入的构建数', [({}, budget['running'])]),
+        ('web2apk_admission_reserved_bytes', 'gauge', '已准入构建的预估内存', [({}, budget['reserved_mb'] * 1024 * 1024)]),
+        ('web2apk_admission_available_bytes', 'gauge', '主机可用内存',
+         [({}, budget['available_mb'] * 1024 * 1024 if budget['available_mb'] is not None else None)]),
+        ('web2apk_admission_waits_total', 'counter', '因资源不足等待的构建数', [({}, budget['waited'])]),
+        ('web2apk_admission_rejects_total', 'counter', '因资源不足被拒绝的构建数', [({}, budget['rejected'])]),
+        ('web2apk_gradle_daemons_busy', 'gauge', '正在使用的 Gradle daemon 槽位数',
+         [({}, sum(1 for slot in gradle_pool.stats() if slot['busy']))]),
+        ('web2apk_sse_subscribers', 'gauge', '进度订阅连接数', [({}, broker['subscribers'])]),
+    ]
+
+
+metrics.REGISTRY.add_collector(collect_metrics)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标，serve.py 下由构建节点提供"""
+    forwarded = _forward_to_node()
+    if forwarded is not None:
+        return forwarded
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/builds/<build_id>/profile')
+def build_profile(build_id):
+    """单次构建的剖析 (build_id 见构建开始和成功消息)"""
+    profile = metrics.load_profile(build_id)
+    if profile is None:
+        return jsonify(send_error('构建剖析不存在')), 404
+    return jsonify(profile)
 
 
 @app.route('/download/<filename>')
 def download(filename):
-    """下载文件（APK 或 ZIP）"""
-    file_path = OUTPUT_DIR / filename
-    if file_path.exists() and file_path.suffix in ('.apk', '.zip'):
-        return send_file(file_path, as_attachment=True)
-    return '文件不存在', 404
+    """下载文件（APK 或 ZIP），支持断点续传和条件请求，见 artifacts.py"""
+    response = artifacts.serve(OUTPUT_DIR, filename)
+    if response is None:
+        return '文件不存在或已过期', 404
+    return response
 
 
 if __name__ == '__main__':
@@ -895,5 +1500,9 @@ if __name__ == '__main__':
     print('网页转APK生成器')
     print('=' * 50)
     print(f'请访问: http://localhost:5000')
+    print('开发服务器，生产环境请使用: python serve.py')
     print('=' * 50)
+    # debug 模式下 reloader 父进程不处理请求，只在实际服务进程中启动工作线程
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
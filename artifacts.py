@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建产物下载与过期清理
+
+下载：
+  - send_file(conditional=True) 支持 Range (断点续传) 和 If-None-Match /
+    If-Modified-Since 条件请求。文件通过 wsgi.file_wrapper 返回，gunicorn
+    等服务器会用 sendfile 零拷贝发送。
+  - 设置 DOWNLOAD_ACCEL_REDIRECT (nginx internal location 前缀) 时只返回
+    X-Accel-Redirect 头，由前端代理发送文件，慢速下载不占用 Python 线程；
+    DOWNLOAD_X_SENDFILE=1 时改用 X-Sendfile (Apache / lighttpd)。
+  - 产物文件名包含构建 id，内容不会变化；但 ZIP 中有签名证书和密码，
+    只允许浏览器私有缓存 (Cache-Control: private)。
+
+过期：后台线程每 ARTIFACT_REAP_INTERVAL_SECONDS 删除修改时间早于
+ARTIFACT_TTL_HOURS 的产物。结果缓存命中时会刷新与缓存条目硬链接的产物
+的修改时间，因此仍在被复用的产物会保留更久。打包时先写入临时文件
+(<产物名>.tmp-xxxxxxxx) 再改名，进程崩溃留下的临时文件超过
+ARTIFACT_TMP_GRACE_SECONDS 未被修改后一并删除。同一轮清理中删除结束时间
+早于 ARTIFACT_TTL_HOURS 的任务记录和进度事件 (prune)，它们引用的产物已过期。
+"""
+
+import os
+import threading
+import time
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, send_file
+from werkzeug.security import safe_join
+
+# 产物保留时长 (小时)，0 表示不清理
+ARTIFACT_TTL_HOURS = float(os.environ.get('ARTIFACT_TTL_HOURS', '72'))
+# 未完成的临时文件多久未修改后视为遗留并删除 (秒)
+ARTIFACT_TMP_GRACE_SECONDS = float(os.environ.get('ARTIFACT_TMP_GRACE_SECONDS', '3600'))
+# 清理间隔 (秒)
+ARTIFACT_REAP_INTERVAL_SECONDS = float(os.environ.get('ARTIFACT_REAP_INTERVAL_SECONDS', '600'))
+# nginx internal location 前缀 (如 /protected-output/)，设置后由 nginx 发送文件
+DOWNLOAD_ACCEL_REDIRECT = os.environ.get('DOWNLOAD_ACCEL_REDIRECT', '')
+# 使用 X-Sendfile 头 (Apache mod_xsendfile / lighttpd)
+DOWNLOAD_X_SENDFILE = os.environ.get('DOWNLOAD_X_SENDFILE', '0') == '1'
+# 浏览器缓存时长 (秒)
+DOWNLOAD_MAX_AGE = int(os.environ.get('DOWNLOAD_MAX_AGE', '3600'))
+
+# 可下载的产物类型
+ARTIFACT_SUFFIXES = ('.apk', '.aab', '.zip')
+
+
+def resolve(output_dir, filename):
+    """产物路径，不存在或类型不允许时返回 None"""
+    path = safe_join(str(output_dir), filename)
+    if path is None or not path.endswith(ARTIFACT_SUFFIXES) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def _content_disposition(name):
+    """与 send_file 相同：文件名 (应用名) 可能包含中文，同时给出 ASCII 回退和 RFC 5987 编码"""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(name)}"
+
+
+def _cache_control(response):
+    response.headers['Cache-Control'] = f'private, max-age={DOWNLOAD_MAX_AGE}, immutable'
+    return response
+
+
+def serve(output_dir, filename):
+    """返回产物下载响应，文件不存在时返回 None"""
+    path = resolve(output_dir, filename)
+    if path is None:
+        return None
+
+    if DOWNLOAD_ACCEL_REDIRECT:
+        # 由 nginx 处理 Range、条件请求和发送，这里只给出文件位置和下载头
+        name = os.path.basename(path)
+        response = Response(mimetype='application/octet-stream')
+        response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_REDIRECT.rstrip('/') + '/' + quote(name)
+        response.headers['Content-Disposition'] = _content_disposition(name)
+        return _cache_control(response)
+
+    # DOWNLOAD_X_SENDFILE 通过 Flask 的 USE_X_SENDFILE 配置生效，send_file 会改为返回 X-Sendfile 头
+    response = send_file(path, as_attachment=True, conditional=True, etag=True, max_age=DOWNLOAD_MAX_AGE)
+    return _cache_control(response)
+
+
+def reap(output_dir, ttl_hours=None):
+    """删除过期的产物，返回删除的文件数"""
+    ttl_hours = ARTIFACT_TTL_HOURS if ttl_hours is None else ttl_hours
+    if ttl_hours <= 0:
+        return 0
+    now = time.time()
+    deadline = now - ttl_hours * 3600
+    tmp_deadline = now - ARTIFACT_TMP_GRACE_SECONDS
+    removed = 0
+    try:
+        entries = list(os.scandir(output_dir))
+    except OSError:
+        return 0
+    for entry in entries:
+        # build_* 目录属于正在进行的构建，不处理
+        if not entry.is_file():
+            continue
+        name, sep, _ = entry.name.partition('.tmp-')
+        if not name.endswith(ARTIFACT_SUFFIXES):
+            continue
+        try:
+            if entry.stat().st_mtime < (tmp_deadline if sep else deadline):
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        print(f'[ARTIFACT] 清理 {removed} 个过期产物')
+    return removed
+
+
+class ArtifactReaper:
+    """定期清理过期产物的后台线程"""
+
+    def __init__(self, output_dir, prune=None):
+        self.output_dir = output_dir
+        # prune(finished_before)：删除过期的任务记录，返回删除数
+        self.prune = prune
+        self.reaped = 0
+        self.pruned = 0
+        self._thread = None
+
+    def start(self):
+        if ARTIFACT_TTL_HOURS <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='artifact-reaper', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.reaped += reap(self.output_dir)
+                if self.prune is not None:
+                    self.pruned += self.prune(time.time() - ARTIFACT_TTL_HOURS * 3600)
+            except Exception as e:
+                print(f'[ARTIFACT] 清理失败: {e}')
+            time.sleep(ARTIFACT_REAP_INTERVAL_SECONDS)
+
+    def stats(self):
+        return {
+            'ttl_hours': ARTIFACT_TTL_HOURS,
+            'reaped': self.reaped,
+            'pruned_jobs': self.pruned,
+        }
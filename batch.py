@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量构建 - 一份清单 (JSON / CSV) + 图标压缩包生成多个白标 APK
+
+清单的每个条目对应一次构建，字段与 build_apk 参数同名：
+  app_name、package_name、url、icon (图标压缩包中的文件名) 必填；
+  screen_orientation、fullscreen、pull_to_refresh、splash_color、
+  status_bar_color、version_name、google_client_id、output_format 可选。
+校验通过的条目作为普通任务进入构建队列，由工作线程池并行执行；校验
+失败的条目直接记为失败，不影响其他条目。
+
+与变体无关的工作在整批之间共享：
+  - 工具链启动时解析一次，依赖在共享 GRADLE_USER_HOME 中只解析一次，
+    模板用硬链接物化，这些对所有任务本来就是共享的。
+  - 条目用到的快速构建变体 (全屏 / Google 登录组合) 还没有预编译时，
+    先于条目提交预编译任务；条目以 wait_prime 提交，同变体正在预编译
+    时等待其完成后快速打包，每个变体整批只执行一次完整 Gradle 构建。
+  - 相同的图标按内容去重，只保存和渲染一次。
+
+批次记录在 jobs.db 的 batches 表中，/batches/<id>/events 推送汇总进度，
+/batches/<id>/download 把各条目的产物和 report.json 流式打包为一个 ZIP。
+"""
+
+import csv
+import io
+import json
+import os
+import sqlite3
+import time
+import uuid
+import zipfile
+from pathlib import Path
+
+from build_queue import FINISHED_STATUSES, STATUS_FAILED, STATUS_SUCCEEDED
+
+# 单个批次的条目数上限
+BATCH_MAX_ENTRIES = int(os.environ.get('BATCH_MAX_ENTRIES', '200'))
+# 条目等待同变体预编译完成的最长时间 (秒)，超时后各自执行 Gradle 构建
+BATCH_PRIME_WAIT_SECONDS = float(os.environ.get('BATCH_PRIME_WAIT_SECONDS', '1800'))
+# 清单文件大小上限 (KB)
+MANIFEST_MAX_KB = 1024
+
+REQUIRED_FIELDS = ('app_name', 'package_name', 'url', 'icon')
+# 可选字段及默认值 (与 /build 表单一致)
+OPTIONAL_FIELDS = {
+    'screen_orientation': 'unspecified',
+    'fullscreen': False,
+    'pull_to_refresh': False,
+    'splash_color': '#f8f9fa',
+    'status_bar_color': '#000000',
+    'version_name': '1.0',
+    'google_client_id': '',
+    'output_format': 'apk',
+}
+BOOL_FIELDS = ('fullscreen', 'pull_to_refresh')
+SCREEN_ORIENTATIONS = ('unspecified', 'portrait', 'landscape')
+
+# 汇总事件类型
+EVENT_BATCH = 'batch'
+EVENT_ENTRY = 'entry'
+EVENT_BATCH_DONE = 'batch_done'
+
+
+class BatchError(Exception):
+    """清单或图标压缩包不合法"""
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+
+
+def parse_manifest(data, filename=''):
+    """解析清单 (.csv 按表头取字段，其他按 JSON 数组或 {"apps": [...]})，返回条目列表"""
+    if len(data) > MANIFEST_MAX_KB * 1024:
+        raise BatchError(f'清单文件过大 (上限 {MANIFEST_MAX_KB} KB)')
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise BatchError('清单文件应为 UTF-8 编码') from None
+
+    if filename.lower().endswith('.csv'):
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise BatchError(f'清单不是有效的 JSON: {e}') from None
+        if isinstance(rows, dict):
+            rows = rows.get('apps')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise BatchError('JSON 清单应为对象数组或 {"apps": [...]}')
+
+    if not rows:
+        raise BatchError('清单中没有条目')
+    if len(rows) > BATCH_MAX_ENTRIES:
+        raise BatchError(f'清单条目过多 ({len(rows)}，上限 {BATCH_MAX_ENTRIES})')
+
+    entries = []
+    for row in rows:
+        entry = {}
+        for field in REQUIRED_FIELDS:
+            entry[field] = str(row.get(field) or '').strip()
+        for field, default in OPTIONAL_FIELDS.items():
+            value = row.get(field)
+            if value is None or value == '':
+                entry[field] = default
+            elif field in BOOL_FIELDS:
+                entry[field] = _parse_bool(value)
+            else:
+                entry[field] = str(value).strip()
+        entry['package_name'] = entry['package_name'].lower()
+        entry['output_format'] = entry['output_format'].lower()
+        entries.append(entry)
+    return entries
+
+
+def check_entry(entry, validate_package_name):
+    """校验条目字段，返回错误信息，合法时返回 None"""
+    missing = [field for field in REQUIRED_FIELDS if not entry[field]]
+    if missing:
+        return f'缺少字段: {", ".join(missing)}'
+    if not validate_package_name(entry['package_name']):
+        return f'包名格式不正确: {entry["package_name"]}'
+    if entry['screen_orientation'] not in SCREEN_ORIENTATIONS:
+        return f'不支持的屏幕方向: {entry["screen_orientation"]}'
+    if entry['output_format'] not in ('apk', 'aab'):
+        return f'不支持的输出格式: {entry["output_format"]}'
+    return None
+
+
+def open_icons(stream):
+    """打开图标压缩包，返回 ZipFile"""
+    try:
+        return zipfile.ZipFile(stream)
+    except (zipfile.BadZipFile, OSError):
+        raise BatchError('图标压缩包不是有效的 ZIP 文件') from None
+
+
+def find_icon(icons, name):
+    """在图标压缩包中查找条目的图标：先按完整路径，再按唯一的文件名"""
+    names = [info.filename for info in icons.infolist() if not info.is_dir()]
+    if name in names:
+        return name
+    matches = [n for n in names if n.rsplit('/', 1)[-1] == name]
+    return matches[0] if len(matches) == 1 else None
+
+
+def entry_params(entry, icon_path):
+    """条目对应的构建参数 (自动生成证书，交付 ZIP)"""
+    params = {field: entry[field] for field in REQUIRED_FIELDS if field != 'icon'}
+    params.update({field: entry[field] for field in OPTIONAL_FIELDS})
+    params['icon_path'] = str(icon_path)
+    params['wait_prime'] = True
+    return params
+
+
+class BatchStore:
+    """批次记录 (与构建队列共用 SQLite 数据库)
+
+    每个批次保存条目列表：[{index, app_name, package_name, job_id, error}]，
+    校验失败的条目 job_id 为 None。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS batches (
+                    id TEXT PRIMARY KEY,
+                    entries TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, entries):
+        batch_id = uuid.uuid4().hex[:12]
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO batches (id, entries, created_at) VALUES (?, ?, ?)',
+                (batch_id, json.dumps(entries, ensure_ascii=False), time.time())
+            )
+        return batch_id
+
+    def get(self, batch_id):
+        """获取批次，不存在返回 None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM batches WHERE id = ?', (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = dict(row)
+        batch['entries'] = json.loads(batch['entries'])
+        return batch
+
+
+def _last_message(queue, job_id):
+    last = queue.last_event(job_id)
+    return last[1].get('message') if last is not None else None
+
+
+def entry_states(queue, batch, messages=None):
+    """各条目的当前状态 [{index, app_name, package_name, job_id, status, filename, message}]
+
+    messages: 已结束任务最后一条消息的缓存 {job_id: message}，避免重复查询事件
+    """
+    messages = {} if messages is None else messages
+    statuses = queue.statuses([e['job_id'] for e in batch['entries'] if e['job_id']])
+    states = []
+    for entry in batch['entries']:
+        state = {**entry, 'status': STATUS_FAILED, 'filename': None, 'message': entry['error']}
+        del state['error']
+        if entry['job_id']:
+            status, result = statuses.get(entry['job_id'], (STATUS_FAILED, None))
+            state['status'], state['filename'] = status, result
+            if status in FINISHED_STATUSES and status != STATUS_SUCCEEDED:
+                if entry['job_id'] not in messages:
+                    messages[entry['job_id']] = _last_message(queue, entry['job_id'])
+                state['message'] = messages[entry['job_id']]
+        states.append(state)
+    return states
+
+
+def summarize(states):
+    """按状态统计 {total, queued, running, succeeded, failed, canceled}"""
+    summary = {'total': len(states), 'queued': 0, 'running': 0, 'succeeded': 0, 'failed': 0, 'canceled': 0}
+    for state in states:
+        summary[state['status']] = summary.get(state['status'], 0) + 1
+    return summary
+
+
+def iter_progress(queue, batch, heartbeat=None):
+    """批次的汇总进度事件 (配合 stream_response 使用)
+
+    先产出当前统计，之后每个条目结束时产出 entry 事件和新的统计，全部结束
+    时产出 batch_done；空闲 heartbeat 秒产出 None (心跳)。断线重连时从当前
+    状态重新开始，已结束的条目会再次产出。
+    """
+    messages = {}
+    reported = set()
+    last_sent = time.monotonic()
+    summary = None
+    while True:
+        states = entry_states(queue, batch, messages)
+        for state in states:
+            if state['index'] not in reported and state['status'] in FINISHED_STATUSES:
+                reported.add(state['index'])
+                yield {'type': EVENT_ENTRY, **state}
+                last_sent = time.monotonic()
+        current = summarize(states)
+        if current != summary:
+            summary = current
+            done = summary['total'] - summary['queued'] - summary['running']
+            yield {'type': EVENT_BATCH, 'batch_id': batch['id'], 'percent': done * 100 // summary['total'], **summary}
+            last_sent = time.monotonic()
+        if len(reported) == len(states):
+            yield {'type': EVENT_BATCH_DONE, 'batch_id': batch['id'], 'download': f'/batches/{batch["id"]}/download', **summary}
+            return
+        if heartbeat and time.monotonic() - last_sent >= heartbeat:
+            yield None
+            last_sent = time.monotonic()
+        # 任意任务产生事件时被唤醒 (其他进程执行的任务靠超时轮询)
+        queue.wait(2.0)
+
+
+def archive_members(states, output_dir):
+    """汇总 ZIP 的成员：report.json + 每个成功条目的产物 (<序号>_<包名>/<文件名>)"""
+    report = []
+    members = []
+    for state in states:
+        item = {key: state[key] for key in ('index', 'app_name', 'package_name', 'status', 'message')}
+        path = Path(output_dir) / state['filename'] if state['filename'] else None
+        if state['status'] == STATUS_SUCCEEDED and path is not None and path.is_file():
+            item['file'] = f'{state["index"]:03d}_{state["package_name"]}/{state["filename"]}'
+            members.append((item['file'], path))
+        elif state['status'] == STATUS_SUCCEEDED:
+            item['message'] = '产物已过期'
+        report.append(item)
+    summary = summarize(states)
+    report_json = json.dumps({'summary': summary, 'apps': report}, ensure_ascii=False, indent=2)
+    return [('report.json', report_json)] + members
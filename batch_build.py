@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量构建命令行工具 - 提交清单和图标到 /batch，显示汇总进度并下载结果
+
+用法:
+    python batch_build.py apps.csv icons.zip
+    python batch_build.py apps.json icons/ -o release.zip --server http://build-host:5000
+
+图标可以是 ZIP 或目录 (目录会先打包)。清单格式见 batch.py / README。
+全部成功时退出码为 0，有条目失败时为 1。
+"""
+
+import argparse
+import io
+import json
+import mimetypes
+import sys
+import urllib.error
+import urllib.request
+import uuid
+import zipfile
+from pathlib import Path
+
+
+def encode_multipart(files):
+    """files: {字段名: (文件名, bytes)}，返回 (body, content_type)"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for field, (filename, data) in files.items():
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        body.write(f'--{boundary}\r\n'.encode())
+        body.write(f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode())
+        body.write(f'Content-Type: {content_type}\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def read_icons(path):
+    """图标 ZIP 的内容；目录按相对路径打包 (图标本身已压缩，原样存储)"""
+    path = Path(path)
+    if path.is_file():
+        return path.read_bytes()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        for file in sorted(path.rglob('*')):
+            if file.is_file():
+                zf.write(file, file.relative_to(path).as_posix())
+    return buffer.getvalue()
+
+
+def request_json(url, data=None, headers=None):
+    req = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get('message')
+        except ValueError:
+            message = None
+        raise SystemExit(f'请求失败 ({e.code}): {message or e.reason}')
+
+
+def iter_events(url):
+    """读取 SSE 事件流，产出 data 字段解析后的 dict"""
+    with urllib.request.urlopen(url) as resp:
+        for raw in resp:
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if line.startswith('data:'):
+                yield json.loads(line[5:].strip())
+
+
+def download(url, dest):
+    with urllib.request.urlopen(url) as resp, open(dest, 'wb') as f:
+        while True:
+            chunk = resp.read(1024 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量生成 APK')
+    parser.add_argument('manifest', help='清单文件 (.json 或 .csv)')
+    parser.add_argument('icons', help='图标 ZIP 或图标目录')
+    parser.add_argument('-o', '--output', help='结果 ZIP 路径 (默认 batch_<id>.zip)')
+    parser.add_argument('--server', default='http://127.0.0.1:5000', help='服务地址')
+    args = parser.parse_args()
+    server = args.server.rstrip('/')
+
+    manifest = Path(args.manifest)
+    body, content_type = encode_multipart({
+        'manifest': (manifest.name, manifest.read_bytes()),
+        'icons': ('icons.zip', read_icons(args.icons)),
+    })
+    result = request_json(f'{server}/batch', body, {'Content-Type': content_type})
+    batch_id, total = result['batch_id'], result['total']
+    print(f'批次 {batch_id}: {total} 个应用，{result["queued"]} 个已加入构建队列')
+
+    finished = 0
+    failed = 0
+    for event in iter_events(f'{server}/batches/{batch_id}/events'):
+        kind = event.get('type')
+        if kind == 'entry':
+            finished += 1
+            ok = event['status'] == 'succeeded'
+            failed += not ok
+            detail = event['filename'] if ok else f'{event["status"]}: {event.get("message") or ""}'
+            print(f'[{finished}/{total}] {"✓" if ok else "✗"} {event["app_name"]} ({event["package_name"]}) {detail}')
+        elif kind == 'batch':
+            print(f'  进度 {event["percent"]}% (排队 {event["queued"]}，构建中 {event["running"]})')
+        elif kind == 'batch_done':
+            break
+        elif kind == 'error':
+            raise SystemExit(event.get('message'))
+
+    output = args.output or f'batch_{batch_id}.zip'
+    download(f'{server}/batches/{batch_id}/download', output)
+    print(f'完成: 成功 {total - failed}，失败 {failed}，结果已保存到 {output}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板物化基准测试 - shutil.copytree vs template_fs.materialize
+
+用法: python benchmarks/bench_materialize.py [次数]
+构建目录放在 output/ 下 (与实际构建同一磁盘)。
+"""
+
+import shutil
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import OUTPUT_DIR, TEMPLATE_DIR, TEMPLATE_MUTABLE_FILES  # noqa: E402
+from template_fs import materialize, remove_tree  # noqa: E402
+
+
+def bench(name, create, remove, rounds):
+    create_times = []
+    remove_times = []
+    for i in range(rounds):
+        target = OUTPUT_DIR / f'bench_{name}_{i}'
+        start = time.perf_counter()
+        create(target)
+        create_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        remove(target)
+        remove_times.append(time.perf_counter() - start)
+
+    print(f'{name:<12} 创建 {statistics.mean(create_times) * 1000:8.2f} ms   '
+          f'删除 {statistics.mean(remove_times) * 1000:8.2f} ms   '
+          f'(平均 {rounds} 次)')
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size = sum(f.stat().st_size for f in TEMPLATE_DIR.rglob('*') if f.is_file())
+    count = sum(1 for f in TEMPLATE_DIR.rglob('*') if f.is_file())
+    print(f'模板: {count} 个文件, {size / 1024:.0f} KB')
+
+    bench('copytree', lambda t: shutil.copytree(TEMPLATE_DIR, t), shutil.rmtree, rounds)
+    bench('materialize', lambda t: materialize(TEMPLATE_DIR, t, TEMPLATE_MUTABLE_FILES), remove_tree, rounds)
+
+    stats = materialize(TEMPLATE_DIR, OUTPUT_DIR / 'bench_stats', TEMPLATE_MUTABLE_FILES)
+    shutil.rmtree(OUTPUT_DIR / 'bench_stats')
+    print(f'materialize 明细: {stats}')
+
+
+if __name__ == '__main__':
+    main()
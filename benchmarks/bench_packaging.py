@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产物打包基准测试 - 全部 ZIP_DEFLATED vs packaging.write_zip / stream_zip
+
+用法: python benchmarks/bench_packaging.py [次数]
+用随机数据模拟已压缩的 APK (不同大小)，加上与实际构建相同的证书和说明文件。
+临时文件放在 output/ 下 (与实际构建同一磁盘)。
+"""
+
+import os
+import statistics
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import packaging  # noqa: E402
+
+OUTPUT_DIR = Path(__file__).parent.parent / 'output'
+
+SIZES_MB = (5, 20, 50, 150)
+GUIDE = '===== 签名证书信息 =====\n证书文件: release.keystore\n' * 40
+
+
+def make_members(workdir, size_mb):
+    apk = workdir / f'bench_{size_mb}mb.apk'
+    with open(apk, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    keystore = workdir / 'bench.keystore'
+    keystore.write_bytes(os.urandom(2700))
+    return [
+        ('app.apk', apk),
+        ('release.keystore', keystore),
+        ('证书信息-请妥善保管.txt', GUIDE),
+        ('.well-known/assetlinks.json', '[{"relation": []}]'),
+        ('链接直达功能配置指南.txt', GUIDE),
+    ]
+
+
+def deflate_all(dest, members):
+    """原实现：所有成员都用 ZIP_DEFLATED"""
+    with zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, source in members:
+            if isinstance(source, Path):
+                zf.write(source, arcname)
+            else:
+                zf.writestr(arcname, source)
+
+
+def stream_to_file(dest, members):
+    with open(dest, 'wb') as f:
+        for chunk in packaging.stream_zip(members):
+            f.write(chunk)
+
+
+def bench(name, pack, members, rounds):
+    dest = OUTPUT_DIR / f'bench_packaging_{name}.zip'
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        pack(dest, members)
+        times.append(time.perf_counter() - start)
+    size = dest.stat().st_size
+    dest.unlink()
+    return statistics.mean(times), size
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    workdir = OUTPUT_DIR / 'bench_packaging'
+    workdir.mkdir(exist_ok=True)
+    try:
+        print(f'{"APK":>8}  {"方式":<12} {"耗时":>10} {"ZIP 大小":>12} {"吞吐":>12}')
+        for size_mb in SIZES_MB:
+            members = make_members(workdir, size_mb)
+            for name, pack in (('deflate', deflate_all), ('write_zip', packaging.write_zip),
+                               ('stream_zip', stream_to_file)):
+                seconds, size = bench(name, pack, members, rounds)
+                print(f'{size_mb:>6}MB  {name:<12} {seconds * 1000:>8.1f}ms {size / 1024 / 1024:>10.2f}MB '
+                      f'{size_mb / seconds:>8.0f}MB/s')
+            members[0][1].unlink()
+    finally:
+        for f in workdir.iterdir():
+            f.unlink()
+        workdir.rmdir()
+
+
+if __name__ == '__main__':
+    main()
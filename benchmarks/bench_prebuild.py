@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建前步骤基准测试 - 依次执行 vs step_graph 并行执行
+
+用法: python benchmarks/bench_prebuild.py [次数]
+测量从 build_apk 开始到 Gradle 即将启动 (进度事件 step=gradle) 的时间，
+不实际执行 Gradle。证书走 keytool 现场生成 (不使用证书池)，每次使用新的
+随机图标 (不命中图标缓存)，快速构建关闭；依次执行用单线程线程池模拟
+(步骤按依赖顺序逐个执行，与原来的流程相同，各步骤耗时含排队时间)。
+需要可用的 JDK (keytool)。
+"""
+
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+os.environ['FAST_BUILD_ENABLED'] = '0'
+os.environ['KEYSTORE_POOL_ENABLED'] = '0'
+
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+import step_graph  # noqa: E402
+
+ICON = app.OUTPUT_DIR / 'bench_icon.png'
+
+
+def until_gradle():
+    """执行 build_apk 到 Gradle 启动前，返回 (总耗时, {步骤: 耗时})"""
+    Image.frombytes('RGB', (1024, 1024), os.urandom(1024 * 1024 * 3)).save(ICON)
+    start = time.perf_counter()
+    steps = {}
+    events = app.build_apk('基准测试', 'com.example.bench', 'https://example.com', str(ICON))
+    try:
+        for event in events:
+            if event['type'] == 'done' and 'duration' in event:
+                steps[event['step']] = event['duration']
+            elif event['type'] == 'error':
+                raise SystemExit(f'构建失败: {event["message"]}')
+            elif event.get('step') == 'gradle':
+                return time.perf_counter() - start, steps
+    finally:
+        events.close()
+    raise SystemExit('构建未到达 Gradle 步骤')
+
+
+def bench(name, threads, rounds):
+    step_graph._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='bench')
+    totals = []
+    steps = {}
+    until_gradle()  # 预热
+    for _ in range(rounds):
+        total, timing = until_gradle()
+        totals.append(total)
+        for step, duration in timing.items():
+            steps.setdefault(step, []).append(duration)
+    step_graph._executor.shutdown()
+    detail = '  '.join(f'{step} {statistics.mean(d) * 1000:.0f}' for step, d in steps.items())
+    print(f'{name:<8} 到 Gradle 启动 {statistics.mean(totals) * 1000:8.1f} ms '
+          f'(中位数 {statistics.median(totals) * 1000:.1f} ms，平均 {rounds} 次)')
+    print(f'         各步骤 ms: {detail}')
+    return statistics.mean(totals)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    tools = app.toolchain.get()
+    if not tools.ok:
+        raise SystemExit(f'构建环境不可用: {"; ".join(tools.errors)}')
+
+    sequential = bench('依次执行', 1, rounds)
+    parallel = bench('并行执行', step_graph.PREBUILD_THREADS, rounds)
+    print(f'缩短 {(sequential - parallel) * 1000:.1f} ms ({(1 - parallel / sequential) * 100:.0f}%)')
+    ICON.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Web 服务负载测试 - 对比开发服务器 (python app.py) 与生产入口 (python serve.py)
+
+用法:
+    python app.py                                   # 开发服务器，端口 5000
+    python serve.py --bind 127.0.0.1:8000           # 生产入口
+    python benchmarks/loadtest.py http://127.0.0.1:5000 http://127.0.0.1:8000 -c 1,16,64 -d 10
+
+按 PROFILE 中的权重混合请求首页、状态、任务查询、下载 (不存在的文件，
+只测路由和查库)、指标等接口，不提交构建。每个并发数持续 -d 秒，输出
+吞吐量、错误数和延迟分位数。每个请求新建连接 (与浏览器首次访问相同)。
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# (路径, 权重)
+PROFILE = [
+    ('/', 3),
+    ('/jobs/loadtest000000', 5),
+    ('/stats', 2),
+    ('/health/toolchain', 2),
+    ('/download/loadtest_missing.zip', 2),
+    ('/metrics', 1),
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def worker(base, deadline, latencies, errors, lock):
+    paths = [path for path, weight in PROFILE for _ in range(weight)]
+    local = []
+    failed = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base + random.choice(paths), timeout=30) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            # 404 (任务、文件不存在) 和 503 (工具链不完整) 是预期的响应
+            e.read()
+            if e.code not in (404, 503):
+                failed += 1
+        except OSError:
+            failed += 1
+            continue
+        local.append(time.perf_counter() - start)
+    with lock:
+        latencies.extend(local)
+        errors[0] += failed
+
+
+def run(base, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=worker, args=(base, deadline, latencies, errors, lock))
+               for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        'rps': len(latencies) / duration,
+        'errors': errors[0],
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'mean': (statistics.mean(latencies) if latencies else 0.0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web 服务负载测试')
+    parser.add_argument('servers', nargs='+', help='服务地址，如 http://127.0.0.1:5000')
+    parser.add_argument('-c', '--concurrency', default='1,16,64', help='并发数列表 (逗号分隔)')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='每个并发数持续秒数')
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    results = {}
+    for server in args.servers:
+        base = server.rstrip('/')
+        run(base, 1, 1)  # 预热
+        for level in levels:
+            result = results[server, level] = run(base, level, args.duration)
+            print(f'{base:<28} 并发 {level:>4}  {result["rps"]:8.1f} req/s  错误 {result["errors"]:>4}  '
+                  f'p50 {result["p50"]:7.1f} ms  p95 {result["p95"]:7.1f} ms  p99 {result["p99"]:7.1f} ms')
+
+    if len(args.servers) > 1:
+        baseline = args.servers[0]
+        print(f'\n相对 {baseline}:')
+        for server in args.servers[1:]:
+            for level in levels:
+                base, other = results[baseline, level], results[server, level]
+                ratio = other['rps'] / base['rps'] if base['rps'] else 0.0
+                print(f'  {server:<28} 并发 {level:>4}  吞吐量 x{ratio:.2f}  '
+                      f'p95 {base["p95"]:.1f} → {other["p95"]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
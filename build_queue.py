@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建任务队列 - 持久化队列 + 有界工作线程池
+
+/build 只负责入队并立即返回 job_id，由固定数量的工作线程执行 build_apk。
+任务状态和进度事件通过传输层 (transport.py，默认 SQLite) 持久化，客户端
+断开不影响构建。工作线程可以在 Web 进程中，也可以在独立的构建节点
+(worker.py) 中：Web 进程设置 BUILD_WORKERS=0 时只负责接收任务和推送进度。
+
+租约：领取的任务每 BUILD_HEARTBEAT_SECONDS 秒续约一次，进程崩溃或失联
+的任务在租约过期后重新排队 (服务重启后未完成的任务同样如此)。
+
+取消：排队中的任务直接标记为已取消；运行中的任务通过 cancel_event 通知
+构建函数结束 Gradle 进程组并清理构建目录 (其他节点执行的任务在续约时
+得知取消请求)。订阅进度时指定
+cancel_on_disconnect 的任务，在最后一个订阅者断开 CANCEL_GRACE_SECONDS
+秒后仍无人重新订阅 (刷新页面会重新订阅) 时自动取消。
+
+进度订阅：本进程工作线程产生的事件持久化后发布到 ProgressBroker，
+订阅者被直接唤醒并从内存缓冲区读取；其他节点执行的任务由 ProgressBroker
+轮询传输层。重连时按 Last-Event-ID 补发。
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+
+import metrics
+import transport
+from progress_broker import ProgressBroker
+from transport import (
+    FINISHED_STATUSES, LEASE_CANCEL, LEASE_LOST, STATUS_CANCELED, STATUS_FAILED, STATUS_QUEUED,
+    STATUS_RUNNING, STATUS_SUCCEEDED,
+)
+
+# 单个 Gradle 构建的预估内存占用 (MB)，用于计算默认工作线程数
+BUILD_MEMORY_MB = int(os.environ.get('BUILD_MEMORY_MB', '2560'))
+# 订阅者断开多久后取消无人关注的任务 (秒)
+CANCEL_GRACE_SECONDS = float(os.environ.get('BUILD_CANCEL_GRACE_SECONDS', '30'))
+# 任务租约时长 (秒)，节点超过该时间没有续约视为失联
+LEASE_SECONDS = float(os.environ.get('BUILD_LEASE_SECONDS', '60'))
+# 续约间隔 (秒)
+HEARTBEAT_SECONDS = float(os.environ.get('BUILD_HEARTBEAT_SECONDS', '10'))
+# 同一任务最多执行几次 (节点反复崩溃的任务不再重试)
+MAX_ATTEMPTS = int(os.environ.get('BUILD_MAX_ATTEMPTS', '3'))
+# 带亲和键的任务等待持有本地状态的节点多久 (秒)，之后任意节点都可领取
+AFFINITY_WAIT_SECONDS = float(os.environ.get('BUILD_AFFINITY_WAIT_SECONDS', '60'))
+# 节点名 (亲和性按节点记录，同一台机器上的进程共用本地磁盘)，默认主机名
+WORKER_NODE_ID = os.environ.get('WORKER_NODE_ID') or socket.gethostname()
+
+
+def total_memory_mb():
+    """读取物理内存总量 (MB)，无法获取时返回 None"""
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        pages = os.sysconf('SC_PHYS_PAGES')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        return pages * page_size // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_worker_count():
+    """根据 CPU 核数和内存计算默认工作线程数
+
+    环境变量 BUILD_WORKERS 可直接指定。
+    """
+    configured = os.environ.get('BUILD_WORKERS')
+    if configured:
+        return max(0, int(configured))
+
+    cpu_workers = max(1, (os.cpu_count() or 1) // 2)
+    memory = total_memory_mb()
+    if memory is None:
+        return cpu_workers
+    memory_workers = max(1, memory // BUILD_MEMORY_MB)
+    return min(cpu_workers, memory_workers)
+
+
+class BuildQueue:
+    """持久化构建队列
+
+    runner: 构建函数，接收 submit() 时传入的参数和 cancel_event，返回进度
+            事件生成器 (即 build_apk)。事件中 type 为 success/error/canceled
+            的视为终止事件。
+    on_finish: 可选，任务结束 (含排队中被取消) 后以任务参数调用，用于清理上传文件
+    backend: 传输层，默认按 BUILD_TRANSPORT 创建 (见 transport.py)
+    """
+
+    def __init__(self, db_path, runner, workers=None, on_finish=None, backend=None):
+        self.runner = runner
+        self.on_finish = on_finish
+        self.workers = default_worker_count() if workers is None else workers
+        self.transport = backend or transport.create(db_path)
+        # 本进程的节点标识，领取任务和续约时使用
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}'
+        self.node_id = WORKER_NODE_ID
+        self._cond = threading.Condition()
+        self._threads = []
+        # start() 之后为 True (本进程领取并执行构建)
+        self.started = False
+        self._stopping = threading.Event()
+        # 本进程运行中任务的取消事件 {job_id: threading.Event}
+        self._cancel_events = {}
+        # 每个任务当前的进度订阅者数量
+        self._watchers = {}
+        self._watch_lock = threading.Lock()
+        # 事件写入与发布在同一把锁内，保证缓冲区中的 seq 有序
+        self._event_lock = threading.Lock()
+        self.broker = ProgressBroker(self._load_events)
+
+    def start(self):
+        """启动工作线程和租约线程 (续约本进程的任务，重新排队失联节点的任务)"""
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f'build-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        # 上次退出时未完成、租约已过期的任务立即重新排队
+        self._expire_leases()
+        threading.Thread(target=self._lease_loop, name='build-lease', daemon=True).start()
+        self.started = True
+        print(f'[QUEUE] 节点 {self.worker_id} 已启动 {self.workers} 个构建工作线程')
+
+    def stop(self, timeout=None):
+        """停止领取新任务，等待运行中的任务结束；返回是否已全部结束
+
+        超时仍未结束的任务在进程退出后由租约过期重新排队。
+        """
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for t in self._threads:
+            t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not self._cancel_events
+
+    def running(self):
+        """本进程正在执行的任务数"""
+        return len(self._cancel_events)
+
+    def submit(self, params, affinity=None):
+        """提交构建任务，返回 job_id
+
+        affinity: 亲和键，优先由 set_affinity 记录的节点领取 (见 transport.py)
+        """
+        job_id = uuid.uuid4().hex[:12]
+        self.transport.insert(job_id, params, affinity)
+        self._append_event(job_id, {'type': 'queued', 'message': '已加入构建队列', 'position': self.queue_position(job_id)})
+        with self._cond:
+            self._cond.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        """获取任务信息，不存在返回 None"""
+        return self.transport.get(job_id)
+
+    def set_affinity(self, key):
+        """记录亲和键在本节点，之后带该键的任务优先由本节点领取"""
+        self.transport.set_affinity(key, self.node_id)
+
+    def queue_position(self, job_id):
+        """任务在队列中的位置 (从 1 开始)，不在排队中返回 0"""
+        return self.transport.queue_position(job_id)
+
+    def counts(self):
+        """各状态的任务数 {status: n}"""
+        return self.transport.counts()
+
+    def statuses(self, job_ids):
+        """批量查询任务状态 {job_id: (status, result)}"""
+        return self.transport.statuses(job_ids)
+
+    def active_params(self):
+        """排队中和运行中任务的参数列表"""
+        return self.transport.active_params()
+
+    def events(self, job_id, after_seq=0):
+        """获取 seq 大于 after_seq 的事件列表 [(seq, payload)]"""
+        return self.transport.events(job_id, after_seq)
+
+    def last_event(self, job_id):
+        """最后一个事件 (seq, payload)，没有事件时返回 None"""
+        return self.transport.last_event(job_id)
+
+    def prune(self, finished_before):
+        """删除在 finished_before 之前结束的任务及其事件 (产物过期后不再需要)"""
+        removed = self.transport.prune(finished_before)
+        if removed:
+            print(f'[QUEUE] 清理 {removed} 个过期任务记录')
+        return removed
+
+    def wait(self, timeout):
+        """等待任意任务产生新事件 (只能感知本进程写入的事件)"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def _load_events(self, job_id, after_seq):
+        """事件源：返回 (事件列表, 任务是否已结束)"""
+        # 先查状态再取事件：任务结束时事件已全部写入，不会漏掉最后的事件
+        job = self.get(job_id)
+        finished = job is None or job['status'] in FINISHED_STATUSES
+        return self.events(job_id, after_seq), finished
+
+    def iter_events(self, job_id, after_seq=0, cancel_on_disconnect=False, heartbeat=None):
+        """持续产出 (seq, payload)，直到任务结束且事件全部发出
+
+        after_seq: 从该 seq 之后开始 (客户端的 Last-Event-ID)
+        cancel_on_disconnect: 订阅者中途断开 (生成器被关闭) 且宽限期内无人
+        重新订阅时取消任务
+        heartbeat: 空闲多少秒产出一次 None (SSE 心跳)
+        """
+        finished = False
+        self.add_watcher(job_id)
+        try:
+            yield from self.broker.subscribe(job_id, after_seq, heartbeat)
+            finished = True
+        finally:
+            self.remove_watcher(job_id, cancel_on_disconnect, finished)
+
+    def add_watcher(self, job_id):
+        with self._watch_lock:
+            self._watchers[job_id] = self._watchers.get(job_id, 0) + 1
+
+    def remove_watcher(self, job_id, cancel_on_disconnect=False, finished=False):
+        """订阅者断开；cancel_on_disconnect 且任务未结束时，宽限期后无人订阅则取消"""
+        with self._watch_lock:
+            remaining = self._watchers.get(job_id, 1) - 1
+            if remaining > 0:
+                self._watchers[job_id] = remaining
+            else:
+                self._watchers.pop(job_id, None)
+        if cancel_on_disconnect and not finished and remaining <= 0:
+            timer = threading.Timer(CANCEL_GRACE_SECONDS, self._cancel_if_unwatched, (job_id,))
+            timer.daemon = True
+            timer.start()
+
+    def _cancel_if_unwatched(self, job_id):
+        with self._watch_lock:
+            if self._watchers.get(job_id):
+                return
+        if self.cancel(job_id):
+            print(f'[QUEUE] 任务 {job_id} 的订阅者已断开，自动取消')
+
+    def cancel(self, job_id):
+        """取消任务，返回是否生效 (已结束的任务返回 False)
+
+        运行中的任务：本进程执行的直接通知构建函数，其他节点执行的在其下次
+        续约时得知。
+        """
+        result = self.transport.cancel(job_id)
+        if result == STATUS_CANCELED:
+            self._append_event(job_id, {'type': 'canceled', 'message': '构建已取消'})
+            self._notify_finish(self.get(job_id)['params'])
+            return True
+        if result != STATUS_RUNNING:
+            return False
+        cancel_event = self._cancel_events.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
+        return True
+
+    def _append_event(self, job_id, payload, publish=False):
+        """写入事件；publish 为 True 时 (本进程执行的任务) 同时推送给订阅者
+
+        本进程执行的任务只在仍持有租约时写入，失去租约时返回 None。
+        """
+        with self._event_lock:
+            seq = self.transport.append_event(job_id, payload, self.worker_id if publish else None)
+            if seq is not None and publish:
+                self.broker.publish(job_id, seq, payload)
+        with self._cond:
+            self._cond.notify_all()
+        return seq
+
+    def _finish(self, job_id, status, result=None):
+        finished = self.transport.finish(job_id, status, result, self.worker_id)
+        if finished:
+            self.broker.finish(job_id)
+        else:
+            self.broker.drop(job_id)
+        with self._cond:
+            self._cond.notify_all()
+        return finished
+
+    def _notify_finish(self, params):
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(params)
+        except Exception as e:
+            print(f'[QUEUE] 任务结束回调失败: {e}')
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            job = self.transport.claim(self.worker_id, LEASE_SECONDS, self.node_id, AFFINITY_WAIT_SECONDS)
+            if job is None:
+                self.wait(2.0)
+                continue
+            self._cancel_events[job['id']] = threading.Event()
+            self._run_job(job)
+
+    def _lease_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                self._renew_leases()
+                self._expire_leases()
+            except Exception as e:
+                print(f'[QUEUE] 续约失败: {e}')
+
+    def _renew_leases(self):
+        """续约本进程的任务；有取消请求或已失去租约的任务通知构建函数结束"""
+        if not self._cancel_events:
+            return
+        for job_id, state in self.transport.renew(list(self._cancel_events), self.worker_id, LEASE_SECONDS).items():
+            cancel_event = self._cancel_events.get(job_id)
+            if cancel_event is None or state not in (LEASE_CANCEL, LEASE_LOST):
+                continue
+            if state == LEASE_LOST:
+                print(f'[QUEUE] 任务 {job_id} 的租约已过期 (已由其他节点接手)，停止构建')
+            cancel_event.set()
+
+    def _expire_leases(self):
+        """租约过期的任务 (节点崩溃或失联)：重新排队或结束"""
+        for job_id, status in self.transport.expire_leases(MAX_ATTEMPTS):
+            if status == STATUS_QUEUED:
+                print(f'[QUEUE] 任务 {job_id} 的构建节点失联，重新排队')
+                self._append_event(job_id, {
+                    'type': 'queued', 'message': '构建节点失联，任务重新排队', 'position': self.queue_position(job_id),
+                })
+                continue
+            if status == STATUS_CANCELED:
+                self._append_event(job_id, {'type': 'canceled', 'message': '构建已取消'})
+            else:
+                print(f'[QUEUE] 任务 {job_id} 的构建节点多次失联，放弃')
+                self._append_event(job_id, {'type': 'error', 'message': '构建节点多次异常退出，任务已放弃'})
+            self._notify_finish(self.get(job_id)['params'])
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run_job(self, job):
+        job_id = job['id']
+        print(f'[QUEUE] 开始构建任务 {job_id} (第 {job["attempts"]} 次)')
+        metrics.QUEUE_WAIT.observe(max(0.0, job['started_at'] - job['created_at']))
+        status, result = STATUS_FAILED, None
+        cancel_event = self._cancel_events[job_id]
+        lost = False
+        try:
+            events = self.runner(cancel_event=cancel_event, **job['params'])
+            for event in events:
+                if self._append_event(job_id, event, publish=True) is None:
+                    # 租约已过期，任务已交给其他节点，停止构建且不再写入
+                    events.close()
+                    lost = True
+                    break
+                if event.get('type') == 'success':
+                    status, result = STATUS_SUCCEEDED, event.get('filename')
+                elif event.get('type') == 'error':
+                    status = STATUS_FAILED
+                elif event.get('type') == 'canceled':
+                    status = STATUS_CANCELED
+                if cancel_event.is_set() and status != STATUS_SUCCEEDED:
+                    # 构建函数在两个事件之间没有检查取消，直接关闭生成器 (触发其清理)
+                    events.close()
+                    status = STATUS_CANCELED
+                    break
+        except Exception as e:
+            self._append_event(job_id, {'type': 'error', 'message': f'构建过程出错: {str(e)}'}, publish=True)
+            status = STATUS_FAILED
+        if not lost:
+            if status == STATUS_CANCELED:
+                last = self.last_event(job_id)
+                if last is None or last[1].get('type') != 'canceled':
+                    self._append_event(job_id, {'type': 'canceled', 'message': '构建已取消'}, publish=True)
+            elif status == STATUS_FAILED and result is None:
+                last = self.last_event(job_id)
+                if last is None or last[1].get('type') != 'error':
+                    self._append_event(job_id, {'type': 'error', 'message': '构建意外终止'}, publish=True)
+        finished = self._finish(job_id, status, result)
+        self._cancel_events.pop(job_id, None)
+        if finished:
+            self._notify_finish(job['params'])
+            print(f'[QUEUE] 任务 {job_id} 结束: {status}')
+        else:
+            print(f'[QUEUE] 任务 {job_id} 已由其他节点接手，丢弃本次结果')
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+证书指纹 - 在进程内解析 PKCS12 证书并计算 SHA1/SHA256 指纹
+
+PKCS12 证书用 cryptography 解析，取出证书 DER 直接哈希，不再为此启动
+keytool JVM。结果按证书文件内容哈希 + 口令哈希 + 别名缓存，同一客户重复
+上传同一证书时无需再次解析，口令错误也不会命中用正确口令缓存的结果。
+JKS/JCEKS 证书或未安装 cryptography 时回退到 keytool。
+"""
+
+import hashlib
+import subprocess
+import threading
+from collections import OrderedDict
+
+try:
+    from cryptography.hazmat.primitives.serialization import Encoding, pkcs12
+except ImportError:  # 可选依赖，缺失时全部使用 keytool
+    pkcs12 = None
+
+# 指纹缓存容量
+CACHE_SIZE = 256
+
+# 证书文件格式魔数
+JKS_MAGIC = b'\xfe\xed\xfe\xed'
+JCEKS_MAGIC = b'\xce\xce\xce\xce'
+
+NOT_FOUND = 'NOT_FOUND'
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def keystore_type(data):
+    """根据文件头判断证书格式: 'jks' / 'jceks' / 'pkcs12' / None"""
+    if data[:4] == JKS_MAGIC:
+        return 'jks'
+    if data[:4] == JCEKS_MAGIC:
+        return 'jceks'
+    # PKCS12 是 DER 编码的 SEQUENCE
+    if data[:1] == b'\x30':
+        return 'pkcs12'
+    return None
+
+
+def format_fingerprint(digest):
+    """格式化为 keytool 风格的指纹: AB:CD:..."""
+    return ':'.join(f'{b:02X}' for b in digest)
+
+
+def _from_pkcs12(data, store_password, key_alias):
+    """解析 PKCS12 并返回 (sha1, sha256)，别名不匹配或解析失败返回 None"""
+    try:
+        store = pkcs12.load_pkcs12(data, store_password.encode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if store.cert is None:
+        return None
+    # keytool 的别名就是私钥条目的 friendly name (keytool 会转为小写)
+    name = store.cert.friendly_name
+    if name is not None and name.decode('utf-8', 'replace').lower() != key_alias.lower():
+        return None
+    der = store.cert.certificate.public_bytes(Encoding.DER)
+    return format_fingerprint(hashlib.sha1(der).digest()), format_fingerprint(hashlib.sha256(der).digest())
+
+
+def _from_keytool(keystore_path, store_password, key_alias, keytool, env):
+    """使用 keytool 获取证书 SHA1 和 SHA256 指纹"""
+    cmd = [
+        str(keytool), '-list', '-v',
+        '-keystore', str(keystore_path),
+        '-alias', key_alias,
+        '-storepass', store_password
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    # 从输出中提取指纹
+    sha1 = ''
+    sha256 = ''
+    for line in result.stdout.split('\n'):
+        if 'SHA1:' in line.upper():
+            sha1 = line.split(':', 1)[1].strip() if ':' in line else ''
+        elif 'SHA256:' in line.upper():
+            sha256 = line.split(':', 1)[1].strip() if ':' in line else ''
+    return sha1 or NOT_FOUND, sha256 or NOT_FOUND
+
+
+def get_cert_fingerprints(keystore_path, store_password, key_alias, keytool='keytool', env=None):
+    """获取证书 SHA1 和 SHA256 指纹，失败时为 'NOT_FOUND'"""
+    with open(keystore_path, 'rb') as f:
+        data = f.read()
+    cache_key = (
+        hashlib.sha256(data).hexdigest(),
+        hashlib.sha256(store_password.encode('utf-8')).hexdigest(),
+        key_alias.lower(),
+    )
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+
+    result = None
+    if pkcs12 is not None and keystore_type(data) == 'pkcs12':
+        result = _from_pkcs12(data, store_password, key_alias)
+    if result is None:
+        result = _from_keytool(keystore_path, store_password, key_alias, keytool, env)
+
+    if NOT_FOUND not in result:
+        with _cache_lock:
+            _cache[cache_key] = result
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return result
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+快速构建 - 复用预编译的变体产物，只重新打包资源
+
+同一变体 (影响源码的选项相同) 的 APK 之间只有资源和清单不同：
+应用名、网址、颜色、开关、图标、包名、版本号、深度链接域名、屏幕方向。
+因此每个变体用规范参数完整构建一次 (预编译)，保存：
+  - prebuilt.apk       完整 APK (dex、Java 资源、assets、so)
+  - resources.flata    合并后的全部已编译资源 (aapt2 .flat)
+  - AndroidManifest.xml 合并后的清单
+  - stable-ids.txt     资源 ID (来自 R.txt，保证与 dex 中内联的 ID 一致)
+
+之后同变体的请求只需：aapt2 编译少量变化的资源作为 overlay → aapt2 link
+(改包名) → 替换 APK 中的资源和清单 → zipalign → apksigner 签名。
+没有可用变体时回退到完整 Gradle 构建。
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+import toolchain
+
+BASE_DIR = Path(__file__).parent.absolute()
+TEMPLATE_DIR = BASE_DIR / 'android-template'
+
+# 是否启用快速构建
+FAST_BUILD_ENABLED = os.environ.get('FAST_BUILD_ENABLED', '1') != '0'
+# 预编译变体存放目录
+VARIANT_DIR = Path(os.environ.get('FAST_BUILD_VARIANT_DIR', str(BASE_DIR / 'cache' / 'variants')))
+
+# 预编译时使用的规范参数，快速构建时再替换为实际值
+PREBUILT_PACKAGE = 'org.web2apk.prebuilt'
+PREBUILT_HOST = 'DEEP_LINK_HOST_PLACEHOLDER'
+# build_apk 生成源码的逻辑变化时递增，旧的预编译变体自动失效
+VARIANT_VERSION = 2
+
+# 每次构建会变化的资源 (相对 res 目录)，编译为 overlay 覆盖预编译资源
+OVERLAY_RESOURCES = [
+    'values/strings.xml',
+    'values/colors.xml',
+    'values/bools.xml',
+] + [
+    f'{folder}/{name}'
+    for folder in ('mipmap-mdpi', 'mipmap-hdpi', 'mipmap-xhdpi', 'mipmap-xxhdpi', 'mipmap-xxxhdpi')
+    for name in ('ic_launcher.png', 'ic_launcher_round.png')
+]
+
+# 清单中组件类名属性，改包名时保持不变 (dex 中的类名仍是预编译包名)
+COMPONENT_TAGS = ('application', 'activity', 'activity-alias', 'service', 'receiver', 'provider')
+CLASS_NAME_ATTRS = ('android:name', 'android:targetActivity')
+
+# 清单中的标签和属性
+TAG_RE = re.compile(r'<([\w\-]+)(\s[^<>]*?)>')
+ATTR_RE = re.compile(r'([\w:]+)="([^"]*)"')
+MAIN_ACTIVITY_RE = re.compile(r'android:name="[^"]*\.MainActivity"')
+
+# 签名相关文件，重新签名前需要移除
+SIGNATURE_FILE_RE = re.compile(r'^META-INF/([^/]+\.(SF|RSA|DSA|EC)|MANIFEST\.MF)$', re.IGNORECASE)
+
+_template_hash = None
+_priming = set()
+_priming_lock = threading.Lock()
+
+
+def template_hash():
+    """android-template 内容哈希，模板变化后旧的预编译变体自动失效"""
+    global _template_hash
+    if _template_hash is None:
+        digest = hashlib.sha256()
+        for path in sorted(TEMPLATE_DIR.rglob('*')):
+            if path.is_file():
+                digest.update(path.relative_to(TEMPLATE_DIR).as_posix().encode('utf-8'))
+                digest.update(path.read_bytes())
+        _template_hash = digest.hexdigest()
+    return _template_hash
+
+
+def variant_key(enable_fcm, fullscreen, google_login, output_format):
+    """影响源码的选项组成的变体键，不支持快速构建时返回 None
+
+    FCM 变体的资源由各自的 google-services.json 生成，AAB 需要 bundletool，
+    这两种情况走完整 Gradle 构建。
+    """
+    if not FAST_BUILD_ENABLED or enable_fcm or output_format != 'apk':
+        return None
+    return f"fs{int(bool(fullscreen))}-gl{int(bool(google_login))}"
+
+
+def variant_dir(key):
+    return VARIANT_DIR / f'{template_hash()[:12]}-v{VARIANT_VERSION}' / key
+
+
+def is_ready(key):
+    """变体是否已预编译且快速构建工具齐全"""
+    return key is not None and toolchain.get().fast_build_ready and (variant_dir(key) / 'meta.json').exists()
+
+
+def claim_prime(key):
+    """登记预编译任务，已在预编译中返回 False，避免重复提交"""
+    with _priming_lock:
+        if key in _priming or is_ready(key):
+            return False
+        _priming.add(key)
+        return True
+
+
+def release_prime(key):
+    with _priming_lock:
+        _priming.discard(key)
+
+
+def is_priming(key):
+    """该变体是否正在预编译 (本进程提交的预编译任务)"""
+    with _priming_lock:
+        return key in _priming
+
+
+def prime_params(key, icon_path):
+    """预编译该变体时传给 build_apk 的规范参数"""
+    flags = key.split('-')
+    return {
+        'app_name': 'WebAPK',
+        'package_name': PREBUILT_PACKAGE,
+        'url': f'https://{PREBUILT_HOST}',
+        'icon_path': str(icon_path),
+        'fullscreen': 'fs1' in flags,
+        'google_client_id': 'PREBUILT_CLIENT_ID' if 'gl1' in flags else '',
+        'output_format': 'apk',
+        'prime_variant': key,
+    }
+
+
+def _run(cmd, env=None):
+    result = subprocess.run([str(c) for c in cmd], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise Exception(f'{Path(str(cmd[0])).name} 执行失败: {(result.stderr or result.stdout).strip()}')
+    return result
+
+
+def _glob_one(root, pattern):
+    matches = sorted(root.glob(pattern))
+    if not matches:
+        raise Exception(f'未找到构建中间产物: {pattern}')
+    return matches[0]
+
+
+def _stable_ids(r_txt, package):
+    """把 R.txt 转成 aapt2 --stable-ids 格式"""
+    lines = []
+    for line in r_txt.read_text(encoding='utf-8').splitlines():
+        parts = line.split()
+        # int string app_name 0x7f0f001c (跳过 int[] styleable 及其下标)
+        if len(parts) == 4 and parts[0] == 'int' and parts[1] != 'styleable':
+            lines.append(f'{package}:{parts[1]}/{parts[2]} = {parts[3]}')
+    return '\n'.join(lines) + '\n'
+
+
+def capture(key, build_dir):
+    """从预编译构建的产物中保存变体，build_dir 为规范参数完成的 Gradle 构建目录"""
+    intermediates = build_dir / 'app' / 'build' / 'intermediates'
+    apk = build_dir / 'app' / 'build' / 'outputs' / 'apk' / 'release' / 'app-release.apk'
+    manifest = _glob_one(intermediates, 'merged_manifest/release/**/AndroidManifest.xml')
+    r_txt = _glob_one(intermediates, 'runtime_symbol_list/release/**/R.txt')
+    flats = sorted(intermediates.glob('merged_res/release/**/*.flat'))
+    if not flats:
+        raise Exception('未找到已编译资源 (merged_res)')
+
+    target = variant_dir(key)
+    staging = target.with_name(target.name + '.tmp')
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    shutil.copy(apk, staging / 'prebuilt.apk')
+    shutil.copy(manifest, staging / 'AndroidManifest.xml')
+    (staging / 'stable-ids.txt').write_text(_stable_ids(r_txt, PREBUILT_PACKAGE), encoding='utf-8')
+    with zipfile.ZipFile(staging / 'resources.flata', 'w', zipfile.ZIP_STORED) as zf:
+        for flat in flats:
+            zf.write(flat, flat.name)
+
+    gradle_content = (build_dir / 'app' / 'build.gradle').read_text(encoding='utf-8')
+    compile_sdk = re.search(r'compileSdk (\d+)', gradle_content).group(1)
+    (staging / 'meta.json').write_text(json.dumps({
+        'variant': key,
+        'template_hash': template_hash(),
+        'compile_sdk': int(compile_sdk),
+        'resources': [flat.name for flat in flats],
+        'created_at': time.time(),
+    }, indent=2), encoding='utf-8')
+
+    if target.exists():
+        shutil.rmtree(target)
+    staging.rename(target)
+    print(f'[FAST] 变体 {key} 预编译完成，共 {len(flats)} 个资源')
+
+
+def patch_manifest(content, package_name, version_code, version_name, screen_orientation, deep_link_host):
+    """替换合并清单中的版本号、深度链接域名、屏幕方向和包名相关的属性值
+
+    manifest 的 package 属性由 aapt2 --rename-manifest-package 修改；组件类名
+    保持预编译包名 (与 dex 一致)，其余属性中的预编译包名 (FileProvider
+    authorities、动态广播权限等) 改为实际包名，避免与其他 APP 冲突。
+    """
+    content = re.sub(r'android:versionCode="[^"]*"', f'android:versionCode="{version_code}"', content)
+    content = re.sub(r'android:versionName="[^"]*"', f'android:versionName="{_xml_escape(version_name)}"', content)
+    content = content.replace(PREBUILT_HOST, _xml_escape(deep_link_host))
+
+    def patch_tag(match):
+        tag, attrs = match.group(1), match.group(2)
+
+        def patch_attr(attr_match):
+            name, value = attr_match.group(1), attr_match.group(2)
+            if tag == 'manifest' and name == 'package':
+                return attr_match.group(0)
+            if tag in COMPONENT_TAGS and name in CLASS_NAME_ATTRS:
+                return attr_match.group(0)
+            return f'{name}="{value.replace(PREBUILT_PACKAGE, package_name)}"'
+
+        attrs = ATTR_RE.sub(patch_attr, attrs)
+        if tag == 'activity' and screen_orientation != 'unspecified' and MAIN_ACTIVITY_RE.search(attrs):
+            # 与完整构建一致：屏幕方向设置在 MainActivity 上
+            end = '/' if attrs.endswith('/') else ''
+            attrs = attrs[:len(attrs) - len(end)] + f'\n            android:screenOrientation="{screen_orientation}"' + end
+        return '<' + tag + attrs + '>'
+
+    return TAG_RE.sub(patch_tag, content)
+
+
+def _xml_escape(value):
+    return (value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace('"', '&quot;'))
+
+
+def build(key, build_dir, package_name, version_code, version_name, screen_orientation, deep_link_host,
+          keystore_path, store_password, key_alias, key_password, env=None):
+    """快速构建 APK，输出到与 Gradle 相同的位置 (app/build/outputs/apk/release/app-release.apk)
+
+    build_dir 中的资源文件 (strings/colors/bools/图标) 已由 build_apk 写好。
+    """
+    source = variant_dir(key)
+    meta = json.loads((source / 'meta.json').read_text(encoding='utf-8'))
+    tools = toolchain.get()
+    if meta['compile_sdk'] != toolchain.COMPILE_SDK:
+        raise Exception(f'预编译变体的 compileSdk ({meta["compile_sdk"]}) 与当前工具链不一致')
+    res_dir = build_dir / 'app' / 'src' / 'main' / 'res'
+    output_apk = build_dir / 'app' / 'build' / 'outputs' / 'apk' / 'release' / 'app-release.apk'
+    output_apk.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix='fast_', dir=str(build_dir)) as tmp:
+        tmp = Path(tmp)
+
+        # 1. 编译变化的资源
+        overlay_dir = tmp / 'overlay'
+        overlay_dir.mkdir()
+        inputs = [res_dir / rel for rel in OVERLAY_RESOURCES if (res_dir / rel).exists()]
+        _run([tools.aapt2, 'compile', '-o', overlay_dir] + inputs, env)
+        # 不按文件名比对预编译资源：MergeResources 把 values/*.xml 合并为 values_values.arsc.flat，
+        # 与 overlay 的 values_strings.arsc.flat 等对不上。-R 按资源名覆盖，预编译中没有的资源 link 时报错
+        overlays = sorted(overlay_dir.glob('*.flat'))
+
+        # 2. 清单 + 链接资源
+        manifest = tmp / 'AndroidManifest.xml'
+        manifest.write_text(patch_manifest(
+            (source / 'AndroidManifest.xml').read_text(encoding='utf-8'),
+            package_name, version_code, version_name, screen_orientation, deep_link_host
+        ), encoding='utf-8')
+        linked = tmp / 'linked.apk'
+        cmd = [
+            tools.aapt2, 'link', '-o', linked,
+            '-I', tools.android_jar,
+            '--manifest', manifest,
+            '--stable-ids', source / 'stable-ids.txt',
+            '--rename-manifest-package', package_name,
+            source / 'resources.flata',
+        ]
+        for flat in overlays:
+            cmd += ['-R', flat]
+        _run(cmd, env)
+
+        # 3. 预编译 APK 的代码和其他文件 + 新的资源和清单
+        unsigned = tmp / 'unsigned.apk'
+        with zipfile.ZipFile(source / 'prebuilt.apk') as prebuilt, \
+                zipfile.ZipFile(linked) as resources, \
+                zipfile.ZipFile(unsigned, 'w') as out:
+            replaced = set(resources.namelist())
+            for info in resources.infolist():
+                # resources.arsc 必须不压缩 (Android 11+ 安装要求)
+                compress = zipfile.ZIP_STORED if info.filename == 'resources.arsc' else info.compress_type
+                out.writestr(_copy_info(info, compress), resources.read(info))
+            for info in prebuilt.infolist():
+                name = info.filename
+                if name in replaced or name.startswith('res/') or SIGNATURE_FILE_RE.match(name):
+                    continue
+                out.writestr(_copy_info(info, info.compress_type), prebuilt.read(info))
+
+        # 4. 对齐 + 签名
+        aligned = tmp / 'aligned.apk'
+        _run([tools.zipalign, '-p', '-f', '4', unsigned, aligned], env)
+        _run([
+            tools.apksigner, 'sign',
+            '--ks', keystore_path,
+            '--ks-pass', f'pass:{store_password}',
+            '--ks-key-alias', key_alias,
+            '--key-pass', f'pass:{key_password}',
+            '--out', output_apk,
+            aligned,
+        ], env)
+
+    return output_apk
+
+
+def _copy_info(info, compress_type):
+    new = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    new.compress_type = compress_type
+    new.external_attr = info.external_attr
+    return new
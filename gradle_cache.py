@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享 Gradle 缓存 - 所有构建共用同一个 GRADLE_USER_HOME 和本地构建缓存
+
+- GRADLE_USER_HOME: 依赖 (AndroidX、Firebase、Glide 等) 只下载解析一次。
+  Gradle 自身通过文件锁保证多个 daemon 并发访问安全。
+- 本地构建缓存: 通过 init 脚本指向共享目录，任务输入相同即命中缓存。
+  Gradle 命中缓存时会更新条目的修改时间，据此按 LRU 淘汰到容量上限以内。
+"""
+
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+CACHE_DIR = BASE_DIR / 'cache'
+
+# 共享的 Gradle 用户目录 (依赖缓存、wrapper 发行包、daemon 注册表)
+GRADLE_SHARED_HOME = Path(os.environ.get('GRADLE_SHARED_HOME', str(CACHE_DIR / 'gradle-home')))
+# 共享的本地构建缓存目录
+GRADLE_BUILD_CACHE_DIR = Path(os.environ.get('GRADLE_BUILD_CACHE_DIR', str(CACHE_DIR / 'gradle-build-cache')))
+# 构建缓存容量上限 (MB)
+GRADLE_BUILD_CACHE_MAX_MB = int(os.environ.get('GRADLE_BUILD_CACHE_MAX_MB', '5120'))
+# 最近写入的条目可能仍在被使用，淘汰时跳过 (秒)
+EVICTION_GRACE_SECONDS = 600
+
+INIT_SCRIPT_PATH = CACHE_DIR / 'build-cache.init.gradle'
+
+# > Task :app:compileReleaseKotlin FROM-CACHE
+TASK_OUTCOME_RE = re.compile(r'^> Task (\S+)(?: (UP-TO-DATE|FROM-CACHE|NO-SOURCE|SKIPPED|FAILED))?$')
+# 42 actionable tasks: 10 executed, 30 from cache, 2 up-to-date
+SUMMARY_RE = re.compile(r'^(\d+) actionable tasks?: (.*)$')
+
+_eviction_lock = threading.Lock()
+_totals_lock = threading.Lock()
+_totals = {'builds': 0, 'executed': 0, 'from_cache': 0, 'up_to_date': 0}
+
+
+def setup():
+    """创建共享目录并写入 init 脚本，服务启动时调用一次"""
+    GRADLE_SHARED_HOME.mkdir(parents=True, exist_ok=True)
+    GRADLE_BUILD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_dir = GRADLE_BUILD_CACHE_DIR.as_posix()
+    INIT_SCRIPT_PATH.write_text(f'''// 由 gradle_cache.py 生成，请勿手动修改
+settingsEvaluated {{ settings ->
+    settings.buildCache {{
+        local {{
+            enabled = true
+            directory = new File('{cache_dir}')
+        }}
+    }}
+}}
+''', encoding='utf-8')
+
+
+def gradle_args():
+    """启用共享构建缓存的 gradlew 参数"""
+    return ['--build-cache', '--console=plain', '--init-script', str(INIT_SCRIPT_PATH)]
+
+
+def apply_env(env):
+    """在子进程环境变量中设置共享的 GRADLE_USER_HOME"""
+    env['GRADLE_USER_HOME'] = str(GRADLE_SHARED_HOME)
+    return env
+
+
+class CacheStats:
+    """从 Gradle 输出中统计单次构建的缓存命中情况"""
+
+    def __init__(self):
+        self.executed = 0
+        self.from_cache = 0
+        self.up_to_date = 0
+        self.summary = None
+
+    def feed(self, line):
+        match = TASK_OUTCOME_RE.match(line)
+        if match:
+            outcome = match.group(2)
+            if outcome is None:
+                self.executed += 1
+            elif outcome == 'FROM-CACHE':
+                self.from_cache += 1
+            elif outcome == 'UP-TO-DATE':
+                self.up_to_date += 1
+            return
+        match = SUMMARY_RE.match(line)
+        if match:
+            # 以 Gradle 汇总行为准
+            self.summary = {'actionable': int(match.group(1))}
+            for part in match.group(2).split(','):
+                count, _, name = part.strip().partition(' ')
+                if count.isdigit():
+                    self.summary[name.replace('-', '_').replace(' ', '_')] = int(count)
+
+    def as_dict(self):
+        executed = self.executed
+        from_cache = self.from_cache
+        up_to_date = self.up_to_date
+        if self.summary:
+            executed = self.summary.get('executed', executed)
+            from_cache = self.summary.get('from_cache', from_cache)
+            up_to_date = self.summary.get('up_to_date', up_to_date)
+        cacheable = executed + from_cache
+        return {
+            'executed': executed,
+            'from_cache': from_cache,
+            'up_to_date': up_to_date,
+            'hit_rate': round(from_cache / cacheable, 3) if cacheable else 0.0,
+        }
+
+    def record(self):
+        """计入全局统计并返回本次构建的统计结果"""
+        result = self.as_dict()
+        with _totals_lock:
+            _totals['builds'] += 1
+            _totals['executed'] += result['executed']
+            _totals['from_cache'] += result['from_cache']
+            _totals['up_to_date'] += result['up_to_date']
+        return result
+
+
+def stats():
+    """全局缓存统计"""
+    with _totals_lock:
+        result = dict(_totals)
+    cacheable = result['executed'] + result['from_cache']
+    result['hit_rate'] = round(result['from_cache'] / cacheable, 3) if cacheable else 0.0
+    result['size_mb'] = round(_cache_size() / (1024 * 1024), 1)
+    return result
+
+
+def _cache_entries():
+    try:
+        return [e for e in os.scandir(GRADLE_BUILD_CACHE_DIR) if e.is_file() and not e.name.endswith(('.lock', '.properties'))]
+    except OSError:
+        return []
+
+
+def _cache_size():
+    return sum(e.stat().st_size for e in _cache_entries())
+
+
+def evict():
+    """按最近使用时间淘汰构建缓存条目，直到总大小不超过上限"""
+    if not _eviction_lock.acquire(blocking=False):
+        return 0
+    try:
+        limit = GRADLE_BUILD_CACHE_MAX_MB * 1024 * 1024
+        entries = []
+        for e in _cache_entries():
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= limit:
+            return 0
+
+        removed = 0
+        now = time.time()
+        for mtime, size, path in sorted(entries):
+            if total <= limit:
+                break
+            if now - mtime < EVICTION_GRACE_SECONDS:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        print(f'[CACHE] 构建缓存淘汰 {removed} 个条目，当前 {total // (1024 * 1024)}MB')
+        return removed
+    finally:
+        _eviction_lock.release()
+
+
+def schedule_eviction():
+    """在后台线程中执行淘汰，不阻塞构建"""
+    threading.Thread(target=evict, name='gradle-cache-evict', daemon=True).start()
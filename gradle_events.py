@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gradle 结构化进度 - init 脚本输出任务开始/结束事件，构建按任务计算进度
+
+init 脚本在任务图就绪时输出任务总数，每个任务开始和结束时输出一行
+`##WEB2APK {json}`，构建循环据此计算真实的完成比例、各任务耗时和失败
+的任务，不再对每行输出做关键字匹配。
+
+完整的 Gradle 输出写入每个构建单独的日志文件 (logs/builds/<build_id>.log)，
+不保留在进程内存中，也不再打印到终端；单个日志超过 BUILD_LOG_MAX_MB 后
+截断，日志目录只保留最近 BUILD_LOG_KEEP 个。
+"""
+
+import json
+import os
+import re
+import threading
+from collections import deque
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+# 构建日志目录
+BUILD_LOG_DIR = Path(os.environ.get('BUILD_LOG_DIR', str(BASE_DIR / 'logs' / 'builds')))
+# 保留的构建日志数
+BUILD_LOG_KEEP = int(os.environ.get('BUILD_LOG_KEEP', '200'))
+# 单个构建日志的大小上限 (MB)
+BUILD_LOG_MAX_MB = int(os.environ.get('BUILD_LOG_MAX_MB', '20'))
+
+INIT_SCRIPT_PATH = BASE_DIR / 'cache' / 'build-events.init.gradle'
+EVENT_PREFIX = '##WEB2APK '
+
+# 编译器错误行：Kotlin (e: ...)、javac / aapt2 (error: ...)、AGP (ERROR: ...)
+COMPILER_ERROR_RE = re.compile(r'^(e: |ERROR:|.*\berror: )')
+
+# 任务名 -> 进度文案，按顺序匹配
+TASK_STAGES = (
+    (re.compile(r'compile\w*Kotlin|compile\w*JavaWithJavac'), '编译源码'),
+    (re.compile(r'dex|Dex'), '生成 dex'),
+    (re.compile(r'Resources|Manifest|Assets|process\w*GoogleServices'), '处理资源'),
+    (re.compile(r'^(package|bundle|sign|zipalign)'), '打包'),
+    (re.compile(r'minify|shrink|R8', re.IGNORECASE), '代码压缩'),
+)
+
+_prune_lock = threading.Lock()
+
+
+def setup():
+    """写入 init 脚本，服务启动时调用一次"""
+    INIT_SCRIPT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    BUILD_LOG_DIR.mkdir(parents=True, exist_ok=True)
+    INIT_SCRIPT_PATH.write_text(f'''// 由 gradle_events.py 生成，请勿手动修改
+import groovy.json.JsonOutput
+
+def emit = {{ Map event -> println('{EVENT_PREFIX}' + JsonOutput.toJson(event)) }}
+def started = [:]
+
+gradle.taskGraph.whenReady {{ graph ->
+    emit(type: 'graph', tasks: graph.allTasks.size())
+}}
+gradle.taskGraph.beforeTask {{ task ->
+    started[task.path] = System.currentTimeMillis()
+    emit(type: 'task_start', path: task.path)
+}}
+gradle.taskGraph.afterTask {{ task, state ->
+    def start = started.remove(task.path) ?: System.currentTimeMillis()
+    def failure = state.failure
+    while (failure?.cause != null) {{
+        failure = failure.cause
+    }}
+    emit(type: 'task_finish', path: task.path,
+         outcome: state.failure != null ? 'FAILED' : (state.skipMessage ?: 'EXECUTED'),
+         duration_ms: System.currentTimeMillis() - start,
+         failure: failure?.message)
+}}
+''', encoding='utf-8')
+
+
+def gradle_args():
+    """输出结构化进度事件的 gradlew 参数"""
+    return ['--init-script', str(INIT_SCRIPT_PATH)]
+
+
+def stage_label(task_path):
+    """任务路径 (:app:compileReleaseKotlin) 对应的进度文案，无法归类时返回 None"""
+    name = task_path.rsplit(':', 1)[-1]
+    for pattern, label in TASK_STAGES:
+        if pattern.search(name):
+            return label
+    return None
+
+
+class BuildLog:
+    """单个构建的日志文件"""
+
+    def __init__(self, build_id):
+        BUILD_LOG_DIR.mkdir(parents=True, exist_ok=True)
+        self.path = BUILD_LOG_DIR / f'{build_id}.log'
+        self.limit = BUILD_LOG_MAX_MB * 1024 * 1024
+        self.size = 0
+        self.truncated = False
+        self._file = open(self.path, 'w', encoding='utf-8', errors='replace')
+        prune()
+
+    def write(self, line):
+        if self.truncated:
+            return
+        data = line + '\n'
+        self.size += len(data)
+        if self.size > self.limit:
+            self.truncated = True
+            data = f'... 日志超过 {BUILD_LOG_MAX_MB} MB，之后的输出已省略\n'
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def prune():
+    """只保留最近的 BUILD_LOG_KEEP 个日志"""
+    if not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        logs = []
+        for entry in os.scandir(BUILD_LOG_DIR):
+            if entry.name.endswith('.log'):
+                try:
+                    logs.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        logs.sort(reverse=True)
+        for _, path in logs[BUILD_LOG_KEEP:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    except OSError:
+        pass
+    finally:
+        _prune_lock.release()
+
+
+class GradleProgress:
+    """解析 init 脚本输出的任务事件
+
+    feed() 返回需要推送给用户的 (文案, 百分比) 或 None。只在阶段变化或
+    进度前进至少 min_step 时推送，避免每个任务一条 SSE 消息。
+    """
+
+    def __init__(self, start_percent=40, end_percent=95, min_step=5):
+        self.start_percent = start_percent
+        self.end_percent = end_percent
+        self.min_step = min_step
+        self.total = 0
+        self.completed = 0
+        self.tasks = {}
+        self.failed_task = None
+        self.failure = None
+        self.errors = deque(maxlen=20)
+        self.tail = deque(maxlen=50)
+        self._last_label = None
+        self._last_percent = start_percent
+
+    def percent(self):
+        if not self.total:
+            return self.start_percent
+        ratio = min(1.0, self.completed / self.total)
+        return int(self.start_percent + (self.end_percent - self.start_percent) * ratio)
+
+    def feed(self, line):
+        if not line.startswith(EVENT_PREFIX):
+            self.tail.append(line)
+            if COMPILER_ERROR_RE.match(line):
+                self.errors.append(line)
+            return None
+        try:
+            event = json.loads(line[len(EVENT_PREFIX):])
+        except ValueError:
+            return None
+
+        kind = event.get('type')
+        if kind == 'graph':
+            self.total = event.get('tasks') or 0
+            self._last_label = '执行构建任务'
+            return self._report(self._last_label)
+        if kind == 'task_start':
+            # 无法归类的任务沿用上一个阶段的文案
+            label = stage_label(event.get('path', ''))
+            if label and label != self._last_label:
+                self._last_label = label
+                return self._report(label)
+            return None
+        if kind == 'task_finish':
+            self.completed += 1
+            path = event.get('path', '')
+            self.tasks[path] = (event.get('outcome'), event.get('duration_ms') or 0)
+            if event.get('outcome') == 'FAILED' and self.failed_task is None:
+                self.failed_task = path
+                self.failure = event.get('failure')
+            if self.percent() - self._last_percent >= self.min_step:
+                return self._report(self._last_label or '执行构建任务')
+        return None
+
+    def _report(self, label):
+        self._last_percent = self.percent()
+        suffix = f' ({self.completed}/{self.total})' if self.total else ''
+        return f'{label}...{suffix}', self._last_percent
+
+    def slowest(self, count=5):
+        """耗时最长的任务 [{'task', 'outcome', 'seconds'}]"""
+        ranked = sorted(self.tasks.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        return [{'task': path, 'outcome': outcome, 'seconds': round(ms / 1000, 2)}
+                for path, (outcome, ms) in ranked]
+
+    def error_message(self):
+        """构建失败时给用户看的原因：失败的任务 + 编译器错误或异常信息"""
+        detail = self.errors[0] if self.errors else self.failure
+        if not detail:
+            candidates = [l for l in self.tail if 'error' in l.lower() or 'failed' in l.lower()]
+            detail = candidates[-1] if candidates else '未知错误'
+        if self.failed_task:
+            return f'任务 {self.failed_task} 失败: {detail}'
+        return detail
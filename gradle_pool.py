@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gradle 守护进程池 - 复用常驻 Gradle daemon，避免每次构建冷启动 JVM
+
+每个槽位对应一个 Gradle daemon：槽位的 JVM 参数中带有唯一标记
+(-Dweb2apk.daemon=<进程号>.<槽位>.<代数>)，Gradle 只会把 JVM 参数完全一致
+的构建交给同一个 daemon，因此槽位与 daemon 一一对应。标记中带有创建守护
+进程池的进程号：同一主机上的多个构建节点 (包括平滑重启时仍在等待构建结束
+的旧节点) 各自使用自己的 daemon，查找 PID、回收和读取内存时不会误操作
+其他节点的 daemon (节点重启后旧 daemon 不再被选中，由空闲超时退出)。
+Gradle daemon 同一时间只执行一个构建，所以每个槽位同一时间只租给一个构建。
+
+回收方式：代数 +1 后旧 daemon 不再被选中，同时结束旧进程 (能找到 PID 时)，
+找不到的由 Gradle 的空闲超时自行退出。
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# 是否使用常驻 daemon (设为 0 时退回 --no-daemon)
+GRADLE_USE_DAEMON = os.environ.get('GRADLE_USE_DAEMON', '1') != '0'
+# 单个 daemon 的堆内存
+GRADLE_DAEMON_HEAP = os.environ.get('GRADLE_DAEMON_HEAP', '2048m')
+# 按槽位分别指定堆内存，逗号分隔 (如 3g,2g,2g)，未列出的槽位使用 GRADLE_DAEMON_HEAP
+GRADLE_DAEMON_HEAPS = [h.strip() for h in os.environ.get('GRADLE_DAEMON_HEAPS', '').split(',') if h.strip()]
+# 单个 daemon 执行多少次构建后回收
+GRADLE_DAEMON_MAX_BUILDS = int(os.environ.get('GRADLE_DAEMON_MAX_BUILDS', '50'))
+# 单个 daemon 常驻内存上限 (MB)，超过后回收
+GRADLE_DAEMON_MAX_RSS_MB = int(os.environ.get('GRADLE_DAEMON_MAX_RSS_MB', '3072'))
+# daemon 空闲多久后自行退出 (毫秒)
+GRADLE_DAEMON_IDLE_TIMEOUT_MS = int(os.environ.get('GRADLE_DAEMON_IDLE_TIMEOUT_MS', str(30 * 60 * 1000)))
+
+# daemon 异常退出时 Gradle 输出的特征文本
+DAEMON_CRASH_MARKERS = (
+    'Gradle build daemon disappeared unexpectedly',
+    'The daemon has terminated unexpectedly',
+    'Could not connect to the Gradle daemon',
+)
+
+
+def find_daemon_pid(marker):
+    """根据 JVM 参数中的标记查找 daemon 进程 PID (仅 Linux)"""
+    proc = '/proc'
+    if not os.path.isdir(proc):
+        return None
+    needle = marker.encode()
+    for entry in os.listdir(proc):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc, entry, 'cmdline'), 'rb') as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        if b'GradleDaemon' in cmdline and needle in cmdline.split(b'\0'):
+            return int(entry)
+    return None
+
+
+def parse_size_mb(value):
+    """解析 JVM 风格的内存大小 (2048m、2g、512k) 为 MB"""
+    value = value.strip().lower()
+    units = {'k': 1 / 1024, 'm': 1, 'g': 1024, 't': 1024 * 1024}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value) // (1024 * 1024)  # 无单位为字节
+
+
+def process_rss_mb(pid):
+    """读取进程常驻内存 (MB)，无法获取时返回 None"""
+    try:
+        with open(f'/proc/{pid}/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def kill_process(pid):
+    """结束进程，进程不存在时忽略"""
+    try:
+        if sys.platform == 'win32':
+            import subprocess
+            subprocess.run(['taskkill', '/F', '/PID', str(pid)], capture_output=True)
+        else:
+            import signal
+            os.kill(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def process_group_kwargs():
+    """Popen 参数：子进程作为新进程组的组长，取消时可以结束整个进程树"""
+    if sys.platform == 'win32':
+        import subprocess
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def kill_process_tree(process, timeout=10):
+    """结束 process_group_kwargs() 启动的进程及其所有子进程
+
+    使用 daemon 时被结束的是 Gradle 客户端，daemon 发现客户端断开后会自行
+    取消正在执行的构建，daemon 本身继续复用。
+    """
+    if process.poll() is not None:
+        return
+    try:
+        if sys.platform == 'win32':
+            import subprocess
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+        else:
+            import signal
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(timeout)
+            except Exception:
+                os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def kill_on_cancel(process, cancel_event, timeout=None):
+    """后台监视 process：cancel_event 置位或运行超过 timeout 秒时结束其进程树
+
+    返回 timed_out 事件 (因超时被结束时置位)；进程退出后监视线程自动结束。
+    """
+    timed_out = threading.Event()
+    if cancel_event is None and not timeout:
+        return timed_out
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def watch():
+        while process.poll() is None:
+            if cancel_event is not None and cancel_event.wait(0.5):
+                kill_process_tree(process)
+                return
+            if cancel_event is None:
+                time.sleep(0.5)
+            if deadline is not None and time.monotonic() > deadline:
+                timed_out.set()
+                kill_process_tree(process)
+                return
+
+    threading.Thread(target=watch, name=f'build-watch-{process.pid}', daemon=True).start()
+    return timed_out
+
+
+class DaemonSlot:
+    """守护进程槽位"""
+
+    def __init__(self, index, owner):
+        self.index = index
+        self.owner = owner
+        self.generation = 0
+        self.builds = 0
+        self.busy = False
+        self.unhealthy = False
+        self.last_used = None
+
+    @property
+    def marker(self):
+        return f'-Dweb2apk.daemon={self.owner}.{self.index}.{self.generation}'
+
+    @property
+    def heap(self):
+        """该槽位的堆内存 (覆盖 gradle.properties 中的 -Xmx)"""
+        if self.index < len(GRADLE_DAEMON_HEAPS):
+            return GRADLE_DAEMON_HEAPS[self.index]
+        return GRADLE_DAEMON_HEAP
+
+    def jvm_args(self):
+        """该槽位 daemon 的 JVM 参数"""
+        return f'-Xmx{self.heap} -Dfile.encoding=UTF-8 {self.marker}'
+
+    def memory_cost_mb(self, overhead_mb):
+        """本次构建预计新增的内存：热 daemon 已占用的部分不再重复计算"""
+        heap_mb = parse_size_mb(self.heap)
+        pid = self.pid()
+        rss = process_rss_mb(pid) if pid else None
+        if rss is not None:
+            heap_mb = max(heap_mb - rss, 0)
+        return heap_mb + overhead_mb
+
+    def gradle_args(self):
+        """传给 gradlew 的命令行参数"""
+        if not GRADLE_USE_DAEMON:
+            return ['--no-daemon', f'-Dorg.gradle.jvmargs=-Xmx{self.heap} -Dfile.encoding=UTF-8']
+        return [
+            '--daemon',
+            f'-Dorg.gradle.jvmargs={self.jvm_args()}',
+            f'-Dorg.gradle.daemon.idletimeout={GRADLE_DAEMON_IDLE_TIMEOUT_MS}',
+        ]
+
+    def pid(self):
+        return find_daemon_pid(self.marker) if GRADLE_USE_DAEMON else None
+
+    def check_output(self, line):
+        """检查 Gradle 输出，发现 daemon 崩溃时标记为不健康"""
+        if any(m in line for m in DAEMON_CRASH_MARKERS):
+            self.unhealthy = True
+
+
+class GradleDaemonPool:
+    """Gradle 守护进程池
+
+    slots: 槽位数，即可同时执行的 Gradle 构建数 (与构建工作线程数一致)
+    owner: 写入 daemon 标记的节点标识，默认为当前进程号
+    """
+
+    def __init__(self, slots, owner=None):
+        owner = owner if owner is not None else os.getpid()
+        self.slots = [DaemonSlot(i, owner) for i in range(max(1, slots))]
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def lease(self):
+        """租用一个空闲槽位，构建结束后自动归还"""
+        slot = self._acquire()
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                idle = [s for s in self.slots if not s.busy]
+                if idle:
+                    # 优先使用最近用过的槽位，它的 daemon 最可能是热的
+                    slot = max(idle, key=lambda s: s.last_used or 0)
+                    slot.busy = True
+                    break
+                self._cond.wait()
+        self._health_check(slot)
+        return slot
+
+    def _release(self, slot):
+        slot.builds += 1
+        slot.last_used = time.time()
+        self._health_check(slot)
+        with self._cond:
+            slot.busy = False
+            self._cond.notify()
+
+    def _health_check(self, slot):
+        """按构建次数、内存上限和崩溃标记决定是否回收 daemon"""
+        if not GRADLE_USE_DAEMON:
+            return
+        reason = None
+        pid = slot.pid()
+        if slot.unhealthy:
+            reason = 'daemon 异常'
+        elif slot.builds >= GRADLE_DAEMON_MAX_BUILDS:
+            reason = f'已执行 {slot.builds} 次构建'
+        elif pid is not None:
+            rss = process_rss_mb(pid)
+            if rss is not None and rss > GRADLE_DAEMON_MAX_RSS_MB:
+                reason = f'内存占用 {rss}MB'
+        if reason:
+            self._recycle(slot, pid, reason)
+
+    def _recycle(self, slot, pid, reason):
+        print(f'[GRADLE] 回收 daemon 槽位 {slot.index} ({reason})')
+        if pid is not None:
+            kill_process(pid)
+        slot.generation += 1
+        slot.builds = 0
+        slot.unhealthy = False
+
+    def stats(self):
+        """各槽位状态"""
+        result = []
+        for slot in self.slots:
+            pid = slot.pid()
+            result.append({
+                'slot': slot.index,
+                'generation': slot.generation,
+                'builds': slot.builds,
+                'busy': slot.busy,
+                'heap': slot.heap,
+                'pid': pid,
+                'rss_mb': process_rss_mb(pid) if pid else None,
+            })
+        return result
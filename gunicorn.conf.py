@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置 - 生产环境 (由 serve.py 使用，也可以直接 gunicorn -c gunicorn.conf.py app:app)
+
+进程结构：
+  - 主进程预加载 app (导入时编译模板插槽，when_ready 中探测工具链、计算
+    模板哈希)，之后 fork 出 SERVE_WORKERS 个 Web 进程，共享这些只读状态；
+  - Web 进程只接收请求、推送进度 (从传输层读取) 和提供下载，不执行构建；
+  - 主进程另外启动一个构建节点子进程 (worker.py --services)，执行构建并
+    运行证书池、产物和上传文件清理、异步 SSE 服务。准入控制按进程计算内存
+    预算，构建集中在一个进程中才不会超额。构建相关的状态和指标都在构建
+    节点中，Web 进程把 /stats、/metrics 转发给它 (见 node_endpoint.py)。
+
+信号：
+  - HUP：平滑重启 Web 进程；旧的构建节点停止领取新任务，等运行中的构建
+    结束后退出，同时启动新的构建节点接手排队中的任务 (加载新代码)。新旧
+    节点短时间内同时运行，各自只使用自己的 Gradle daemon (标记中带进程号，
+    见 gradle_pool.py)，不会回收或结束对方正在构建的 daemon；异步 SSE 端口
+    (SSE_ASYNC_PORT) 在 Linux 上由新旧节点同时监听 (SO_REUSEPORT)，旧节点
+    不再接受新的订阅连接，其他系统上新节点等旧节点退出后再监听；
+  - TERM：Web 进程处理完当前请求后退出 (最多 SERVE_GRACEFUL_SECONDS 秒)，
+    构建节点等运行中的构建结束 (最多 WORKER_DRAIN_SECONDS 秒) 后主进程退出。
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# 监听地址
+bind = os.environ.get('SERVE_BIND', '0.0.0.0:5000')
+# Web 进程数
+workers = int(os.environ.get('SERVE_WORKERS', str(min(4, (os.cpu_count() or 1) * 2))))
+# 每个 Web 进程的线程数；进度订阅 (SSE) 每个连接占用一个线程
+worker_class = 'gthread'
+threads = int(os.environ.get('SERVE_THREADS', '32'))
+# 平滑重启 / 退出时等待 Web 进程处理完当前请求的时间 (秒)，进度订阅断开后客户端会自动重连
+graceful_timeout = int(os.environ.get('SERVE_GRACEFUL_SECONDS', '30'))
+# 在主进程中导入 app，Web 进程 fork 后共享
+preload_app = True
+keepalive = 5
+
+# 由主进程启动构建节点子进程；构建节点单独部署时设为 0
+SERVE_BUILD_NODE = os.environ.get('SERVE_BUILD_NODE', '1') == '1'
+# 构建节点等待运行中的构建结束的最长时间 (秒)，与 worker.py 相同
+WORKER_DRAIN_SECONDS = float(os.environ.get('WORKER_DRAIN_SECONDS', '1800'))
+
+WORKER_SCRIPT = str(Path(__file__).parent / 'worker.py')
+
+
+# 构建节点子进程记录在主进程 (Arbiter) 上：HUP 时 gunicorn 会重新执行本配置文件，模块变量不保留
+def _build_node(server):
+    return getattr(server, 'build_node', None)
+
+
+def _start_build_node(server):
+    # 独立的进程组：终端 Ctrl+C 只发给主进程，由主进程通知构建节点，避免收到两次信号直接退出
+    server.build_node = subprocess.Popen([sys.executable, WORKER_SCRIPT, '--services'], start_new_session=True)
+    server.log.info('构建节点已启动 (pid %s)', server.build_node.pid)
+
+
+def _ensure_build_node(server):
+    """构建节点未运行 (首次启动或意外退出) 时启动"""
+    if not SERVE_BUILD_NODE:
+        return
+    node = _build_node(server)
+    if node is not None and node.poll() is None:
+        return
+    if node is not None:
+        server.log.warning('构建节点已退出 (退出码 %s)，重新启动', node.returncode)
+    _start_build_node(server)
+
+
+def when_ready(server):
+    # preload_app 时 app 已在主进程导入，fork Web 进程之前加载共享状态
+    import app
+    app.preload()
+    _ensure_build_node(server)
+
+
+def pre_fork(server, worker):
+    # gunicorn 主进程没有定时钩子，借 Web 进程 (重新) 启动的时机检查构建节点
+    _ensure_build_node(server)
+
+
+def on_reload(server):
+    # 重启后仍在等待运行中构建结束的旧节点
+    draining = [node for node in getattr(server, 'draining_nodes', []) if node.poll() is None]
+    node = _build_node(server)
+    if node is not None and node.poll() is None:
+        # 旧节点停止领取新任务，运行中的构建在旧节点上完成
+        node.send_signal(signal.SIGTERM)
+        draining.append(node)
+        server.log.info('构建节点 (pid %s) 等待运行中的构建结束后退出', node.pid)
+        server.build_node = None
+    server.draining_nodes = draining
+    _ensure_build_node(server)
+
+
+def on_exit(server):
+    nodes = list(getattr(server, 'draining_nodes', []))
+    node = _build_node(server)
+    if node is not None and node.poll() is None:
+        node.send_signal(signal.SIGTERM)
+        nodes.append(node)
+    if not nodes:
+        return
+    server.log.info('等待构建节点完成运行中的构建 (最多 %.0f 秒)...', WORKER_DRAIN_SECONDS)
+    deadline = time.monotonic() + WORKER_DRAIN_SECONDS
+    for node in nodes:
+        try:
+            node.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            # 未完成的任务在租约过期后由下次启动的构建节点重新执行
+            node.kill()
+            server.log.warning('构建节点 (pid %s) 等待超时，已结束', node.pid)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图标渲染缓存 - 按图标内容哈希缓存各尺寸的 PNG
+
+同一图标重复构建时直接把缓存的 PNG 硬链接到构建目录，不再解码和缩放。
+ic_launcher.png 和 ic_launcher_round.png 内容相同，只渲染一次，两个文件
+链接到同一个缓存文件。缓存按总字节数上限做 LRU 淘汰 (命中时更新目录
+修改时间)。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+from PIL import Image
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+# 图标缓存目录
+ICON_CACHE_DIR = Path(os.environ.get('ICON_CACHE_DIR', str(BASE_DIR / 'cache' / 'icons')))
+# 图标缓存容量上限 (MB)
+ICON_CACHE_MAX_MB = int(os.environ.get('ICON_CACHE_MAX_MB', '256'))
+
+# 每个尺寸输出的文件名
+ICON_NAMES = ('ic_launcher.png', 'ic_launcher_round.png')
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def cache_key(icon_path, sizes):
+    """图标内容 + 尺寸集合的哈希"""
+    digest = hashlib.sha256()
+    with open(icon_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(json.dumps(sorted(set(sizes))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _render(icon_path, sizes, entry_dir):
+    """渲染各尺寸 PNG 到缓存目录 (先写临时目录再改名，保证原子性)"""
+    tmp_dir = entry_dir.with_name(f'{entry_dir.name}.tmp-{uuid.uuid4().hex[:8]}')
+    tmp_dir.mkdir(parents=True)
+    try:
+        img = Image.open(icon_path)
+        # 转换为 RGBA
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        for size in sorted(set(sizes)):
+            resized = img.resize((size, size), Image.Resampling.LANCZOS)
+            resized.save(tmp_dir / f'{size}.png', 'PNG', optimize=True)
+        try:
+            tmp_dir.rename(entry_dir)
+        except OSError:
+            # 其他线程已渲染同一图标
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _link(source, target):
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def place_icons(icon_path, res_dir, icon_sizes):
+    """把图标各尺寸放入构建目录的 mipmap 文件夹
+
+    icon_sizes: {'mipmap-mdpi': 48, ...}
+    返回是否命中缓存
+    """
+    key = cache_key(icon_path, icon_sizes.values())
+    entry_dir = ICON_CACHE_DIR / key
+    hit = entry_dir.is_dir()
+    if hit:
+        # 更新访问时间，用于 LRU
+        os.utime(entry_dir)
+    else:
+        ICON_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _render(icon_path, icon_sizes.values(), entry_dir)
+
+    for folder, size in icon_sizes.items():
+        target_dir = Path(res_dir) / folder
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for name in ICON_NAMES:
+            _link(entry_dir / f'{size}.png', target_dir / name)
+
+    with _lock:
+        _stats['hits' if hit else 'misses'] += 1
+    if not hit:
+        evict()
+    return hit
+
+
+def _entry_size(entry_dir):
+    return sum(f.stat().st_size for f in entry_dir.iterdir())
+
+
+def evict():
+    """按最近使用时间淘汰，直到总大小不超过上限"""
+    limit = ICON_CACHE_MAX_MB * 1024 * 1024
+    with _lock:
+        entries = []
+        for entry in ICON_CACHE_DIR.iterdir():
+            if not entry.is_dir() or '.tmp-' in entry.name:
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, _entry_size(entry), entry))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= limit:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+    total = result['hits'] + result['misses']
+    result['hit_rate'] = round(result['hits'] / total, 3) if total else 0.0
+    return result
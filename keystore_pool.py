@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+签名证书池 - 后台预生成 PKCS12 证书，构建时直接取用
+
+keytool 生成 RSA 2048 证书需要启动 JVM，约 1 秒以上，放在构建关键路径上
+很浪费。池中证书使用统一的通用 CN (KEYSTORE_POOL_CN)，而不是应用名；
+签名校验只关心证书本身，CN 不影响安装和更新。需要 CN 为应用名时可关闭证书池。
+
+每个证书在磁盘上是一对文件：<id>.p12 和 <id>.json (密码)。json 存在才算
+可用；取用时先把 json 改名占用，多进程同时取用也不会拿到同一个证书。
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+# 是否启用证书池
+KEYSTORE_POOL_ENABLED = os.environ.get('KEYSTORE_POOL_ENABLED', '1') != '0'
+# 池中保持的证书数量 (也是磁盘上的上限)
+KEYSTORE_POOL_SIZE = int(os.environ.get('KEYSTORE_POOL_SIZE', '4'))
+# 预生成证书使用的 CN
+KEYSTORE_POOL_CN = os.environ.get('KEYSTORE_POOL_CN', 'Web2APK')
+# 证书池目录
+KEYSTORE_POOL_DIR = Path(os.environ.get('KEYSTORE_POOL_DIR', str(BASE_DIR / 'cache' / 'keystores')))
+
+# 未完成的证书文件 (没有对应 json) 超过该时间视为残留 (秒)
+STALE_SECONDS = 300
+
+
+class KeystorePool:
+    """签名证书池
+
+    generate: 生成证书的函数，签名与 generate_keystore 相同
+    password_factory: 生成随机密码的函数
+    """
+
+    def __init__(self, generate, password_factory, pool_dir=KEYSTORE_POOL_DIR, size=KEYSTORE_POOL_SIZE):
+        self.generate = generate
+        self.password_factory = password_factory
+        self.pool_dir = Path(pool_dir)
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+
+    def start(self):
+        """清理残留文件并启动后台补充线程"""
+        if not KEYSTORE_POOL_ENABLED or self.size <= 0:
+            return
+        self.pool_dir.mkdir(parents=True, exist_ok=True)
+        self._cleanup()
+        threading.Thread(target=self._refill_loop, name='keystore-pool', daemon=True).start()
+        self._refill.set()
+
+    def _entries(self):
+        """池中的证书元数据文件，按生成时间排序"""
+        entries = []
+        for path in self.pool_dir.glob('*.json'):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue  # 列出目录后被其他线程/进程取走
+        return [path for _, path in sorted(entries)]
+
+    def available(self):
+        try:
+            return len(self._entries())
+        except OSError:
+            return 0
+
+    def take(self, dest_path):
+        """取出一个证书移动到 dest_path，返回密码信息；池为空时返回 None"""
+        if not KEYSTORE_POOL_ENABLED or self.size <= 0:
+            return None
+        for meta_path in self._entries():
+            claimed = meta_path.with_name(f'{meta_path.stem}.claimed-{os.getpid()}-{threading.get_ident()}')
+            try:
+                meta_path.rename(claimed)
+            except OSError:
+                continue  # 已被其他线程/进程取走
+            try:
+                info = json.loads(claimed.read_text(encoding='utf-8'))
+                shutil.move(str(self.pool_dir / f'{meta_path.stem}.p12'), str(dest_path))
+            except (OSError, ValueError):
+                continue
+            finally:
+                claimed.unlink(missing_ok=True)
+            with self._lock:
+                self.hits += 1
+            self._refill.set()
+            return info
+
+        with self._lock:
+            self.misses += 1
+        self._refill.set()
+        return None
+
+    def _refill_loop(self):
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while self.available() < self.size:
+                if not self._generate_one():
+                    # 生成失败 (如缺少 keytool) 时稍后重试
+                    time.sleep(60)
+                    break
+
+    def _generate_one(self):
+        entry_id = uuid.uuid4().hex[:12]
+        keystore_path = self.pool_dir / f'{entry_id}.p12'
+        store_password = self.password_factory()
+        info = {
+            'store_password': store_password,
+            'key_password': store_password,
+            'key_alias': 'key0',
+            'cn': KEYSTORE_POOL_CN,
+            'created_at': time.time(),
+        }
+        try:
+            self.generate(keystore_path, KEYSTORE_POOL_CN, store_password, store_password, 'key0')
+            os.chmod(keystore_path, 0o600)
+            tmp = self.pool_dir / f'{entry_id}.json.tmp'
+            tmp.write_text(json.dumps(info), encoding='utf-8')
+            os.chmod(tmp, 0o600)
+            tmp.rename(self.pool_dir / f'{entry_id}.json')
+            return True
+        except Exception as e:
+            keystore_path.unlink(missing_ok=True)
+            with self._lock:
+                self.failures += 1
+            print(f'[KEYSTORE] 预生成证书失败: {e}')
+            return False
+
+    def _cleanup(self):
+        """删除残留的半成品，并把池裁剪到容量上限以内"""
+        now = time.time()
+        for path in self.pool_dir.iterdir():
+            if path.suffix == '.json':
+                continue
+            if path.suffix == '.p12' and (self.pool_dir / f'{path.stem}.json').exists():
+                continue
+            if now - path.stat().st_mtime > STALE_SECONDS:
+                path.unlink(missing_ok=True)
+        for meta_path in self._entries()[self.size:]:
+            meta_path.unlink(missing_ok=True)
+            (self.pool_dir / f'{meta_path.stem}.p12').unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': KEYSTORE_POOL_ENABLED and self.size > 0,
+                'available': self.available(),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'failures': self.failures,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
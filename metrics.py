@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建指标 - Prometheus 文本格式的计数器 / 仪表 / 直方图，以及单次构建剖析
+
+指标在进程内累计，/metrics 按 Prometheus 文本格式 (0.0.4) 输出，不依赖
+prometheus_client。各子系统 (队列、缓存、准入控制等) 的状态通过
+Registry.add_collector 注册的回调在抓取时读取。
+
+每个构建结束后把剖析 (各步骤耗时、Gradle 任务耗时、缓存命中、产物大小、
+失败原因) 写入 logs/profiles/<build_id>.json，可通过 /builds/<build_id>/profile
+查询，只保留最近 PROFILE_KEEP 个。
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+# 构建剖析目录
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(BASE_DIR / 'logs' / 'profiles')))
+# 保留的构建剖析数
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '500'))
+
+BUILD_ID_RE = re.compile(r'^[0-9a-f]{8}$')
+
+MB = 1024 * 1024
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: 标签应为 {self.labelnames}，实际为 {tuple(labels)}')
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def samples(self):
+        """[(名称后缀, 标签, 值)]"""
+        with self._lock:
+            return [('', key, value) for key, value in sorted(self._values.items())]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                result.append(('_bucket', key + (('le', _format_value(bound)),), cumulative))
+            result.append(('_sum', key, total))
+            result.append(('_count', key, cumulative))
+        return result
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """collector() 返回 [(名称, 类型, 说明, [(标签 dict, 值)])]，抓取时调用"""
+        self.collectors.append(collector)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f'[METRICS] 采集失败: {e}')
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+BUILD_DURATION = Histogram(
+    'web2apk_build_duration_seconds', '构建总耗时', ['outcome', 'path'],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800),
+)
+PHASE_DURATION = Histogram(
+    'web2apk_build_phase_seconds', '构建各步骤耗时', ['phase'],
+    buckets=(0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600),
+)
+GRADLE_TASK_DURATION = Histogram(
+    'web2apk_gradle_task_seconds', 'Gradle 任务耗时', ['task'],
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+QUEUE_WAIT = Histogram(
+    'web2apk_queue_wait_seconds', '任务从提交到开始执行的等待时间',
+    buckets=(0.1, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+ARTIFACT_BYTES = Histogram(
+    'web2apk_artifact_bytes', '构建产物大小', ['kind'],
+    buckets=(1 * MB, 2 * MB, 5 * MB, 10 * MB, 20 * MB, 50 * MB, 100 * MB),
+)
+BUILDS = Counter('web2apk_builds_total', '结束的构建数', ['outcome', 'path'])
+FAILURES = Counter('web2apk_build_failures_total', '失败的构建数 (按原因)', ['reason'])
+FAST_BUILD_FALLBACKS = Counter('web2apk_fast_build_fallbacks_total', '快速构建失败后回退到 Gradle 的次数', ['variant'])
+BUILDS_RUNNING = Gauge('web2apk_builds_running', '正在执行的构建数')
+BUILDS_RUNNING.set(0)
+
+
+class BuildProfile:
+    """单次构建的剖析，由 observe() 从进度事件中提取，build_apk 补充细节"""
+
+    def __init__(self, **info):
+        self.build_id = None
+        self.started_at = time.time()
+        self.info = info
+        self.path = 'gradle'
+        self.outcome = None
+        self.reason = None
+        self.message = None
+        self.step = None
+        self.timings = None
+        self.gradle = None
+        self.artifacts = {}
+        self.fast_fallback = None
+
+    def observe(self, event):
+        """处理一个进度事件"""
+        kind = event.get('type')
+        if kind == 'progress' and 'step' in event:
+            self.step = event['step']
+        elif kind == 'done' and 'duration' in event:
+            PHASE_DURATION.observe(event['duration'], phase=event['step'])
+        elif kind == 'success':
+            self.outcome = 'succeeded'
+            self.timings = event.get('timings')
+        elif kind == 'error':
+            self.outcome = 'failed'
+            # 事件未指明原因时以出错时所在的步骤作为原因
+            self.reason = event.get('reason') or self.step or 'unknown'
+            self.message = event.get('message')
+        elif kind == 'canceled':
+            self.outcome = 'canceled'
+
+    def record_gradle(self, tasks, cache, failed_task=None):
+        """tasks: {任务路径: (结果, 毫秒)}"""
+        for path, (_, ms) in tasks.items():
+            GRADLE_TASK_DURATION.observe(ms / 1000, task=path)
+        self.gradle = {
+            'cache': cache,
+            'failed_task': failed_task,
+            'tasks': [
+                {'task': path, 'outcome': outcome, 'seconds': round(ms / 1000, 3)}
+                for path, (outcome, ms) in sorted(tasks.items(), key=lambda item: item[1][1], reverse=True)
+            ],
+        }
+
+    def record_fast_fallback(self, variant, error):
+        """快速构建失败、回退到 Gradle"""
+        FAST_BUILD_FALLBACKS.inc(variant=variant)
+        self.fast_fallback = str(error)
+
+    def record_artifact(self, kind, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self.artifacts[kind] = size
+        ARTIFACT_BYTES.observe(size, kind=kind)
+
+    def finish(self):
+        """计入指标并保存剖析 (生成器被关闭时 outcome 为空，视为取消)"""
+        outcome = self.outcome or 'canceled'
+        duration = time.time() - self.started_at
+        BUILD_DURATION.observe(duration, outcome=outcome, path=self.path)
+        BUILDS.inc(outcome=outcome, path=self.path)
+        if outcome == 'failed':
+            FAILURES.inc(reason=self.reason)
+        if self.build_id is None:
+            return
+        profile = {
+            'build_id': self.build_id,
+            'started_at': self.started_at,
+            'duration': round(duration, 3),
+            'outcome': outcome,
+            'path': self.path,
+            'reason': self.reason,
+            'message': self.message,
+            'info': self.info,
+            'timings': self.timings,
+            'gradle': self.gradle,
+            'artifacts': self.artifacts,
+            'fast_fallback': self.fast_fallback,
+        }
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            target = PROFILE_DIR / f'{self.build_id}.json'
+            tmp = target.with_suffix('.tmp')
+            tmp.write_text(json.dumps(profile, ensure_ascii=False, indent=2), encoding='utf-8')
+            os.replace(tmp, target)
+        except OSError as e:
+            print(f'[METRICS] 保存构建剖析失败: {e}')
+            return
+        prune_profiles()
+
+
+def load_profile(build_id):
+    """读取构建剖析，不存在返回 None"""
+    if not BUILD_ID_RE.match(build_id):
+        return None
+    try:
+        return json.loads((PROFILE_DIR / f'{build_id}.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def prune_profiles():
+    """只保留最近的 PROFILE_KEEP 个剖析"""
+    try:
+        entries = sorted(PROFILE_DIR.glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for entry in entries[PROFILE_KEEP:]:
+        entry.unlink(missing_ok=True)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建节点状态接口 - serve.py 下 /stats、/metrics 由执行构建的节点提供
+
+gunicorn 的 Web 进程不执行构建：构建、Gradle 守护进程池、准入控制、图标
+和结果缓存、证书池以及 metrics.py 中的计数器和直方图都在构建节点子进程
+(worker.py --services) 的内存中，Web 进程自己的这些状态一直是空的。
+
+构建节点用同一个 Flask 应用在 127.0.0.1 的随机端口上只提供 STATUS_PATHS，
+并把地址和进程号写入 DATA_DIR/build-node.json；不执行构建的 Web 进程
+收到这些请求时转发给它。平滑重启时新节点覆盖地址文件，之后抓取的是新
+节点 (旧节点只在等待运行中的构建结束，退出时不删除新节点的地址)。
+"""
+
+import atexit
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# 构建节点对外提供的路径
+STATUS_PATHS = ('/stats', '/metrics')
+# 转发请求的超时 (秒)
+FORWARD_TIMEOUT_SECONDS = 10
+
+
+class _QuietHandler(WSGIRequestHandler):
+    """不逐条打印抓取请求"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _only_status_paths(wsgi_app):
+    """只放行 STATUS_PATHS，其余路径返回 404"""
+    def wrapped(environ, start_response):
+        if environ.get('PATH_INFO') not in STATUS_PATHS:
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return [b'']
+        return wsgi_app(environ, start_response)
+    return wrapped
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def publish(wsgi_app, address_file):
+    """在后台线程中提供状态接口，并记录地址 (构建节点调用)"""
+    server = make_server('127.0.0.1', 0, _only_status_paths(wsgi_app), threaded=True, request_handler=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name='node-endpoint', daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    pid = os.getpid()
+    tmp = address_file.with_name(f'{address_file.name}.{pid}.tmp')
+    tmp.write_text(json.dumps({'pid': pid, 'url': url}), encoding='utf-8')
+    os.replace(tmp, address_file)
+
+    def unpublish():
+        # 地址文件已被新节点覆盖时保留
+        if _read(address_file).get('pid') == pid:
+            address_file.unlink(missing_ok=True)
+
+    atexit.register(unpublish)
+    print(f'[NODE] 状态接口已启动: {url}')
+    return url
+
+
+def _read(address_file):
+    try:
+        return json.loads(address_file.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def address(address_file):
+    """构建节点状态接口地址，没有运行中的构建节点时返回 None"""
+    node = _read(address_file)
+    if not node.get('url') or not _process_alive(node.get('pid', 0)):
+        return None
+    return node['url']
+
+
+def forward(url):
+    """请求构建节点，返回 (状态码, 响应体, Content-Type)，无法连接时返回 None"""
+    try:
+        with urllib.request.urlopen(url, timeout=FORWARD_TIMEOUT_SECONDS) as resp:
+            return resp.status, resp.read(), resp.headers.get('Content-Type')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), e.headers.get('Content-Type')
+    except OSError:
+        return None
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+产物打包 - 已压缩的成员 (APK/AAB/证书) 原样存储，只压缩文本说明
+
+APK 和 AAB 本身就是 ZIP，用 ZIP_DEFLATED 再压一遍几乎不变小，却要为
+每个字节跑一次 deflate。打包时按扩展名选择压缩方式：已压缩的文件用
+ZIP_STORED 分块复制，文本用 ZIP_DEFLATED。
+
+write_zip 直接写入目标目录中的临时文件再原子重命名，下载方不会读到
+写了一半的 ZIP；stream_zip 把同样的 ZIP 按块产出，用于直接作为响应体
+(不落盘)。
+"""
+
+import os
+import shutil
+import uuid
+import zipfile
+
+# 已压缩或加密、不需要再压缩的成员
+STORED_SUFFIXES = ('.apk', '.aab', '.zip', '.keystore', '.jks', '.p12', '.png', '.jpg', '.webp')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def compress_type(arcname):
+    return zipfile.ZIP_STORED if arcname.lower().endswith(STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+
+
+def _write_members(zf, members):
+    """写入成员，每写完一块产出一次 (供 stream_zip 及时取走数据)
+
+    members: [(ZIP 内路径, 文件路径或 str/bytes 内容)]
+    """
+    for arcname, source in members:
+        if isinstance(source, (str, bytes)):
+            data = source.encode('utf-8') if isinstance(source, str) else source
+            zf.writestr(arcname, data, compress_type=compress_type(arcname))
+            yield
+            continue
+        zinfo = zipfile.ZipInfo.from_file(source, arcname)
+        zinfo.compress_type = compress_type(arcname)
+        with open(source, 'rb') as src, zf.open(zinfo, 'w', force_zip64=zinfo.file_size > 0x7FFFFFFF) as dest:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                dest.write(chunk)
+                yield
+
+
+def write_zip(dest_path, members):
+    """写入 ZIP (临时文件 + 原子重命名)，返回文件大小"""
+    dest_path = str(dest_path)
+    tmp = f'{dest_path}.tmp-{uuid.uuid4().hex[:8]}'
+    try:
+        with zipfile.ZipFile(tmp, 'w') as zf:
+            for _ in _write_members(zf, members):
+                pass
+        os.replace(tmp, dest_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(dest_path)
+
+
+def place_file(source, dest_path, copy=False):
+    """单个文件作为产物 (硬链接，跨文件系统时复制)，同样原子地出现在目标位置
+
+    copy: 源文件之后会被原地改写时 (增量构建工作区中的 Gradle 输出) 必须复制
+    """
+    dest_path = str(dest_path)
+    tmp = f'{dest_path}.tmp-{uuid.uuid4().hex[:8]}'
+    if copy:
+        shutil.copyfile(source, tmp)
+    else:
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+    os.replace(tmp, dest_path)
+    return os.path.getsize(dest_path)
+
+
+class _ChunkBuffer:
+    """不可 seek 的写入目标，zipfile 会改用数据描述符记录大小和 CRC"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(members):
+    """按块产出 ZIP 内容"""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for _ in _write_members(zf, members):
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
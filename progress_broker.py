@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进度事件分发 - 每个任务一个有界环形缓冲区，向多个订阅者扇出
+
+本进程工作线程执行的任务，事件写入 SQLite 后同时发布到这里；订阅者从
+缓冲区读取 seq 大于 Last-Event-ID 的事件 (断线重连时补发)，有新事件时
+被唤醒，不再轮询 SQLite。缓冲区没有覆盖到的旧事件、排队中的任务和其他
+进程执行的任务 (本进程收不到发布) 从事件源 (SQLite) 读取，按
+poll_interval 轮询。
+
+同时提供同步迭代 (Flask 线程) 和异步迭代 (sse_server.py 的 asyncio
+服务，一个线程承载大量空闲连接) 两种订阅方式，空闲时产出 None 作为心跳。
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 每个任务在内存中保留的事件数
+BROKER_BUFFER_EVENTS = int(os.environ.get('BROKER_BUFFER_EVENTS', '256'))
+# 任务结束后缓冲区保留多久 (秒)
+BROKER_RETENTION_SECONDS = float(os.environ.get('BROKER_RETENTION_SECONDS', '300'))
+# SSE 心跳间隔 (秒)，防止代理在 Gradle 长时间无输出时断开连接
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+
+# SSE 心跳 (注释行，客户端忽略)
+SSE_PING = ': ping\n\n'
+
+
+def sse_message(payload, event_id=None):
+    """格式化一条 SSE 消息，event_id 供客户端断线重连时作为 Last-Event-ID"""
+    data = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return data if event_id is None else f'id: {event_id}\n{data}'
+
+
+def parse_event_id(value):
+    """解析 Last-Event-ID，无效时从头开始"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Channel:
+    """单个任务的事件缓冲区和订阅者"""
+
+    def __init__(self):
+        self.buffer = deque(maxlen=BROKER_BUFFER_EVENTS)
+        self.listeners = set()
+        self.finished_at = None
+
+
+class ProgressBroker:
+    """进度事件分发
+
+    source: source(job_id, after_seq) -> (事件列表 [(seq, payload)], 是否已结束)
+    """
+
+    def __init__(self, source, poll_interval=1.0):
+        self.source = source
+        self.poll_interval = poll_interval
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, job_id, seq, payload):
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                channel = self._channels[job_id] = _Channel()
+            channel.buffer.append((seq, payload))
+            listeners = list(channel.listeners)
+        for notify in listeners:
+            notify()
+
+    def finish(self, job_id):
+        """任务结束：唤醒订阅者，缓冲区保留一段时间供重连补发"""
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                return
+            channel.finished_at = time.monotonic()
+            listeners = list(channel.listeners)
+            self._expire()
+        for notify in listeners:
+            notify()
+
+    def drop(self, job_id):
+        """任务不再由本进程执行 (失去租约后由其他节点重新执行)：清空缓冲区，
+        订阅者改为从事件源轮询"""
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                return
+            channel.buffer.clear()
+            listeners = list(channel.listeners)
+        for notify in listeners:
+            notify()
+
+    def _expire(self):
+        deadline = time.monotonic() - BROKER_RETENTION_SECONDS
+        for job_id in [j for j, c in self._channels.items()
+                       if c.finished_at is not None and c.finished_at < deadline and not c.listeners]:
+            del self._channels[job_id]
+
+    def _listen(self, job_id, notify):
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                channel = self._channels[job_id] = _Channel()
+            channel.listeners.add(notify)
+
+    def _unlisten(self, job_id, notify):
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is not None:
+                channel.listeners.discard(notify)
+                if not channel.buffer and not channel.listeners:
+                    del self._channels[job_id]
+
+    def _read_buffer(self, job_id, after_seq):
+        """从缓冲区读取，返回 (事件, 是否已结束)；缓冲区无法保证完整时返回 None"""
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None or not channel.buffer:
+                return None
+            first_seq = channel.buffer[0][0]
+            if first_seq > after_seq + 1:
+                return None  # 中间的事件已被挤出缓冲区
+            events = [(seq, payload) for seq, payload in channel.buffer if seq > after_seq]
+            return events, channel.finished_at is not None
+
+    def _is_local(self, job_id):
+        with self._lock:
+            channel = self._channels.get(job_id)
+            return channel is not None and bool(channel.buffer)
+
+    def read(self, job_id, after_seq):
+        """读取 seq 大于 after_seq 的事件，返回 (事件, 是否已结束)"""
+        result = self._read_buffer(job_id, after_seq)
+        if result is None:
+            return self.source(job_id, after_seq)
+        return result
+
+    def _wait_timeout(self, job_id, heartbeat):
+        # 本进程收不到发布的任务需要轮询事件源
+        timeout = heartbeat or SSE_HEARTBEAT_SECONDS
+        return timeout if self._is_local(job_id) else min(timeout, self.poll_interval)
+
+    def subscribe(self, job_id, after_seq=0, heartbeat=None):
+        """同步订阅：产出 (seq, payload)，空闲 heartbeat 秒产出 None，任务结束后停止"""
+        wake = threading.Event()
+        self._listen(job_id, wake.set)
+        last_heartbeat = time.monotonic()
+        try:
+            while True:
+                wake.clear()
+                events, finished = self.read(job_id, after_seq)
+                for seq, payload in events:
+                    after_seq = seq
+                    yield seq, payload
+                if events:
+                    last_heartbeat = time.monotonic()
+                if finished:
+                    return
+                wake.wait(self._wait_timeout(job_id, heartbeat))
+                if heartbeat and time.monotonic() - last_heartbeat >= heartbeat:
+                    last_heartbeat = time.monotonic()
+                    yield None
+        finally:
+            self._unlisten(job_id, wake.set)
+
+    async def subscribe_async(self, job_id, after_seq=0, heartbeat=None):
+        """异步订阅，语义同 subscribe；事件源读取放到线程池执行"""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(wake.set)
+
+        self._listen(job_id, notify)
+        last_heartbeat = time.monotonic()
+        try:
+            while True:
+                wake.clear()
+                result = self._read_buffer(job_id, after_seq)
+                if result is None:
+                    result = await loop.run_in_executor(None, self.source, job_id, after_seq)
+                events, finished = result
+                for seq, payload in events:
+                    after_seq = seq
+                    yield seq, payload
+                if events:
+                    last_heartbeat = time.monotonic()
+                if finished:
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), self._wait_timeout(job_id, heartbeat))
+                except asyncio.TimeoutError:
+                    pass
+                if heartbeat and time.monotonic() - last_heartbeat >= heartbeat:
+                    last_heartbeat = time.monotonic()
+                    yield None
+        finally:
+            self._unlisten(job_id, notify)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'jobs': len(self._channels),
+                'subscribers': sum(len(c.listeners) for c in self._channels.values()),
+                'buffered_events': sum(len(c.buffer) for c in self._channels.values()),
+            }
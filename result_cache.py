@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建结果缓存 - 相同输入直接返回已有的 ZIP，不再构建
+
+指纹覆盖所有影响产物的输入：表单字段、图标、证书文件 + 别名 + 密码、
+google-services.json、输出格式、模板哈希。缓存规则：
+  - 只缓存使用上传证书的构建。自动生成的证书每次都不同，缓存会把同一个
+    签名密钥发给不同的请求者，因此这类构建不查也不存。
+  - versionCode 按小时生成 (YYYYMMDDHH)，指纹中包含它，所以命中只发生在
+    同一小时内，返回的产物与重新构建的完全等价。
+缓存条目以交付物本身的扩展名保存 (<指纹>.zip / .apk / .aab)，命中时只返回
+扩展名与请求的交付物相同的条目。缓存按总字节数上限做 LRU 淘汰 (命中时
+更新文件修改时间)。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+# 是否启用构建结果缓存
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+# 缓存目录
+RESULT_CACHE_DIR = Path(os.environ.get('RESULT_CACHE_DIR', str(BASE_DIR / 'cache' / 'results')))
+# 缓存容量上限 (MB)
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', '2048'))
+
+# 产物格式版本，ZIP 内容或布局变化时递增，旧缓存自动失效
+CACHE_VERSION = 2
+
+# 缓存的交付物类型
+ENTRY_SUFFIXES = ('.zip', '.apk', '.aab')
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stored': 0}
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(fields, files, template_hash):
+    """计算构建输入指纹
+
+    fields: 表单字段等标量输入 (需可 JSON 序列化)
+    files: {名称: 文件路径或 None}
+    """
+    payload = {
+        'version': CACHE_VERSION,
+        'template': template_hash,
+        'fields': fields,
+        'files': {name: _file_digest(path) if path else None for name, path in files.items()},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _entry_path(key, suffix):
+    return RESULT_CACHE_DIR / f'{key}{suffix}'
+
+
+def _entries():
+    """[(修改时间, 大小, 路径)]，不含写入中的临时文件"""
+    entries = []
+    for entry in RESULT_CACHE_DIR.glob('*'):
+        if entry.suffix not in ENTRY_SUFFIXES:
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry))
+    return entries
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def lookup(key, dest_path):
+    """命中时把缓存的交付物链接到 dest_path 并返回 True (条目扩展名须与 dest_path 相同)"""
+    if not RESULT_CACHE_ENABLED or key is None:
+        return False
+    entry = _entry_path(key, Path(dest_path).suffix)
+    try:
+        _link_or_copy(entry, dest_path)
+    except FileNotFoundError:
+        with _lock:
+            _stats['misses'] += 1
+        return False
+    # 更新访问时间，用于 LRU
+    os.utime(entry)
+    with _lock:
+        _stats['hits'] += 1
+    return True
+
+
+def store(key, artifact_path):
+    """保存构建产物 (ZIP 或安装包，硬链接，不额外占用空间直到输出文件被删除)"""
+    if not RESULT_CACHE_ENABLED or key is None:
+        return
+    suffix = Path(artifact_path).suffix
+    if suffix not in ENTRY_SUFFIXES:
+        print(f'[RESULT_CACHE] 不缓存的产物类型: {artifact_path}')
+        return
+    RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    entry = _entry_path(key, suffix)
+    tmp = entry.with_name(f'{key}.tmp-{uuid.uuid4().hex[:8]}')
+    try:
+        _link_or_copy(artifact_path, tmp)
+        os.replace(tmp, entry)
+    except OSError as e:
+        tmp.unlink(missing_ok=True)
+        print(f'[RESULT_CACHE] 保存失败: {e}')
+        return
+    with _lock:
+        _stats['stored'] += 1
+    evict()
+
+
+def evict():
+    """按最近使用时间淘汰，直到总大小不超过上限"""
+    limit = RESULT_CACHE_MAX_MB * 1024 * 1024
+    with _lock:
+        entries = _entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= limit:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+    total = result['hits'] + result['misses']
+    result['enabled'] = RESULT_CACHE_ENABLED
+    result['hit_rate'] = round(result['hits'] / total, 3) if total else 0.0
+    entries = _entries() if RESULT_CACHE_DIR.exists() else []
+    result['entries'] = {suffix[1:]: sum(1 for _, _, e in entries if e.suffix == suffix) for suffix in ENTRY_SUFFIXES}
+    result['size_mb'] = round(sum(size for _, size, _ in entries) / 1024 / 1024, 1)
+    return result
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生产环境入口 - 多进程 WSGI 服务 (python app.py 是单进程的开发服务器)
+
+    python serve.py                               # 0.0.0.0:5000
+    python serve.py --bind 0.0.0.0:8000 --workers 4
+
+Linux / macOS 使用 gunicorn，进程结构、平滑重启 (kill -HUP) 和退出时等待
+运行中的构建见 gunicorn.conf.py。
+
+Windows 或未安装 gunicorn 时回退到 waitress：单进程多线程，构建在本进程
+执行；Ctrl+C / SIGTERM 后停止接收请求，等待运行中的构建结束 (最多
+WORKER_DRAIN_SECONDS 秒) 后退出。
+"""
+
+import argparse
+import os
+import signal
+import sys
+from pathlib import Path
+
+CONFIG_FILE = str(Path(__file__).parent / 'gunicorn.conf.py')
+
+
+def serve_gunicorn(args):
+    from gunicorn.app.wsgiapp import run
+
+    argv = ['gunicorn', '-c', CONFIG_FILE]
+    if args.bind:
+        argv += ['--bind', args.bind]
+    if args.workers:
+        argv += ['--workers', str(args.workers)]
+    if args.threads:
+        argv += ['--threads', str(args.threads)]
+    sys.argv = argv + ['app:app']
+    run()
+
+
+def serve_waitress(args):
+    from waitress import create_server
+
+    import app
+    from worker import WORKER_DRAIN_SECONDS
+
+    app.preload()
+    app.start_services()
+    host, _, port = (args.bind or os.environ.get('SERVE_BIND', '0.0.0.0:5000')).rpartition(':')
+    threads = args.threads or int(os.environ.get('SERVE_THREADS', '32'))
+    server = create_server(app.app, host=host or '0.0.0.0', port=int(port), threads=threads)
+
+    def handle_signal(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    print(f'[SERVE] waitress 已启动: http://{host or "0.0.0.0"}:{port} ({threads} 个线程)')
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+    queue = app.build_queue
+    print(f'[SERVE] 停止接收请求，等待 {queue.running()} 个运行中的构建结束...')
+    if queue.stop(WORKER_DRAIN_SECONDS):
+        print('[SERVE] 已退出')
+        return 0
+    print('[SERVE] 等待超时，未完成的任务将在下次启动后重新排队')
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生产环境服务')
+    parser.add_argument('--bind', help='监听地址 host:port (默认 SERVE_BIND 或 0.0.0.0:5000)')
+    parser.add_argument('--workers', type=int, help='Web 进程数 (仅 gunicorn，默认 SERVE_WORKERS)')
+    parser.add_argument('--threads', type=int, help='每个进程的线程数 (默认 SERVE_THREADS 或 32)')
+    parser.add_argument('--server', choices=('gunicorn', 'waitress'),
+                        help='WSGI 服务器 (默认 Windows 用 waitress，其他系统优先 gunicorn)')
+    args = parser.parse_args()
+
+    server = args.server
+    if server is None:
+        server = 'waitress'
+        if sys.platform != 'win32':
+            try:
+                import gunicorn  # noqa: F401
+                server = 'gunicorn'
+            except ImportError:
+                print('[SERVE] 未安装 gunicorn，使用 waitress (单进程)')
+    if server == 'gunicorn':
+        return serve_gunicorn(args)
+    return serve_waitress(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
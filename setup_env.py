@@ -274,7 +274,7 @@ echo ANDROID_HOME=%ANDROID_HOME%
     start_content = f'''@echo off
 cd /d "{BASE_DIR}"
 call set_env.bat
-python app.py
+python serve.py
 pause
 '''
     start_bat.write_text(start_content, encoding='utf-8')
@@ -288,9 +288,12 @@ def install_python_deps():
     requirements = BASE_DIR / 'requirements.txt'
     requirements.write_text('''flask>=2.0.0
 Pillow>=9.0.0
+cryptography>=36.0
+gunicorn>=21.2; sys_platform != "win32"
+waitress>=2.1
 ''', encoding='utf-8')
 
-    print("安装 Flask 和 Pillow...")
+    print("安装 Flask、Pillow 和 WSGI 服务器...")
     subprocess.run([sys.executable, '-m', 'pip', 'install', '-r', str(requirements)])
     print("Python 依赖安装完成")
 
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步 SSE 服务 - 在独立端口上用一个 asyncio 线程承载所有进度订阅连接
+
+Flask 的每个 SSE 连接占用一个请求线程，构建动辄十几分钟，大量空闲的
+订阅连接会耗尽线程。设置 SSE_ASYNC_PORT 后，首页改为从这个端口订阅
+进度：连接由单个事件循环线程持有，事件由 ProgressBroker 推送唤醒。
+
+只实现 GET /jobs/<job_id>/events (参数与 Flask 路由相同)，响应以关闭
+连接结束，不依赖第三方异步框架。与页面不同源，返回 CORS 头。
+"""
+
+import asyncio
+import errno
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from progress_broker import SSE_HEARTBEAT_SECONDS, SSE_PING, parse_event_id, sse_message
+
+# 异步 SSE 服务端口，0 表示不启用 (进度由 Flask 路由提供)
+SSE_ASYNC_PORT = int(os.environ.get('SSE_ASYNC_PORT', '0'))
+# 监听地址
+SSE_ASYNC_HOST = os.environ.get('SSE_ASYNC_HOST', '0.0.0.0')
+# 浏览器访问的地址 (如经反向代理 https://sse.example.com)，为空时使用页面主机名 + SSE_ASYNC_PORT
+SSE_PUBLIC_URL = os.environ.get('SSE_PUBLIC_URL', '').rstrip('/')
+
+# 端口被占用时重试监听的间隔 (秒)
+BIND_RETRY_SECONDS = 2
+# 与平滑重启中的旧构建节点同时监听 (仅 Linux)
+REUSE_PORT = sys.platform.startswith('linux') and hasattr(socket, 'SO_REUSEPORT')
+
+# 读取请求头的超时 (秒)
+REQUEST_TIMEOUT_SECONDS = 10
+
+JOB_EVENTS_PATH = re.compile(r'^/jobs/([0-9a-zA-Z]+)/events$')
+
+CORS_HEADERS = (
+    'Access-Control-Allow-Origin: *\r\n'
+    'Access-Control-Allow-Headers: Last-Event-ID\r\n'
+)
+
+
+def public_url(request_host, scheme='http'):
+    """首页使用的订阅地址前缀，未启用时返回空字符串 (使用同源 Flask 路由)"""
+    if SSE_PUBLIC_URL:
+        return SSE_PUBLIC_URL
+    if not SSE_ASYNC_PORT:
+        return ''
+    host = request_host.rsplit(':', 1)[0] if not request_host.endswith(']') else request_host
+    return f'{scheme}://{host}:{SSE_ASYNC_PORT}'
+
+
+class AsyncSSEServer:
+    """独立端口的进度订阅服务"""
+
+    def __init__(self, queue, host=SSE_ASYNC_HOST, port=SSE_ASYNC_PORT):
+        self.queue = queue
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self._loop = None
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        """在后台线程中启动事件循环
+
+        serve.py 平滑重启时旧构建节点仍占用端口：Linux 上用 SO_REUSEPORT 与旧节点
+        同时监听 (任一节点都能提供任意任务的进度)，其他系统等旧节点退出后再监听。
+        """
+        if self._thread is not None:
+            return
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            waiting = False
+            while True:
+                try:
+                    self._server = self._loop.run_until_complete(
+                        asyncio.start_server(self._handle, self.host, self.port, reuse_port=REUSE_PORT))
+                    break
+                except OSError as e:
+                    if e.errno != errno.EADDRINUSE:
+                        errors.append(e)
+                        started.set()
+                        return
+                    if not waiting:
+                        waiting = True
+                        print(f'[SSE] 端口 {self.port} 被占用，等待占用的进程退出...')
+                        started.set()
+                    time.sleep(BIND_RETRY_SECONDS)
+            print(f'[SSE] 异步进度服务已启动: {self.host}:{self.port}')
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='sse-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            print(f'[SSE] 无法监听 {self.host}:{self.port}: {errors[0]}')
+
+    def stop_accepting(self):
+        """不再接受新连接 (构建节点等待运行中的构建结束时)，已有的订阅继续推送"""
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+    async def _read_request(self, reader):
+        """返回 (method, target, headers)"""
+        request_line = await reader.readline()
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _handle(self, reader, writer):
+        try:
+            method, target, headers = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT_SECONDS)
+        except (ValueError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+
+        url = urlsplit(target)
+        match = JOB_EVENTS_PATH.match(url.path)
+        try:
+            if method == 'OPTIONS':
+                writer.write(f'HTTP/1.1 204 No Content\r\n{CORS_HEADERS}Connection: close\r\n\r\n'.encode())
+            elif method != 'GET' or match is None:
+                writer.write(f'HTTP/1.1 404 Not Found\r\n{CORS_HEADERS}Content-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+            else:
+                await self._serve_events(reader, writer, match.group(1), parse_qs(url.query), headers)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_events(self, reader, writer, job_id, query, headers):
+        writer.write((
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/event-stream; charset=utf-8\r\n'
+            'Cache-Control: no-cache\r\n'
+            'X-Accel-Buffering: no\r\n'
+            f'{CORS_HEADERS}'
+            'Connection: close\r\n\r\n'
+        ).encode())
+
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self.queue.get, job_id) is None:
+            writer.write(sse_message({'type': 'error', 'message': '任务不存在'}).encode())
+            return
+
+        last_event_id = headers.get('last-event-id') or query.get('last_event_id', [None])[0]
+        after_seq = parse_event_id(last_event_id)
+        cancel_on_disconnect = query.get('cancel_on_disconnect') == ['1']
+
+        self.connections += 1
+        self.queue.add_watcher(job_id)
+        finished = False
+        stream = asyncio.ensure_future(self._stream(writer, job_id, after_seq))
+        # 客户端不会再发送数据，读到 EOF 即表示已断开
+        disconnected = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait({stream, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            finished = stream.done() and not stream.cancelled() and stream.exception() is None
+        finally:
+            stream.cancel()
+            disconnected.cancel()
+            self.connections -= 1
+            self.queue.remove_watcher(job_id, cancel_on_disconnect, finished)
+
+    async def _stream(self, writer, job_id, after_seq):
+        async for item in self.queue.broker.subscribe_async(job_id, after_seq, SSE_HEARTBEAT_SECONDS):
+            if item is None:
+                writer.write(SSE_PING.encode())
+            else:
+                seq, payload = item
+                writer.write(sse_message(payload, seq).encode())
+            await writer.drain()
+
+    def stats(self):
+        return {
+            'enabled': self._thread is not None,
+            'port': self.port,
+            'connections': self.connections,
+        }
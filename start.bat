@@ -22,6 +22,6 @@ echo 按 Ctrl+C 停止服务
 echo ========================================
 echo.
 
-python app.py
+python serve.py
 
 pause
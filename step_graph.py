@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建前步骤的依赖图 - 互不依赖的步骤在线程池中并行执行
+
+build_apk 在 Gradle 之前的步骤原本依次执行，其中生成签名证书要启动
+keytool (JVM + RSA 密钥生成)，单独就要一秒以上，而处理图标、改写配置
+文件只依赖模板目录，与证书无关。按依赖关系表示为：
+
+    template ─┬─ icon
+              ├─ keystore ─┬─ signing
+              └─ config ───┘
+
+步骤的依赖全部完成后立即提交到共享线程池 (PREBUILD_THREADS 个线程，
+所有构建共用)，依赖步骤的返回值作为同名关键字参数传入 (返回 None 的依赖
+只表示先后顺序，不传入)。某个步骤出错后
+不再启动新步骤，等待运行中的步骤结束后抛出第一个错误；生成器被关闭
+(任务取消) 时同样等待运行中的步骤结束，调用方之后才能安全地删除构建目录。
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# 执行构建前步骤的线程数 (所有构建共用)
+PREBUILD_THREADS = int(os.environ.get('PREBUILD_THREADS', '8'))
+
+# 事件类型
+STEP_STARTED = 'started'
+STEP_FINISHED = 'finished'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """共享线程池 (首次使用时创建)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREBUILD_THREADS, thread_name_prefix='prebuild')
+        return _executor
+
+
+class StepFailed(Exception):
+    """步骤失败，消息直接发送给客户端；step 为失败的步骤名 (由 StepGraph 填写)"""
+
+    def __init__(self, message, step=None):
+        super().__init__(message)
+        self.step = step
+
+
+class StepGraph:
+    """步骤依赖图，步骤只能依赖已添加的步骤 (因此不会有环)"""
+
+    def __init__(self):
+        self._steps = {}
+
+    def add(self, name, fn, after=()):
+        """添加步骤：after 中的步骤全部完成后执行 fn(**{依赖名: 返回值})，返回 None 的依赖不传入"""
+        for dep in after:
+            if dep not in self._steps:
+                raise ValueError(f'步骤 {name} 依赖未定义的步骤 {dep}')
+        self._steps[name] = (fn, tuple(after))
+
+    def run(self, cancel_event=None, pool=None):
+        """执行全部步骤，产出 (事件类型, 步骤名, 单调时钟时间, 是否与其他步骤并行)
+
+        全部完成时返回 {步骤名: 返回值}，cancel_event 置位时不再启动新步骤，
+        等待运行中的步骤结束后返回 None。
+        """
+        pool = pool or executor()
+        pending = dict(self._steps)
+        results = {}
+        running = {}
+        # 开始时是否与其他步骤并行 (完成事件沿用，页面据此更新同一个进度项)
+        parallel = {}
+        completed = queue.Queue()
+        error = None
+
+        def launch(name):
+            fn, after = pending.pop(name)
+            future = pool.submit(fn, **{dep: results[dep] for dep in after if results[dep] is not None})
+            future.add_done_callback(lambda f: completed.put((name, f, time.monotonic())))
+            running[name] = future
+
+        try:
+            while True:
+                canceled = cancel_event is not None and cancel_event.is_set()
+                if error is None and not canceled:
+                    ready = [name for name, (_, after) in pending.items() if all(dep in results for dep in after)]
+                    started = time.monotonic()
+                    for name in ready:
+                        launch(name)
+                    for name in ready:
+                        parallel[name] = len(running) > 1
+                        yield STEP_STARTED, name, started, parallel[name]
+                if not running:
+                    break
+                name, future, ended = completed.get()
+                del running[name]
+                exc = future.exception()
+                if exc is not None:
+                    if isinstance(exc, StepFailed) and exc.step is None:
+                        exc.step = name
+                    error = error or exc
+                    continue
+                results[name] = future.result()
+                yield STEP_FINISHED, name, ended, parallel[name]
+        finally:
+            # 出错或生成器被关闭：未开始的步骤不再执行，等待运行中的步骤结束
+            for future in running.values():
+                future.cancel()
+            wait(list(running.values()))
+
+        if error is not None:
+            raise error
+        if pending:
+            return None
+        return results
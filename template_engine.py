@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板引擎 - 启动时编译 android-template 中需要改写的文件，构建时一次渲染
+
+模板文件本身保持为可直接编译的 Android 工程，不插入占位符；每个插槽
+(Slot) 以模板中的一段原文 (字符串或正则) 为锚点：
+  - replace: 替换锚点文本，未提供值时保留原文
+  - before / after: 在锚点前 / 后插入内容，未提供值时不插入
+
+编译时每个锚点的匹配次数必须符合预期 (默认恰好一次)，插槽之间不能重叠，
+否则抛出 TemplateError —— 模板改动导致锚点失效会在启动时暴露，而不是
+构建时静默地什么也不替换。渲染时只做一次字符串拼接，不再逐条 str.replace
+扫描整个文件。
+"""
+
+import os
+from pathlib import Path
+
+REPLACE = 'replace'
+BEFORE = 'before'
+AFTER = 'after'
+
+
+class TemplateError(Exception):
+    """模板编译或渲染错误"""
+
+
+class Slot:
+    """插槽定义
+
+    anchor: 模板原文 (str) 或已编译的正则
+    count: 锚点应匹配的次数，None 表示至少一次 (全部替换)
+    """
+
+    def __init__(self, name, anchor, mode=REPLACE, count=1):
+        if mode not in (REPLACE, BEFORE, AFTER):
+            raise ValueError(f'未知的插槽模式: {mode}')
+        self.name = name
+        self.anchor = anchor
+        self.mode = mode
+        self.count = count
+
+    def find(self, text):
+        """返回所有匹配的 (start, end)"""
+        if isinstance(self.anchor, str):
+            spans = []
+            start = text.find(self.anchor)
+            while start != -1:
+                spans.append((start, start + len(self.anchor)))
+                start = text.find(self.anchor, start + len(self.anchor))
+            return spans
+        return [m.span() for m in self.anchor.finditer(text)]
+
+
+class Template:
+    """编译后的模板：字面量片段与插槽交替排列"""
+
+    def __init__(self, name, text, slots):
+        self.name = name
+        self.slot_names = {slot.name for slot in slots}
+        if len(self.slot_names) != len(slots):
+            raise TemplateError(f'{name}: 插槽名重复')
+
+        # (start, end, 插槽名, 默认值)
+        cuts = []
+        for slot in slots:
+            spans = slot.find(text)
+            if not spans or (slot.count is not None and len(spans) != slot.count):
+                expected = '至少 1' if slot.count is None else slot.count
+                raise TemplateError(f'{name}: 插槽 {slot.name} 的锚点匹配 {len(spans)} 次，应为 {expected} 次')
+            for start, end in spans:
+                if slot.mode == REPLACE:
+                    cuts.append((start, end, slot.name, text[start:end]))
+                elif slot.mode == BEFORE:
+                    cuts.append((start, start, slot.name, ''))
+                else:
+                    cuts.append((end, end, slot.name, ''))
+        cuts.sort(key=lambda c: (c[0], c[1]))
+
+        # parts: 字面量为 str，插槽为 (插槽名, 默认值)
+        self.parts = []
+        pos = 0
+        for start, end, slot_name, default in cuts:
+            if start < pos:
+                raise TemplateError(f'{name}: 插槽 {slot_name} 与其他插槽重叠')
+            self.parts.append(text[pos:start])
+            self.parts.append((slot_name, default))
+            pos = end
+        self.parts.append(text[pos:])
+
+    def render(self, values=None):
+        values = values or {}
+        unknown = set(values) - self.slot_names
+        if unknown:
+            raise TemplateError(f'{self.name}: 未定义的插槽 {", ".join(sorted(unknown))}')
+        return ''.join(
+            part if isinstance(part, str) else values.get(part[0], part[1])
+            for part in self.parts
+        )
+
+
+class TemplateSet:
+    """一个模板目录中所有需要改写的文件
+
+    slots: {相对路径: [Slot, ...]}
+    """
+
+    def __init__(self, root, slots):
+        self.root = Path(root)
+        self.templates = {}
+        for rel_path, file_slots in slots.items():
+            text = (self.root / rel_path).read_text(encoding='utf-8')
+            self.templates[rel_path] = Template(rel_path, text, file_slots)
+
+    def __contains__(self, rel_path):
+        return rel_path in self.templates
+
+    def render(self, rel_path, values=None):
+        try:
+            template = self.templates[rel_path]
+        except KeyError:
+            raise TemplateError(f'未编译的模板: {rel_path}') from None
+        return template.render(values)
+
+    def render_to(self, rel_path, dest, values=None):
+        """渲染并写入 dest
+
+        构建目录中的模板文件可能是指向 android-template 的硬链接，
+        先删除再写入，避免改动模板本身。
+        """
+        content = self.render(rel_path, values)
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.unlink(dest)
+        except FileNotFoundError:
+            pass
+        dest.write_text(content, encoding='utf-8')
+
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板目录物化 - 用 reflink/硬链接代替 shutil.copytree
+
+模板中绝大多数文件 (gradle wrapper、布局、drawable 等) 构建时只读，
+只有 build_apk 会改写的文件需要真实复制：
+  - reflink (写时复制): 文件系统支持时 (btrfs/xfs/APFS)，所有文件都可以安全共享
+  - 硬链接: 与模板共享 inode，因此会被改写的文件必须复制，否则会改坏模板
+  - 复制: 跨设备或文件系统不支持链接时的兜底
+
+构建目录删除时先改名到回收目录，再由后台线程删除，不阻塞构建流程。
+"""
+
+import errno
+import fnmatch
+import os
+import re
+import shutil
+import sys
+import threading
+import uuid
+from pathlib import Path
+
+# Linux FICLONE ioctl
+FICLONE = 0x40049409
+
+# 各设备是否支持 reflink / 硬链接 (st_dev -> bool)
+_reflink_supported = {}
+_hardlink_supported = {}
+
+
+def _try_reflink(src, dst):
+    """尝试写时复制，不支持时返回 False (留下的空文件由调用方覆盖)"""
+    if sys.platform != 'linux':
+        return False
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM):
+                return False
+            raise
+
+
+def _compile_patterns(mutable_patterns):
+    """把通配符列表编译成一个正则"""
+    if not mutable_patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(p) for p in mutable_patterns))
+
+
+def materialize(src, dst, mutable_patterns=()):
+    """把模板目录 src 物化到 dst
+
+    mutable_patterns: 会被改写的文件 (相对路径的通配符)，硬链接模式下真实复制
+    返回统计信息 {'reflinked': n, 'linked': n, 'copied': n}
+    """
+    src = os.fspath(src)
+    dst = os.fspath(dst)
+    mutable = _compile_patterns(mutable_patterns)
+    stats = {'reflinked': 0, 'linked': 0, 'copied': 0}
+    device = os.stat(src).st_dev
+
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        if rel_root == '.':
+            rel_prefix, target_root = '', dst
+        else:
+            rel_prefix, target_root = rel_root.replace(os.sep, '/') + '/', os.path.join(dst, rel_root)
+        os.makedirs(target_root, exist_ok=True)
+
+        for name in files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+
+            if _reflink_supported.get(device, True):
+                if _try_reflink(source, target):
+                    _reflink_supported[device] = True
+                    shutil.copystat(source, target)
+                    stats['reflinked'] += 1
+                    continue
+                _reflink_supported[device] = False
+                os.remove(target)
+
+            is_mutable = mutable is not None and mutable.match(rel_prefix + name)
+            if not is_mutable and _hardlink_supported.get(device, True):
+                try:
+                    os.link(source, target)
+                    stats['linked'] += 1
+                    continue
+                except OSError:
+                    _hardlink_supported[device] = False
+
+            shutil.copy2(source, target)
+            stats['copied'] += 1
+
+    return stats
+
+
+def remove_tree(path):
+    """删除构建目录：改名到回收目录后由后台线程删除"""
+    path = Path(path)
+    if not path.exists():
+        return
+    trash_dir = path.parent / '.trash'
+    trash_dir.mkdir(exist_ok=True)
+    trash = trash_dir / f'{path.name}_{uuid.uuid4().hex[:8]}'
+    try:
+        path.rename(trash)
+    except OSError:
+        # 改名失败 (如 Windows 文件被占用) 时直接删除
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={'ignore_errors': True},
+                     name='remove-tree', daemon=True).start()
+
+
+def purge_trash(parent):
+    """清理上次运行遗留的回收目录，服务启动时调用"""
+    trash_dir = Path(parent) / '.trash'
+    if trash_dir.exists():
+        shutil.rmtree(trash_dir, ignore_errors=True)
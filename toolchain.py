@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具链注册表 - 服务启动时解析一次 JDK、keytool、Android SDK 和 build-tools
+
+构建过程中不再重复 glob 查找 JDK、复制 os.environ；子进程统一使用预先
+构造好的环境变量。工具缺失或版本不符时在启动时 (以及 /health/toolchain)
+就能发现，而不是构建到一半才失败。
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import gradle_cache
+
+BASE_DIR = Path(__file__).parent.absolute()
+TOOLS_DIR = BASE_DIR / 'tools'
+
+# 最低 JDK 版本 (Android Gradle Plugin 8.x 要求 JDK 17)
+MIN_JAVA_VERSION = 17
+# 模板使用的 compileSdk
+COMPILE_SDK = 34
+
+EXE = '.exe' if sys.platform == 'win32' else ''
+BAT = '.bat' if sys.platform == 'win32' else ''
+
+_toolchain = None
+_lock = threading.Lock()
+
+
+def _version_key(name):
+    return [int(p) if p.isdigit() else 0 for p in re.split(r'[.\-]', name)]
+
+
+def _java_major_version(java):
+    """运行 java -version 解析主版本号"""
+    try:
+        result = subprocess.run([str(java), '-version'], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None, ''
+    output = (result.stderr or result.stdout).strip()
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if not match:
+        return None, output
+    major = int(match.group(1))
+    if major == 1 and match.group(2):  # 1.8 -> 8
+        major = int(match.group(2))
+    return major, output.splitlines()[0] if output else ''
+
+
+class Toolchain:
+    """解析后的工具链"""
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self.jdk_home = None
+        self.java = None
+        self.keytool = None
+        self.java_version = None
+        self.java_version_text = ''
+        self.sdk_home = None
+        self.build_tools_version = None
+        self.aapt2 = None
+        self.zipalign = None
+        self.apksigner = None
+        self.android_jar = None
+        # 子进程环境变量，所有构建共用，调用方不要修改
+        self.env = {}
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def resolve(self):
+        self._resolve_jdk()
+        self._resolve_sdk()
+        self._build_env()
+        return self
+
+    def _resolve_jdk(self):
+        jdk_dirs = sorted((TOOLS_DIR / 'jdk').glob('jdk-*'), key=lambda d: _version_key(d.name[4:]))
+        if jdk_dirs:
+            self.jdk_home = jdk_dirs[-1]
+        elif os.environ.get('JAVA_HOME'):
+            self.jdk_home = Path(os.environ['JAVA_HOME'])
+
+        if self.jdk_home is not None:
+            self.java = self.jdk_home / 'bin' / f'java{EXE}'
+            self.keytool = self.jdk_home / 'bin' / f'keytool{EXE}'
+        else:
+            # 使用系统 PATH 中的 java/keytool
+            self.java = shutil.which('java')
+            self.keytool = shutil.which('keytool')
+
+        if not self.java or not Path(self.java).exists():
+            self.errors.append('未找到 Java，请运行 setup_env.py 安装 JDK 17')
+            return
+        if not self.keytool or not Path(self.keytool).exists():
+            self.errors.append('未找到 keytool')
+
+        self.java_version, self.java_version_text = _java_major_version(self.java)
+        if self.java_version is None:
+            self.errors.append(f'无法获取 Java 版本: {self.java_version_text or self.java}')
+        elif self.java_version < MIN_JAVA_VERSION:
+            self.errors.append(f'Java 版本过低: {self.java_version}，需要 {MIN_JAVA_VERSION}+')
+
+    def _resolve_sdk(self):
+        candidates = [TOOLS_DIR / 'android-sdk']
+        for name in ('ANDROID_HOME', 'ANDROID_SDK_ROOT'):
+            if os.environ.get(name):
+                candidates.append(Path(os.environ[name]))
+        self.sdk_home = next((c for c in candidates if c.exists()), None)
+        if self.sdk_home is None:
+            self.errors.append('未找到 Android SDK，请运行 setup_env.py 安装')
+            return
+
+        android_jar = self.sdk_home / 'platforms' / f'android-{COMPILE_SDK}' / 'android.jar'
+        if android_jar.exists():
+            self.android_jar = android_jar
+        else:
+            # Gradle 可自动下载缺失的平台，只影响快速构建
+            self.warnings.append(f'未找到 android-{COMPILE_SDK} 平台')
+
+        build_tools = sorted((d for d in (self.sdk_home / 'build-tools').glob('*') if d.is_dir()),
+                             key=lambda d: _version_key(d.name))
+        if not build_tools:
+            self.warnings.append('未找到 build-tools，快速构建不可用')
+            return
+        bt = build_tools[-1]
+        self.build_tools_version = bt.name
+        for name, filename in (('aapt2', f'aapt2{EXE}'), ('zipalign', f'zipalign{EXE}'), ('apksigner', f'apksigner{BAT}')):
+            path = bt / filename
+            if path.exists():
+                setattr(self, name, path)
+            else:
+                self.warnings.append(f'build-tools {bt.name} 中缺少 {filename}')
+
+    def _build_env(self):
+        env = os.environ.copy()
+        if self.jdk_home is not None:
+            env['JAVA_HOME'] = str(self.jdk_home)
+            env['PATH'] = str(self.jdk_home / 'bin') + os.pathsep + env.get('PATH', '')
+        if self.sdk_home is not None:
+            env['ANDROID_HOME'] = str(self.sdk_home)
+            env['ANDROID_SDK_ROOT'] = str(self.sdk_home)
+        gradle_cache.apply_env(env)
+        self.env = env
+
+    @property
+    def fast_build_ready(self):
+        """快速构建所需的工具是否齐全"""
+        return all((self.aapt2, self.zipalign, self.apksigner, self.android_jar))
+
+    def health(self):
+        return {
+            'ok': self.ok,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            'java': {
+                'home': str(self.jdk_home) if self.jdk_home else None,
+                'version': self.java_version,
+                'version_text': self.java_version_text,
+                'keytool': str(self.keytool) if self.keytool else None,
+            },
+            'android_sdk': {
+                'home': str(self.sdk_home) if self.sdk_home else None,
+                'build_tools': self.build_tools_version,
+                'android_jar': str(self.android_jar) if self.android_jar else None,
+                'fast_build_ready': self.fast_build_ready,
+            },
+            'gradle_user_home': self.env.get('GRADLE_USER_HOME'),
+        }
+
+
+def get():
+    """获取工具链 (首次调用时解析并缓存)"""
+    global _toolchain
+    if _toolchain is None:
+        with _lock:
+            if _toolchain is None:
+                _toolchain = Toolchain().resolve()
+                for error in _toolchain.errors:
+                    print(f'[TOOLCHAIN] 错误: {error}')
+                for warning in _toolchain.warnings:
+                    print(f'[TOOLCHAIN] 警告: {warning}')
+    return _toolchain
+
+
+def refresh():
+    """重新解析工具链 (如安装了新的 SDK 组件后)"""
+    global _toolchain
+    with _lock:
+        _toolchain = None
+    return get()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建任务传输层 - Web 进程 (协调端) 与构建节点之间的任务、进度事件和租约
+
+BuildQueue 通过传输层存取任务：Web 进程提交任务、读取进度、取消任务；
+构建节点 (worker.py，或 Web 进程自己的工作线程) 领取任务、写入进度、
+续约并提交结果。两端之间没有其他通道，增加构建节点不需要改动 Web 进程。
+
+租约：节点领取任务时获得 BUILD_LEASE_SECONDS 秒的租约，执行期间定期续约。
+节点崩溃或失联导致租约过期后，任意一个进程都会把任务重新排队 (最多执行
+BUILD_MAX_ATTEMPTS 次)。失去租约的节点续约时得知并结束构建，之后它写入
+的事件和结果都会被拒绝，不会与重新执行的结果混在一起。
+
+取消：排队中的任务直接标记为已取消；运行中的任务记录取消请求，执行它的
+节点在下次续约时结束构建。
+
+清理：任务和事件在产物过期后由产物清理线程删除 (prune，见 artifacts.py)。
+
+亲和性：任务可以带一个亲和键 (如 workspace:包名)，节点完成构建后用
+set_affinity 记录该键所在的节点 (持有增量构建工作区等本地状态)。带亲和键
+的任务在排队不超过 affinity_wait 秒时只由该节点领取，之后任意节点都可领取。
+
+后端：默认 SQLiteTransport，只适用于同一台机器上的多个进程：WAL 模式
+依赖本机共享内存，数据库文件放在 NFS/SMB 等网络文件系统上会损坏或死锁。
+构建节点分布在多台机器时用 BUILD_TRANSPORT=包.模块:类名 换成基于网络
+服务的实现，构造参数为数据库路径，方法与 SQLiteTransport 相同。
+"""
+
+import importlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+STATUS_CANCELED = 'canceled'
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELED)
+
+# 传输层后端：sqlite 或 包.模块:类名
+BUILD_TRANSPORT = os.environ.get('BUILD_TRANSPORT', 'sqlite')
+
+# 续约结果
+LEASE_OK = 'ok'
+LEASE_CANCEL = 'cancel'
+LEASE_LOST = 'lost'
+
+
+class SQLiteTransport:
+    """SQLite 后端 (WAL 模式，多个进程共用一个数据库文件)
+
+    领取、续约、写入事件等写操作在 BEGIN IMMEDIATE 事务中执行，多个进程
+    同时领取同一个任务时只有一个成功。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS affinity (
+                    key TEXT PRIMARY KEY,
+                    node TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+            # 租约相关的列 (旧数据库升级)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for name, declaration in (
+                ('worker_id', 'TEXT'),
+                ('lease_expires', 'REAL'),
+                ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                ('cancel_requested', 'INTEGER NOT NULL DEFAULT 0'),
+                ('affinity', 'TEXT'),
+            ):
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {name} {declaration}')
+
+    def insert(self, job_id, params, affinity=None):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, params, created_at, affinity) VALUES (?, ?, ?, ?, ?)',
+                (job_id, STATUS_QUEUED, json.dumps(params, ensure_ascii=False), time.time(), affinity)
+            )
+
+    def set_affinity(self, key, node):
+        """记录亲和键所在的节点"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO affinity (key, node, updated_at) VALUES (?, ?, ?)',
+                (key, node, time.time())
+            )
+
+    def affinity(self, key):
+        """亲和键所在的节点，没有记录返回 None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT node FROM affinity WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row['node']
+
+    def get(self, job_id):
+        """获取任务信息，不存在返回 None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def queue_position(self, job_id):
+        """任务在队列中的位置 (从 1 开始)，不在排队中返回 0"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT created_at, status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None or row['status'] != STATUS_QUEUED:
+                return 0
+            ahead = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?',
+                (STATUS_QUEUED, row['created_at'])
+            ).fetchone()[0]
+        return ahead + 1
+
+    def counts(self):
+        """各状态的任务数 {status: n}"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def statuses(self, job_ids):
+        """批量查询任务状态 {job_id: (status, result)}"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        placeholders = ','.join('?' * len(job_ids))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT id, status, result FROM jobs WHERE id IN ({placeholders})', job_ids
+            ).fetchall()
+        return {row['id']: (row['status'], row['result']) for row in rows}
+
+    def active_params(self):
+        """排队中和运行中任务的参数列表"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT params FROM jobs WHERE status IN (?, ?)', (STATUS_QUEUED, STATUS_RUNNING)
+            ).fetchall()
+        return [json.loads(row['params']) for row in rows]
+
+    def events(self, job_id, after_seq=0):
+        """获取 seq 大于 after_seq 的事件列表 [(seq, payload)]"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT seq, payload FROM events WHERE job_id = ? AND seq > ? ORDER BY seq',
+                (job_id, after_seq)
+            ).fetchall()
+        return [(row['seq'], json.loads(row['payload'])) for row in rows]
+
+    def last_event(self, job_id):
+        """最后一个事件 (seq, payload)，没有事件时返回 None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT seq, payload FROM events WHERE job_id = ? ORDER BY seq DESC LIMIT 1', (job_id,)
+            ).fetchone()
+        return (row['seq'], json.loads(row['payload'])) if row is not None else None
+
+    def append_event(self, job_id, payload, worker_id=None):
+        """写入事件，返回 seq
+
+        worker_id: 构建节点写入时指定，该节点已不再持有任务 (租约过期) 时
+        拒绝写入并返回 None
+        """
+        with self._transaction() as conn:
+            if worker_id is not None:
+                owner = conn.execute(
+                    'SELECT 1 FROM jobs WHERE id = ? AND worker_id = ? AND status = ?',
+                    (job_id, worker_id, STATUS_RUNNING)
+                ).fetchone()
+                if owner is None:
+                    return None
+            seq = conn.execute(
+                'SELECT COALESCE(MAX(seq), 0) + 1 FROM events WHERE job_id = ?', (job_id,)
+            ).fetchone()[0]
+            conn.execute(
+                'INSERT INTO events (job_id, seq, payload) VALUES (?, ?, ?)',
+                (job_id, seq, json.dumps(payload, ensure_ascii=False))
+            )
+        return seq
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接取消返回 STATUS_CANCELED，运行中的记录取消请求
+        返回 STATUS_RUNNING，已结束或不存在返回 None"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row['status'] == STATUS_QUEUED:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?',
+                    (STATUS_CANCELED, time.time(), job_id)
+                )
+                return STATUS_CANCELED
+            if row['status'] == STATUS_RUNNING:
+                conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+                return STATUS_RUNNING
+            return None
+
+    def claim(self, worker_id, lease_seconds, node=None, affinity_wait=0):
+        """领取最早排队的任务并获得租约，没有任务时返回 None
+
+        node: 领取者所在的节点；亲和键属于其他节点、排队未超过 affinity_wait
+        秒的任务留给那个节点
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            waited_before = now - affinity_wait if node is not None else float('inf')
+            row = conn.execute(
+                'SELECT jobs.id FROM jobs LEFT JOIN affinity ON affinity.key = jobs.affinity '
+                'WHERE jobs.status = ? AND (affinity.node IS NULL OR affinity.node = ? OR jobs.created_at < ?) '
+                'ORDER BY jobs.created_at LIMIT 1',
+                (STATUS_QUEUED, node, waited_before)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE jobs SET status = ?, started_at = ?, worker_id = ?, lease_expires = ?, '
+                'attempts = attempts + 1 WHERE id = ?',
+                (STATUS_RUNNING, now, worker_id, now + lease_seconds, row['id'])
+            )
+        return self.get(row['id'])
+
+    def renew(self, job_ids, worker_id, lease_seconds):
+        """续约，返回 {job_id: LEASE_OK / LEASE_CANCEL (有取消请求) / LEASE_LOST (已不属于该节点)}"""
+        result = {}
+        with self._transaction() as conn:
+            expires = time.time() + lease_seconds
+            for job_id in job_ids:
+                updated = conn.execute(
+                    'UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker_id = ? AND status = ?',
+                    (expires, job_id, worker_id, STATUS_RUNNING)
+                ).rowcount
+                if not updated:
+                    result[job_id] = LEASE_LOST
+                    continue
+                requested = conn.execute(
+                    'SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)
+                ).fetchone()[0]
+                result[job_id] = LEASE_CANCEL if requested else LEASE_OK
+        return result
+
+    def finish(self, job_id, status, result=None, worker_id=None):
+        """记录任务结果，返回是否生效 (节点已失去租约时不生效)"""
+        with self._transaction() as conn:
+            if worker_id is None:
+                query, args = 'WHERE id = ?', (job_id,)
+            else:
+                query, args = 'WHERE id = ? AND worker_id = ? AND status = ?', (job_id, worker_id, STATUS_RUNNING)
+            updated = conn.execute(
+                f'UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires = NULL {query}',
+                (status, result, time.time()) + args
+            ).rowcount
+        return bool(updated)
+
+    def prune(self, finished_before):
+        """删除在 finished_before 之前结束的任务及其事件，返回删除的任务数"""
+        with self._transaction() as conn:
+            ids = [row['id'] for row in conn.execute(
+                'SELECT id FROM jobs WHERE finished_at < ? AND status IN (?, ?, ?)',
+                (finished_before,) + FINISHED_STATUSES
+            )]
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                conn.execute(f'DELETE FROM events WHERE job_id IN ({marks})', chunk)
+                conn.execute(f'DELETE FROM jobs WHERE id IN ({marks})', chunk)
+        return len(ids)
+
+    def expire_leases(self, max_attempts):
+        """处理租约过期的运行中任务：重新排队，有取消请求的标记为已取消，
+        执行次数达到 max_attempts 的标记为失败。返回 [(job_id, 新状态)]"""
+        changed = []
+        with self._transaction() as conn:
+            now = time.time()
+            rows = conn.execute(
+                'SELECT id, attempts, cancel_requested FROM jobs '
+                'WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)',
+                (STATUS_RUNNING, now)
+            ).fetchall()
+            for row in rows:
+                if row['cancel_requested']:
+                    status = STATUS_CANCELED
+                elif row['attempts'] >= max_attempts:
+                    status = STATUS_FAILED
+                else:
+                    status = STATUS_QUEUED
+                if status == STATUS_QUEUED:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, started_at = NULL, worker_id = NULL, lease_expires = NULL '
+                        'WHERE id = ?', (status, row['id'])
+                    )
+                else:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, finished_at = ?, lease_expires = NULL WHERE id = ?',
+                        (status, now, row['id'])
+                    )
+                changed.append((row['id'], status))
+        return changed
+
+
+TRANSPORTS = {
+    'sqlite': SQLiteTransport,
+}
+
+
+def create(db_path, name=None):
+    """按 BUILD_TRANSPORT 创建传输层"""
+    name = name or BUILD_TRANSPORT
+    if name in TRANSPORTS:
+        return TRANSPORTS[name](db_path)
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError(f'未知的 BUILD_TRANSPORT: {name} (应为 {"/".join(TRANSPORTS)} 或 包.模块:类名)')
+    return getattr(importlib.import_module(module_name), class_name)(db_path)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传文件接收 - 分块写盘、入队前校验、按内容去重、任务结束后清理
+
+/build 收到的图标、证书、google-services.json 在入队前处理：
+  - 分块复制到 UPLOAD_DIR 并同时计算 sha256，超过单文件上限立即拒绝；
+    整个请求体由 Flask 的 MAX_CONTENT_LENGTH 限制 (超出返回 413)。
+  - 以内容哈希命名，同一文件重复上传只保存一份。
+  - 校验：图标只读取文件头 (格式、尺寸)；证书检查格式魔数，PKCS12 还会
+    用密码解开并核对别名；google-services.json 检查结构并确认包含本次
+    构建的包名 (否则 google-services 插件会在 Gradle 构建中途失败)。
+    校验失败抛出 UploadError，请求直接返回 400，不占用构建工作线程。
+
+清理：任务结束后以及后台定期删除没有未完成任务引用的上传文件。文件
+可能被去重复用 (重复上传会写入新文件并替换，修改时间随之更新)，修改时间
+在 UPLOAD_REAP_GRACE_SECONDS 内的文件不删除，避免与正在提交的请求竞争；
+构建很快结束时留下的文件由后台清理处理。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from PIL import Image, UnidentifiedImageError
+
+from cert_fingerprint import keystore_type, pkcs12
+
+# 整个 /build 请求体的大小上限 (MB)
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '20'))
+# 图标文件大小上限 (MB)
+ICON_MAX_MB = int(os.environ.get('UPLOAD_ICON_MAX_MB', '10'))
+# 图标尺寸范围 (像素)
+ICON_MIN_SIZE = 48
+ICON_MAX_SIZE = 4096
+ICON_FORMATS = ('PNG', 'JPEG', 'WEBP', 'GIF', 'BMP')
+# 证书和 google-services.json 大小上限 (KB)
+KEYSTORE_MAX_KB = 256
+FCM_CONFIG_MAX_KB = 512
+# 上传文件在最后一次写入 / 复用后至少保留多久 (秒)
+UPLOAD_REAP_GRACE_SECONDS = float(os.environ.get('UPLOAD_REAP_GRACE_SECONDS', '60'))
+# 后台清理间隔 (秒)
+UPLOAD_REAP_INTERVAL_SECONDS = float(os.environ.get('UPLOAD_REAP_INTERVAL_SECONDS', '600'))
+
+CHUNK_SIZE = 256 * 1024
+
+
+class UploadError(Exception):
+    """上传文件不合法"""
+
+
+def _receive(upload_dir, file_storage, max_bytes, label):
+    """分块写入临时文件并计算哈希，返回 (临时文件路径, sha256)
+
+    file_storage: 上传的 FileStorage 或任意可读文件对象 (如 ZIP 成员)
+    """
+    tmp = Path(upload_dir) / f'.{uuid.uuid4().hex}.part'
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, 'wb') as f:
+            while True:
+                chunk = file_storage.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f'{label}过大 (上限 {max_bytes // 1024} KB)')
+                digest.update(chunk)
+                f.write(chunk)
+        if size == 0:
+            raise UploadError(f'{label}为空')
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return tmp, digest.hexdigest()
+
+
+def _ingest(upload_dir, file_storage, suffix, max_bytes, label, validate):
+    """接收上传文件，validate(临时文件路径) 通过后重命名为 <sha256><suffix>
+
+    校验失败时删除临时文件；已有相同内容的文件时直接替换 (内容一致)，
+    修改时间随之更新，不会被清理。
+    """
+    tmp, digest = _receive(upload_dir, file_storage, max_bytes, label)
+    try:
+        validate(tmp)
+        target = Path(upload_dir) / f'{digest}{suffix}'
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return target
+
+
+def _check_icon(path):
+    try:
+        # 只解析文件头，不解码像素
+        with Image.open(path) as img:
+            fmt, (width, height) = img.format, img.size
+            img.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise UploadError('图标不是有效的图片文件') from None
+    if fmt not in ICON_FORMATS:
+        raise UploadError(f'不支持的图标格式: {fmt}')
+    if min(width, height) < ICON_MIN_SIZE or max(width, height) > ICON_MAX_SIZE:
+        raise UploadError(f'图标尺寸应在 {ICON_MIN_SIZE}~{ICON_MAX_SIZE} 像素之间 (当前 {width}x{height})')
+
+
+def _check_keystore(path, store_password, key_alias):
+    data = path.read_bytes()
+    kind = keystore_type(data)
+    if kind is None:
+        raise UploadError('证书文件格式无法识别 (应为 JKS 或 PKCS12)')
+    # JKS / JCEKS 需要 keytool 才能校验密码，留给构建时处理
+    if kind != 'pkcs12' or pkcs12 is None:
+        return
+    try:
+        store = pkcs12.load_pkcs12(data, store_password.encode('utf-8'))
+    except (ValueError, TypeError):
+        raise UploadError('证书密码错误或证书已损坏') from None
+    # keytool 的别名就是私钥条目的 friendly name (不区分大小写)
+    name = store.cert.friendly_name if store.cert is not None else None
+    if name is not None and name.decode('utf-8', 'replace').lower() != key_alias.lower():
+        raise UploadError(f'证书中没有别名为 {key_alias} 的密钥 (实际为 {name.decode("utf-8", "replace")})')
+
+
+def _check_fcm_config(path, package_name):
+    try:
+        config = json.loads(path.read_text(encoding='utf-8'))
+        project_number = config['project_info']['project_number']
+        packages = [c['client_info']['android_client_info']['package_name'] for c in config['client']]
+    except ValueError:
+        raise UploadError('google-services.json 不是有效的 JSON 文件') from None
+    except (KeyError, TypeError) as e:
+        raise UploadError(f'google-services.json 格式不正确: 缺少 {e}') from None
+    if not project_number or not packages:
+        raise UploadError('google-services.json 中没有项目或 Android 应用信息')
+    if package_name not in packages:
+        raise UploadError(f'google-services.json 中没有包名 {package_name} (已包含: {", ".join(packages)})')
+
+
+def ingest_icon(upload_dir, file_storage):
+    return _ingest(upload_dir, file_storage, '.img', ICON_MAX_MB * 1024 * 1024, '图标文件', _check_icon)
+
+
+def ingest_keystore(upload_dir, file_storage, store_password, key_alias):
+    return _ingest(upload_dir, file_storage, '.keystore', KEYSTORE_MAX_KB * 1024, '证书文件',
+                   lambda path: _check_keystore(path, store_password, key_alias))
+
+
+def ingest_fcm_config(upload_dir, file_storage, package_name):
+    return _ingest(upload_dir, file_storage, '.json', FCM_CONFIG_MAX_KB * 1024, 'google-services.json ',
+                   lambda path: _check_fcm_config(path, package_name))
+
+
+def upload_paths(params):
+    """任务参数中引用的上传文件"""
+    paths = [params.get('icon_path'), params.get('fcm_config_path')]
+    keystore = params.get('existing_keystore')
+    if keystore:
+        paths.append(keystore.get('path'))
+    return {str(p) for p in paths if p}
+
+
+def reap(upload_dir, in_use, paths=None):
+    """删除没有被引用的上传文件
+
+    in_use: 未完成任务引用的路径集合
+    paths: 只检查这些文件 (任务结束时)，None 表示整个目录
+    返回删除的文件数
+    """
+    upload_dir = Path(upload_dir)
+    deadline = time.time() - UPLOAD_REAP_GRACE_SECONDS
+    if paths is None:
+        candidates = [entry.path for entry in os.scandir(upload_dir) if entry.is_file()]
+    else:
+        # 只处理上传目录中的文件 (预编译任务使用模板自带图标)
+        candidates = [p for p in paths if Path(p).parent == upload_dir]
+    removed = 0
+    for path in candidates:
+        if path in in_use:
+            continue
+        try:
+            if os.stat(path).st_mtime < deadline:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+class UploadReaper:
+    """定期清理上传目录的后台线程
+
+    in_use_fn: 返回未完成任务引用的上传文件路径集合
+    """
+
+    def __init__(self, upload_dir, in_use_fn):
+        self.upload_dir = upload_dir
+        self.in_use_fn = in_use_fn
+        self.reaped = 0
+        self._thread = None
+
+    def release(self, params):
+        """任务结束：删除该任务用过、且不再被其他任务引用的上传文件"""
+        try:
+            self.reaped += reap(self.upload_dir, self.in_use_fn(), upload_paths(params))
+        except Exception as e:
+            print(f'[UPLOAD] 清理失败: {e}')
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='upload-reaper', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                removed = reap(self.upload_dir, self.in_use_fn())
+                if removed:
+                    self.reaped += removed
+                    print(f'[UPLOAD] 清理 {removed} 个上传文件')
+            except Exception as e:
+                print(f'[UPLOAD] 清理失败: {e}')
+            time.sleep(UPLOAD_REAP_INTERVAL_SECONDS)
+
+    def stats(self):
+        try:
+            files = sum(1 for entry in os.scandir(self.upload_dir) if entry.is_file())
+        except OSError:
+            files = None
+        return {'files': files, 'reaped': self.reaped}
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建节点 - 独立进程领取并执行构建任务，不提供 Web 服务
+
+    BUILD_WORKERS=0 python app.py     # Web 进程：接收任务、保存上传文件、推送进度、提供下载
+    python worker.py                   # 构建节点：可以启动多个
+
+构建节点与 Web 进程通过传输层 (transport.py，默认 data/jobs.db) 交换任务、
+进度事件和结果；上传文件和构建产物在 uploads/、output/ 目录中。默认的
+SQLite 传输层只支持同一台机器上的进程 (数据库不能放在网络文件系统上)；
+构建节点放在多台机器上时需要用 BUILD_TRANSPORT 换成其他传输层，并用
+UPLOAD_DIR、OUTPUT_DIR 把上传文件和产物目录指向共享存储。
+
+节点崩溃时，它领取的任务在租约 (BUILD_LEASE_SECONDS) 过期后由其他进程
+重新排队。收到 SIGTERM / Ctrl+C 时停止领取新任务，等待运行中的构建结束
+(最多 WORKER_DRAIN_SECONDS 秒) 后退出；再次收到信号立即退出。
+
+准入控制按进程计算内存预算，同一台机器建议只运行一个构建节点，用
+--concurrency 调整并发构建数 (serve.py 平滑重启时新旧节点会短暂同时运行，
+Gradle daemon 按节点区分，互不影响)。
+
+--services 时同时运行产物和上传文件清理、异步 SSE 服务 (serve.py 的
+Web 进程不运行这些后台服务，由它启动的构建节点负责)，并在本机随机端口上
+提供 /stats、/metrics，Web 进程收到这两个请求时转发过来 (见 node_endpoint.py)。
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+
+# 等待运行中的构建结束的最长时间 (秒)
+WORKER_DRAIN_SECONDS = float(os.environ.get('WORKER_DRAIN_SECONDS', '1800'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='构建节点')
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='同时执行的构建数 (默认按 BUILD_WORKERS 或本机 CPU 和内存计算)')
+    parser.add_argument('--services', action='store_true',
+                        help='同时运行产物和上传文件清理、异步 SSE 服务')
+    args = parser.parse_args()
+
+    import app
+    from build_queue import default_worker_count
+
+    # 工具链不完整的节点会领取任务后立即失败，直接拒绝启动
+    tools = app.toolchain.get()
+    if not tools.ok:
+        print(f'[WORKER] 构建环境不可用: {"; ".join(tools.errors)}')
+        return 1
+
+    queue = app.build_queue
+    queue.workers = args.concurrency or default_worker_count() or 1
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        if stop.is_set():
+            print('[WORKER] 再次收到退出信号，立即退出 (运行中的任务将由其他节点重新执行)')
+            os._exit(1)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    if args.services:
+        app.start_services()
+        app.publish_node_endpoint()
+    else:
+        app.start_build_services()
+    print(f'[WORKER] 构建节点 {queue.worker_id} 已启动，并发构建数 {queue.workers}')
+
+    while not stop.wait(1.0):
+        pass
+
+    if args.services:
+        # 新的构建节点 (平滑重启) 接手新的进度订阅连接
+        app.sse_async_server.stop_accepting()
+    print(f'[WORKER] 停止领取新任务，等待 {queue.running()} 个运行中的构建结束...')
+    if queue.stop(WORKER_DRAIN_SECONDS):
+        print('[WORKER] 已退出')
+        return 0
+    print('[WORKER] 等待超时，未完成的任务将在租约过期后重新排队')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量构建工作区 - 同一包名的更新构建复用上一次的 Gradle 项目目录 (可选)
+
+普通构建每次物化全新的模板目录，构建完删除，Gradle 的增量编译无从发挥。
+更新构建 (上传已有证书) 的输入与该包上一次构建几乎完全相同，启用
+WORKSPACE_ENABLED=1 后：
+  - 每个包名保留一个工作区 (含 app/build、.gradle 等中间产物)；
+  - build_apk 照常在临时目录中物化模板并写入本次的图标、字符串、颜色、
+    versionCode 等，再与工作区比对，只写入内容有变化的文件、删除多余的
+    文件，未变化的文件保持原样 (修改时间不变)；
+  - Gradle 在工作区中执行，Kotlin 编译、dex、资源合并等任务只处理变化的部分。
+
+同一工作区同时只能被一个构建使用 (进程内加锁，Linux 下另加 flock 跨进程
+互斥)，正在使用时该构建改用全新目录。构建失败或被取消时删除工作区，避免
+残留的中间状态影响下次构建。工作区按最近使用时间淘汰，总大小不超过
+WORKSPACE_MAX_MB。
+
+工作区在构建节点本地：构建完成后在传输层记录包名所在的节点，该包之后的
+构建优先由这个节点领取 (见 transport.py 的亲和性，BUILD_AFFINITY_WAIT_SECONDS)。
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from template_fs import remove_tree, purge_trash as _purge_trash
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BASE_DIR = Path(__file__).parent.absolute()
+
+# 启用增量构建工作区
+WORKSPACE_ENABLED = os.environ.get('WORKSPACE_ENABLED', '0') == '1'
+# 工作区目录 (应在构建节点的本地磁盘上)
+WORKSPACE_DIR = Path(os.environ.get('WORKSPACE_DIR', str(BASE_DIR / 'cache' / 'workspaces')))
+# 工作区总大小上限 (MB)
+WORKSPACE_MAX_MB = int(os.environ.get('WORKSPACE_MAX_MB', '10240'))
+
+# Gradle 输出目录，同步时不删除
+PRESERVED_DIRS = ('.gradle', '.kotlin', 'build', 'app/build')
+# 含用户证书和密码的文件，构建结束后不留在工作区 (下次同步时重新写入)
+SECRET_FILES = ('release.keystore', 'app/build.gradle')
+META_FILE = '.workspace.json'
+LOCK_FILE = '.workspace.lock'
+
+_lock = threading.Lock()
+_in_use = set()
+_stats = {'reused': 0, 'created': 0, 'busy': 0, 'discarded': 0, 'files_written': 0, 'files_unchanged': 0}
+
+
+def affinity_key(package_name):
+    """传输层中记录工作区所在节点的键"""
+    return f'workspace:{package_name}'
+
+
+def _same_content(src, dst):
+    """文件内容是否相同：同一 inode (都硬链接自模板) 直接判定，否则比较大小和内容"""
+    try:
+        a, b = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    if (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino):
+        return True
+    if a.st_size != b.st_size:
+        return False
+    with open(src, 'rb') as f1, open(dst, 'rb') as f2:
+        while True:
+            c1, c2 = f1.read(1024 * 1024), f2.read(1024 * 1024)
+            if c1 != c2:
+                return False
+            if not c1:
+                return True
+
+
+def _preserved(rel_dir):
+    return rel_dir in PRESERVED_DIRS
+
+
+class Workspace:
+    """已加锁的工作区，用完调用 release()"""
+
+    def __init__(self, path, lock_fd, reused):
+        self.path = path
+        self.reused = reused
+        self._lock_fd = lock_fd
+
+    def sync(self, source):
+        """把 source 中的项目同步到工作区，返回 {'written': n, 'unchanged': n, 'removed': n}"""
+        source = Path(source)
+        written = unchanged = removed = 0
+        expected = set()
+        for root, dirs, files in os.walk(source):
+            rel_root = os.path.relpath(root, source)
+            rel_root = '' if rel_root == '.' else rel_root.replace(os.sep, '/')
+            target_root = self.path / rel_root
+            target_root.mkdir(parents=True, exist_ok=True)
+            expected.add(rel_root)
+            for name in files:
+                rel = f'{rel_root}/{name}' if rel_root else name
+                expected.add(rel)
+                src, dst = Path(root) / name, target_root / name
+                if _same_content(src, dst):
+                    unchanged += 1
+                    continue
+                # 写入新文件再替换：工作区中的旧文件可能与模板硬链接，不能原地改写
+                tmp = target_root / f'.{name}.sync'
+                shutil.copyfile(src, tmp)
+                shutil.copymode(src, tmp)
+                os.replace(tmp, dst)
+                written += 1
+
+        for root, dirs, files in os.walk(self.path, topdown=True):
+            rel_root = os.path.relpath(root, self.path)
+            rel_root = '' if rel_root == '.' else rel_root.replace(os.sep, '/')
+            for name in list(dirs):
+                rel = f'{rel_root}/{name}' if rel_root else name
+                if _preserved(rel):
+                    dirs.remove(name)
+                elif rel not in expected:
+                    shutil.rmtree(Path(root) / name, ignore_errors=True)
+                    dirs.remove(name)
+                    removed += 1
+            for name in files:
+                rel = f'{rel_root}/{name}' if rel_root else name
+                if rel not in expected and rel not in (META_FILE, LOCK_FILE):
+                    os.unlink(Path(root) / name)
+                    removed += 1
+
+        with _lock:
+            _stats['files_written'] += written
+            _stats['files_unchanged'] += unchanged
+        return {'written': written, 'unchanged': unchanged, 'removed': removed}
+
+    def release(self, succeeded):
+        """释放工作区：成功时记录大小和使用时间，失败时删除"""
+        try:
+            if succeeded:
+                for rel in SECRET_FILES:
+                    (self.path / rel).unlink(missing_ok=True)
+                size = sum(f.stat().st_size for f in self.path.rglob('*') if f.is_file())
+                (self.path / META_FILE).write_text(
+                    json.dumps({'size': size, 'last_used': time.time()}), encoding='utf-8'
+                )
+            else:
+                with _lock:
+                    _stats['discarded'] += 1
+                remove_tree(self.path)
+        finally:
+            _unlock(self.path, self._lock_fd)
+        if succeeded:
+            threading.Thread(target=evict, name='workspace-evict', daemon=True).start()
+
+
+def _try_lock(path):
+    """对工作区加锁，已被占用返回 None，成功返回 flock 文件描述符 (无 fcntl 时为 -1)"""
+    with _lock:
+        if path in _in_use:
+            return None
+        _in_use.add(path)
+    if fcntl is None:
+        return -1
+    path.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        with _lock:
+            _in_use.discard(path)
+        return None
+    return fd
+
+
+def _unlock(path, fd):
+    if fd is not None and fd >= 0:
+        os.close(fd)
+    with _lock:
+        _in_use.discard(path)
+
+
+def acquire(package_name, template_hash):
+    """获取包名对应的工作区，正在被其他构建使用时返回 None"""
+    path = WORKSPACE_DIR / template_hash[:12] / package_name
+    reused = (path / META_FILE).exists()
+    fd = _try_lock(path)
+    if fd is None:
+        with _lock:
+            _stats['busy'] += 1
+        return None
+    with _lock:
+        _stats['reused' if reused else 'created'] += 1
+    return Workspace(path, fd, reused)
+
+
+def purge_trash():
+    """清理上次运行遗留的回收目录 (失败或被淘汰的工作区改名到各模板目录的 .trash)，服务启动时调用"""
+    if not WORKSPACE_DIR.exists():
+        return
+    for template_dir in WORKSPACE_DIR.iterdir():
+        if template_dir.is_dir():
+            _purge_trash(template_dir)
+
+
+def _entries():
+    """[(最近使用时间, 大小, 路径)]，模板更新后旧模板的工作区也在其中"""
+    entries = []
+    if not WORKSPACE_DIR.exists():
+        return entries
+    for template_dir in WORKSPACE_DIR.iterdir():
+        if not template_dir.is_dir():
+            continue
+        for path in template_dir.iterdir():
+            try:
+                meta = json.loads((path / META_FILE).read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            entries.append((meta['last_used'], meta['size'], path))
+    return entries
+
+
+def evict():
+    """按最近使用时间淘汰工作区 (跳过正在使用的)，直到总大小不超过上限"""
+    limit = WORKSPACE_MAX_MB * 1024 * 1024
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        fd = _try_lock(path)
+        if fd is None:
+            continue
+        try:
+            remove_tree(path)
+        finally:
+            _unlock(path, fd)
+        total -= size
+        print(f'[WORKSPACE] 淘汰工作区 {path.name}')
+
+
+def stats():
+    entries = _entries()
+    with _lock:
+        result = dict(_stats)
+    result['enabled'] = WORKSPACE_ENABLED
+    result['workspaces'] = len(entries)
+    result['size_mb'] = round(sum(size for _, size, _ in entries) / 1024 / 1024, 1)
+    return result